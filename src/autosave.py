@@ -0,0 +1,232 @@
+"""AUTOSAVE
+Incremental autosave of a track, so that it can be recovered after a crash.
+
+An autosave is made of two files:
+    - a session file (see session.py) with the track at some point, the
+    base
+    - a log file where each finished edit is appended as a record: the
+    modifications of the column store and the new track metadata
+Only the modified data is written, so saving after an edit does not depend
+on the track size. Records are framed with their length and a CRC, a record
+partially written during a crash is ignored. When the log gets too big, the
+base is rewritten with the current track and the log is emptied
+(compaction).
+
+Files are written by a background thread, the caller only queues the data.
+Base and log share a generation, a random number drawn for each base: a log
+which does not belong to the base (crash during a compaction, or log left
+by a former autosave of the same file) is not used.
+
+Store modifications, as logged by ColumnStore:
+    - ('write', column, start, values)
+    - ('insert', start, columns)
+    - ('delete', start, stop)
+    - ('blocks', starts, stops): reorder, concatenation of the row ranges
+    - ('astype', column, dtype)
+
+Author: alguerre
+License: MIT
+"""
+import logging
+import os
+import pickle
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+import constants as c
+import session
+from column_store import ColumnStore
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'TRKLOG\x00\x00'
+LOG_SUFFIX = '.log'
+LOG_HEADER = struct.Struct('<Q')  # generation
+RECORD_HEADER = struct.Struct('<QI')  # payload length and crc32
+
+
+def _operations_nbytes(operations: list) -> int:
+    nbytes = 0
+    for operation in operations:
+        for item in operation[1:]:
+            if isinstance(item, np.ndarray):
+                nbytes += item.nbytes
+            elif isinstance(item, dict):
+                nbytes += sum(values.nbytes for values in item.values())
+    return nbytes
+
+
+def replay(store: ColumnStore, operation: tuple):
+    """
+    Apply a logged modification to a column store.
+    :param store: ColumnStore
+    :param operation: see module documentation
+    """
+    kind = operation[0]
+
+    if kind == 'write':
+        _, column, start, values = operation
+        store.write(column, values[()] if values.ndim == 0 else values,
+                    start)
+    elif kind == 'insert':
+        store.insert(*operation[1:])
+    elif kind == 'delete':
+        store.delete(*operation[1:])
+    elif kind == 'blocks':
+        _, starts, stops = operation
+        lengths = stops - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        store.take(offsets + np.arange(lengths.sum()))
+    elif kind == 'astype':
+        _, column, dtype = operation
+        store.astype({column: dtype})
+    else:
+        raise ValueError(f'Unknown autosave operation: {kind}')
+
+
+class AutosaveJournal:
+    """
+    Writer of the autosave files.
+        - file: base session file, the log is next to it
+        - compact_size: log bytes which trigger a compaction
+        - log_size: bytes queued in the log since the last compaction
+        - generation: random number of the current base and log
+        - snapshots: number of bases written
+    """
+    def __init__(self, file: str,
+                 compact_size: float = c.autosave_compact_size):
+        self.file = file
+        self.log_file = file + LOG_SUFFIX
+        self.compact_size = compact_size
+        self.log_size = 0
+        self.generation = None
+        self.snapshots = 0
+
+        self._log = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    def needs_compaction(self, operations: list = ()) -> bool:
+        # Whether the log would be too big with these operations
+        return self.log_size + _operations_nbytes(operations) > \
+            self.compact_size
+
+    def snapshot(self, columns: dict, metadata: dict):
+        """
+        Write a new base and empty the log.
+        :param columns: arrays of the store, they must not be modified later
+        :param metadata: track metadata, see Track.save_session
+        """
+        self.log_size = 0
+        self._queue.put(('snapshot', columns, metadata))
+
+    def append(self, operations: list, metadata: dict):
+        """
+        Append an edit to the log.
+        :param operations: store modifications, see module documentation
+        :param metadata: track metadata after the edit
+        """
+        self.log_size += _operations_nbytes(operations)
+        self._queue.put(('append', operations, metadata))
+
+    def flush(self):
+        # Wait until all the queued data is written
+        self._queue.join()
+
+    def close(self, remove: bool = False):
+        """
+        Write the pending data and stop the writer.
+        :param remove: delete the autosave files, nothing is to be recovered
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self._log:
+            self._log.close()
+        if remove:
+            for file in [self.file, self.log_file]:
+                if os.path.exists(file):
+                    os.remove(file)
+
+    def _writer(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                elif task[0] == 'snapshot':
+                    self._write_snapshot(*task[1:])
+                else:
+                    self._write_record(*task[1:])
+            except Exception as e:
+                # The edit is kept in memory, only the autosave is lost
+                logger.error(f'Autosave of {self.file} failed: {e}')
+            finally:
+                self._queue.task_done()
+
+    def _write_snapshot(self, columns: dict, metadata: dict):
+        # Unique, a log left by another journal never matches
+        self.generation = int.from_bytes(os.urandom(LOG_HEADER.size),
+                                         'little')
+        self.snapshots += 1
+        session.write(self.file, columns,
+                      dict(metadata, autosave_generation=self.generation))
+
+        # New empty log, replaced at once
+        if self._log:
+            self._log.close()
+        with open(self.log_file + '.tmp', 'wb') as f:
+            f.write(MAGIC + LOG_HEADER.pack(self.generation))
+        os.replace(self.log_file + '.tmp', self.log_file)
+        self._log = open(self.log_file, 'ab')
+
+    def _write_record(self, operations: list, metadata: dict):
+        payload = pickle.dumps((operations, metadata),
+                               protocol=pickle.HIGHEST_PROTOCOL)
+        self._log.write(RECORD_HEADER.pack(len(payload),
+                                           zlib.crc32(payload)))
+        self._log.write(payload)
+        self._log.flush()
+        os.fsync(self._log.fileno())
+
+
+def recover(file: str) -> (ColumnStore, dict):
+    """
+    Rebuild the autosaved track: base session and logged edits.
+    :param file: base session file
+    :return: store and track metadata
+    """
+    columns, metadata = session.read(file)
+    store = ColumnStore.from_arrays(columns)
+
+    try:
+        log = open(file + LOG_SUFFIX, 'rb')
+    except FileNotFoundError:
+        return store, metadata
+
+    with log:
+        header = log.read(len(MAGIC) + LOG_HEADER.size)
+        generation = metadata.get('autosave_generation')
+        if generation is None or \
+                header != MAGIC + LOG_HEADER.pack(generation):
+            return store, metadata
+
+        while True:
+            record_header = log.read(RECORD_HEADER.size)
+            if len(record_header) < RECORD_HEADER.size:
+                break
+            length, crc = RECORD_HEADER.unpack(record_header)
+            payload = log.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                logger.warning(f'Incomplete autosave record in {file}')
+                break
+
+            operations, metadata = pickle.loads(payload)
+            for operation in operations:
+                replay(store, operation)
+
+    return store, metadata
@@ -0,0 +1,276 @@
+"""COLUMN_STORE
+Columnar storage made of one numpy array per column. Arrays are preallocated
+and grow geometrically, so appending data has an amortized cost proportional
+to the appended size, not to the stored one. Rows can be removed or
+reordered in place. A pandas view is provided for code working with
+dataframes.
+
+Author: alguerre
+License: MIT
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+GROWTH_FACTOR = 1.5
+MIN_CAPACITY = 1024
+
+
+def _fill_value(dtype: np.dtype):
+    # Value for missing data according to the column type
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'f':
+        return np.nan
+    elif dtype.kind == 'M':
+        return np.datetime64('NaT')
+    else:
+        return 0
+
+
+class ColumnStore:
+    """
+    Store of typed columns with the same length.
+        - dtypes: name and numpy type of each column, the order is kept
+        - version: increased on every modification, it allows users to
+        know when derived data (e.g. pandas view) is outdated
+        - log: if it is a list, every modification is appended to it as an
+        operation with a copy of the new data, see autosave.py
+    Arrays returned by indexing are views, use write method to modify them.
+    """
+    def __init__(self, dtypes: dict, capacity: int = MIN_CAPACITY):
+        self.dtypes = {name: np.dtype(dtype) for name, dtype in dtypes.items()}
+        self.version = 0
+        self.log = None
+        self._size = 0
+        self._capacity = max(int(capacity), 1)
+        self._data = {name: np.empty(self._capacity, dtype=dtype)
+                      for name, dtype in self.dtypes.items()}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._data
+
+    def __getitem__(self, name: str) -> np.array:
+        return self._data[name][:self._size]
+
+    def __setitem__(self, name: str, values):
+        self.write(name, values)
+
+    @property
+    def columns(self) -> list:
+        return list(self.dtypes)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self._data.values())
+
+    def reserve(self, capacity: int):
+        """
+        Ensure that capacity rows can be stored without reallocation.
+        :param capacity: number of rows
+        """
+        if capacity <= self._capacity:
+            return
+
+        for name, array in self._data.items():
+            new_array = np.empty(capacity, dtype=array.dtype)
+            new_array[:self._size] = array[:self._size]
+            self._data[name] = new_array
+        self._capacity = capacity
+
+    def write(self, name: str, values, start: int = 0):
+        """
+        Write values in a column starting at a given row. New columns are
+        created with the type of the input values.
+        :param name: column name
+        :param values: scalar or array, it must fit in the stored rows
+        :param start: first row to write
+        """
+        if name not in self._data:
+            dtype = np.asarray(values).dtype
+            self.dtypes[name] = dtype
+            self._data[name] = np.full(self._capacity, _fill_value(dtype),
+                                       dtype=dtype)
+
+        if np.ndim(values) == 0:
+            self._data[name][start:self._size] = values
+        else:
+            self._data[name][start:start + len(values)] = values
+        self.version += 1
+        if self.log is not None:
+            self.log.append(('write', name, start, np.array(values)))
+
+    def append(self, columns: dict) -> (int, int):
+        """
+        Append rows at the end of the store. Missing columns are filled with
+        NaN, NaT or 0 according to their type.
+        :param columns: name and values of the columns, scalar values are
+            broadcast
+        :return: first and last+1 rows of the appended data
+        """
+        length = max([len(values) for values in columns.values()
+                      if np.ndim(values) > 0], default=0)
+        start = self._size
+        stop = start + length
+
+        if stop > self._capacity:
+            self.reserve(max(int(self._capacity * GROWTH_FACTOR), stop,
+                             MIN_CAPACITY))
+
+        for name in self.dtypes:
+            if name in columns:
+                self._data[name][start:stop] = columns[name]
+            else:
+                self._data[name][start:stop] = _fill_value(self.dtypes[name])
+
+        self._size = stop
+        self.version += 1
+        if self.log is not None:
+            self.log.append(('insert', start,
+                             {name: np.array(values)
+                              for name, values in columns.items()}))
+        return start, stop
+
+    def insert(self, start: int, columns: dict) -> (int, int):
+        """
+        Insert rows at a given position, the following ones are moved
+        forwards. Missing columns are filled with NaN, NaT or 0.
+        :param start: position of the first inserted row
+        :param columns: name and values of the columns
+        :return: first and last+1 rows of the inserted data
+        """
+        length = max([len(values) for values in columns.values()
+                      if np.ndim(values) > 0], default=0)
+        if self._size + length > self._capacity:
+            self.reserve(max(int(self._capacity * GROWTH_FACTOR),
+                             self._size + length, MIN_CAPACITY))
+
+        for name, array in self._data.items():
+            array[start + length:self._size + length] = \
+                array[start:self._size]
+            array[start:start + length] = \
+                columns[name] if name in columns else \
+                _fill_value(self.dtypes[name])
+
+        self._size += length
+        self.version += 1
+        if self.log is not None:
+            self.log.append(('insert', start,
+                             {name: np.array(values)
+                              for name, values in columns.items()}))
+        return start, start + length
+
+    def delete(self, start: int, stop: int):
+        """
+        Remove rows, the following ones are moved backwards.
+        :param start: first row to remove
+        :param stop: last+1 row to remove
+        """
+        length = stop - start
+        for array in self._data.values():
+            array[start:self._size - length] = array[stop:self._size]
+
+        self._size -= length
+        self.version += 1
+        if self.log is not None:
+            self.log.append(('delete', start, stop))
+
+    def take(self, indices: np.array):
+        """
+        Reorder rows in place.
+        :param indices: new position of rows, as in numpy.take
+        """
+        for array in self._data.values():
+            array[:self._size] = array[:self._size][indices]
+        self.version += 1
+
+        if self.log is not None:
+            # Reorders are usually made of few blocks of consecutive rows
+            indices = np.asarray(indices)
+            starts = np.flatnonzero(np.diff(indices, prepend=np.nan) != 1)
+            stops = np.append(starts[1:], len(indices))
+            self.log.append(('blocks', indices[starts],
+                             indices[stops - 1] + 1))
+
+    def astype(self, dtypes: dict):
+        """
+        Cast columns to the given types, columns already having the right
+        type are not copied.
+        :param dtypes: name and type of the columns to cast
+        """
+        for name, dtype in dtypes.items():
+            if name in self._data and self._data[name].dtype != dtype:
+                self._data[name] = self._data[name].astype(dtype)
+                self.dtypes[name] = np.dtype(dtype)
+                self.version += 1
+                if self.log is not None:
+                    self.log.append(('astype', name, np.dtype(dtype).str))
+
+    def unmap(self, file: str):
+        """
+        Read into memory the columns which are memory maps of a file, so
+        that the file can be replaced: some systems (e.g. Windows) do not
+        allow it while it is mapped.
+        :param file: mapped file
+        """
+        for name, array in self._data.items():
+            if isinstance(array, np.memmap) and array.filename is not None \
+                    and array.filename == os.path.abspath(file):
+                self._data[name] = np.array(array)
+                # Former views, e.g. the pandas one, keep the map open
+                self.version += 1
+
+    def copy(self):
+        store = ColumnStore(self.dtypes, capacity=max(self._size, 1))
+        store.append({name: self[name] for name in self.dtypes})
+        return store
+
+    def to_pandas(self, start: int = 0, stop: int = None) -> pd.DataFrame:
+        """
+        Build a dataframe with the stored rows. The dataframe index is the
+        row number in the store.
+        :param start: first row
+        :param stop: last+1 row, None for the end
+        :return: dataframe with all the columns
+        """
+        stop = self._size if stop is None else stop
+        return pd.DataFrame({name: self._data[name][start:stop]
+                             for name in self.dtypes},
+                            index=pd.RangeIndex(start, stop))
+
+    @classmethod
+    def from_pandas(cls, df: pd.DataFrame, dtypes: dict = None):
+        """
+        Create a store from a dataframe, the index is not kept.
+        :param df: input data
+        :param dtypes: columns and types to store, missing columns in the
+            dataframe are filled with NaN, NaT or 0. By default, all the
+            dataframe columns with their own type.
+        :return: ColumnStore
+        """
+        if dtypes is None:
+            dtypes = df.dtypes.to_dict()
+
+        store = cls(dtypes, capacity=max(df.shape[0], MIN_CAPACITY))
+        store.append({name: df[name].to_numpy(dtype=store.dtypes[name])
+                      for name in dtypes if name in df.columns})
+        return store
+
+    @classmethod
+    def from_arrays(cls, columns: dict):
+        """
+        Create a store using the given arrays as storage, without copying
+        them (e.g. memory maps). They are only copied when the store grows.
+        :param columns: name and array of each column, same length
+        :return: ColumnStore
+        """
+        store = cls({name: values.dtype for name, values in columns.items()},
+                    capacity=1)
+        size = len(next(iter(columns.values()))) if columns else 0
+        store._data = dict(columns)
+        store._size = size
+        store._capacity = size
+        return store
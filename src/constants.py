@@ -6,14 +6,25 @@ License: MIT
 import logging
 import os
 
-# gpx file parser options
-maximum_file_size = 10e+6
+# gpx file loading
+load_processes = os.cpu_count()  # processes to parse several gpx files
+gpx_cache_size = 1e+9  # bytes, 0 to disable the cache
+hash_workers = 8  # threads to compute the hash of several files
+
+# session autosave, see autosave.py
+autosave_compact_size = 100e+6  # bytes of log which rewrite the session
+
+# distance computation: haversine, andoyer or vincenty (see geodesy.py)
+distance_method = 'vincenty'
 
 # plot options
 max_zoom = 16
 map_size = 2  # number of tiles
 margin_outbounds = 0  # extra tiles to load
 max_displayed_points = 100
+tile_images_size = 200e+6  # bytes of decoded tiles kept in memory
+tile_decode_workers = 4  # threads to decode the tiles of a map
+spatial_cell_size = 0.25  # km, grid of the index for segment selection
 
 # fix elevation
 steep_distance = 0.2  # steep zone is always longer than X m
@@ -21,6 +32,16 @@ steep_gap = 0.6  # threshold to consider a steep zone in elevation
 steep_k_moving_average = 20  # step for moving average if needed
 fix_thr = 1000  # under 1000 points smoothing is used instead of fixing
 
+# elevation filters
+smooth_window = 0.05  # moving average window as a fraction of the segment
+filter_window = 15  # points for median and Savitzky-Golay filters
+savitzky_golay_order = 3
+hysteresis_threshold = 2  # m
+filter_processes = 1  # processes to filter several segments
+
+# undo/redo
+undo_memory_budget = 200e+6  # bytes kept to revert edits
+
 # log options
 log_level = logging.DEBUG
 
@@ -29,6 +50,8 @@ src_path = os.path.dirname(os.path.realpath(__file__))
 prj_path = os.path.dirname(src_path)
 test_path = os.path.dirname(src_path) + '/test'
 db_path = 'db_track_editor.sqlite'
+gpx_cache_path = prj_path + '/gpx_cache'  # parsed gpx files
+autosave_path = prj_path + '/autosave.session'  # recovered after a crash
 db_test_path = test_path + '/db_test.sqlite'
 ico_path = src_path + '/media/compass.ico'
 
@@ -36,6 +59,22 @@ ico_path = src_path + '/media/compass.ico'
 version = "v0.12"
 email = "alguerre@outlook.com"
 tool = "TrackEditor"
+tiles_url = 'https://tile.openstreetmap.org/{zoom}/{x}/{y}.png'
+tiles_path = prj_path + '/tiles'
+tiles_mbtiles = ''  # single file of the tiles instead of tiles_path
+download_workers = 2  # parallel requests, OSM tile usage policy allows 2
+download_rate = 2  # requests per second and host
+download_burst = 16  # requests over the rate, e.g. one map at once
+download_timeout = 10  # s
+tiles_max_age = 7 * 24 * 3600  # s, when the server has no cache headers
+tile_size_estimate = 15e+3  # bytes, typical OSM tile
+prefetch_buffer = 0.5  # km around the track whose tiles are downloaded
+prefetch_batch_size = 50  # tiles downloaded between progress saves
+prefetch_state_path = prj_path + '/prefetch.json'  # interrupted download
+tiles_quota = 1e+9  # bytes of tiles on disk, 0 for no limit
+tiles_protected_zoom = 8  # tiles up to this zoom are never removed
+tiles_evict_target = 0.9  # fraction of the quota left by an eviction
+tiles_evict_batch = 500  # tiles removed per transaction
 
 # gpx metadata
 device = "Garmin Edge 830"
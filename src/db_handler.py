@@ -6,10 +6,27 @@ License: MIT
 """
 import sqlite3
 import logging
+import time
 import pandas as pd
 
 LOGGER = logging.getLogger(__name__)
 
+TILES_SCHEMA = """(zoom INTEGER,
+                      x INTEGER,
+                      y INTEGER,
+                 status BOOLEAN,
+                   path TEXT,
+                   size INTEGER,
+            last_access REAL,
+                   etag TEXT,
+          last_modified TEXT,
+                expires REAL,
+                PRIMARY KEY (zoom, x, y)) WITHOUT ROWID"""
+
+# Columns added after the first version of the table
+NEW_COLUMNS = {'last_access': 'REAL', 'etag': 'TEXT', 'last_modified': 'TEXT',
+               'expires': 'REAL'}
+
 
 class DbHandler:
     def __init__(self, db_path):
@@ -21,24 +38,48 @@ class DbHandler:
         self.conn = sqlite3.connect(self.db_path)
         self.cur = self.conn.cursor()
         try:
-            self.cur.execute("""CREATE TABLE Tiles (zoom INTEGER,
-                                                       x INTEGER,
-                                                       y INTEGER,
-                                                  status BOOLEAN,
-                                                    path TEXT,
-                                                    size INTEGER)
-                             """)
-        except sqlite3.OperationalError as e:
-            if 'table Tiles already exists' in str(e):
-                LOGGER.info(e)
+            # Readers are not blocked by writes and commits are cheaper
+            self.cur.execute('PRAGMA journal_mode=WAL')
+            self.cur.execute('PRAGMA synchronous=NORMAL')
+
+            self.cur.execute(
+                f'CREATE TABLE IF NOT EXISTS Tiles {TILES_SCHEMA}')
+            columns = self.cur.execute('PRAGMA table_info(Tiles)').fetchall()
+            if not any(column[5] for column in columns):
+                self._add_primary_key()
             else:
-                LOGGER.error(f'Unexpected error initializing database: {e}')
-                return False
+                names = [column[1] for column in columns]
+                for name, column_type in NEW_COLUMNS.items():
+                    if name not in names:
+                        self.cur.execute(f'ALTER TABLE Tiles ADD COLUMN '
+                                         f'{name} {column_type}')
+            self.cur.execute("""CREATE INDEX IF NOT EXISTS Tiles_last_access
+                                ON Tiles (last_access)""")
+        except sqlite3.DatabaseError as e:
+            LOGGER.error(f'Unexpected error initializing database: {e}')
+            return False
 
         return True
 
     def close_db(self):
         self.cur.close()
+        self.conn.close()
+        self.cur = self.conn = None
+
+    def _add_primary_key(self):
+        # Former databases have no key: the table is rebuilt keeping the
+        # last row of each tile
+        LOGGER.info(f'Adding primary key to Tiles table in {self.db_path}')
+        with self.conn:
+            self.cur.execute('BEGIN')
+            self.cur.execute(f'CREATE TABLE Tiles_pk {TILES_SCHEMA}')
+            self.cur.execute("""INSERT OR REPLACE INTO Tiles_pk
+                                    (zoom, x, y, status, path, size)
+                                    SELECT zoom, x, y, status, path, size
+                                    FROM Tiles ORDER BY rowid
+                             """)
+            self.cur.execute('DROP TABLE Tiles')
+            self.cur.execute('ALTER TABLE Tiles_pk RENAME TO Tiles')
 
     def insert_tile(self, zoom: int, xtile: int, ytile: int, status: bool,
                     path: str, size: int):
@@ -49,16 +90,141 @@ class DbHandler:
         if not status:
             size = 0
 
-        if not self._tile_exists(zoom, xtile, ytile):
-            query = """INSERT OR IGNORE INTO Tiles
-                        (zoom, x, y, status, path, size)
-                        VALUES(?, ?, ?, ?, ?, ?)
-                    """
-            self.cur.execute(query, (zoom, xtile, ytile, status, path, size))
-            self.conn.commit()
+        # Existing tiles are kept
+        query = """INSERT OR IGNORE INTO Tiles
+                    (zoom, x, y, status, path, size, last_access)
+                    VALUES(?, ?, ?, ?, ?, ?, ?)
+                """
+        self.cur.execute(query, (zoom, xtile, ytile, status, path, size,
+                                 time.time()))
+        self.conn.commit()
 
         return True
 
+    def insert_tiles(self, tiles: list) -> bool:
+        """
+        Insert or replace several tiles in one transaction, they are
+        accessed now.
+        :param tiles: zoom, x, y, status, path and size of each tile,
+            optionally followed by the HTTP validators: ETag, Last-Modified
+            and expiry time
+        :return: False if there is no connection
+        """
+        if not self.cur or not self.conn:
+            LOGGER.error('No connection with data base')
+            return False  # not connected
+
+        query = """INSERT INTO Tiles
+                    (zoom, x, y, status, path, size, last_access, etag,
+                     last_modified, expires)
+                    VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (zoom, x, y) DO UPDATE SET
+                        status=excluded.status,
+                        path=excluded.path,
+                        size=excluded.size,
+                        last_access=excluded.last_access,
+                        etag=excluded.etag,
+                        last_modified=excluded.last_modified,
+                        expires=excluded.expires
+                """
+        now = time.time()
+        with self.conn:
+            self.cur.executemany(
+                query, ((zoom, xtile, ytile, status, path,
+                         size if status else 0, now,
+                         *(validators or (None, None, None)))
+                        for zoom, xtile, ytile, status, path, size,
+                        *validators in tiles))
+        return True
+
+    def update_tile_validators(self, tiles: list) -> bool:
+        """
+        Renew the HTTP validators of several tiles, e.g. after a not
+        modified response, in one transaction.
+        :param tiles: zoom, x, y, ETag, Last-Modified and expiry time of
+            each tile, missing validators (None) are kept
+        :return: False if there is no connection
+        """
+        if not self.cur or not self.conn:
+            LOGGER.error('No connection with data base')
+            return False  # not connected
+
+        query = """UPDATE Tiles SET
+                        etag=COALESCE(?, etag),
+                        last_modified=COALESCE(?, last_modified),
+                        expires=?
+                    WHERE zoom=? AND x=? AND y=?
+                """
+        with self.conn:
+            self.cur.executemany(
+                query, ((etag, last_modified, expires, zoom, xtile, ytile)
+                        for zoom, xtile, ytile, etag, last_modified, expires
+                        in tiles))
+        return True
+
+    def touch_tiles(self, tiles: list, access_time: float = None) -> bool:
+        """
+        Record the access to several tiles in one transaction.
+        :param tiles: (zoom, x, y) of each tile
+        :param access_time: unix time, now by default
+        :return: False if there is no connection
+        """
+        if not self.cur or not self.conn:
+            LOGGER.error('No connection with data base')
+            return False  # not connected
+
+        access_time = time.time() if access_time is None else access_time
+        query = 'UPDATE Tiles SET last_access=? WHERE zoom=? AND x=? AND y=?'
+        with self.conn:
+            self.cur.executemany(query, ((access_time, *tile)
+                                         for tile in tiles))
+        return True
+
+    def remove_tiles(self, tiles: list) -> bool:
+        """
+        Remove several tiles in one transaction.
+        :param tiles: (zoom, x, y) of each tile
+        :return: False if there is no connection
+        """
+        if not self.cur or not self.conn:
+            LOGGER.error('No connection with data base')
+            return False  # not connected
+
+        query = 'DELETE FROM Tiles WHERE zoom=? AND x=? AND y=?'
+        with self.conn:
+            self.cur.executemany(query, tiles)
+        return True
+
+    def get_lru_tiles(self, limit: int, min_zoom: int = 0) -> list:
+        """
+        Least recently used tiles, never accessed tiles first.
+        :param limit: maximum number of tiles
+        :param min_zoom: tiles of lower zooms are not returned
+        :return: zoom, x, y, path and size of each tile
+        """
+        if not self.cur or not self.conn:
+            LOGGER.error('No connection with data base')
+            return []  # not connected
+
+        query = """SELECT zoom, x, y, path, size FROM Tiles
+                    WHERE zoom >= ?
+                    ORDER BY last_access
+                    LIMIT ?
+                """
+        return self.cur.execute(query, (min_zoom, limit)).fetchall()
+
+    def get_usage(self) -> (int, int):
+        """
+        :return: number of tiles and their total size in bytes
+        """
+        if not self.cur or not self.conn:
+            LOGGER.error('No connection with data base')
+            return 0, 0  # not connected
+
+        count, size = self.cur.execute(
+            'SELECT COUNT(*), TOTAL(size) FROM Tiles').fetchone()
+        return count, int(size)
+
     def clean_tiles(self):
         self.cur.execute('DROP TABLE IF EXISTS Tiles')
         self.conn.commit()
@@ -100,31 +266,66 @@ class DbHandler:
             return pd.DataFrame()
 
     def get_tile_size(self, zoom: int, xtile: int, ytile: int) -> int:
-        if self._tile_exists(zoom, xtile, ytile):
-            query = 'SELECT size FROM Tiles WHERE zoom=? AND x=? AND y=?'
-            size_query = self.cur.execute(query, (zoom, xtile, ytile))
-            size = size_query.fetchone()[0]
-            return size
-        else:
-            return 0
+        return self._get_tile_value('size', zoom, xtile, ytile)
 
     def get_tile_status(self, zoom: int, xtile: int, ytile: int) -> int:
-        if self._tile_exists(zoom, xtile, ytile):
-            query = 'SELECT status FROM Tiles WHERE zoom=? AND x=? AND y=?'
-            status_query = self.cur.execute(query, (zoom, xtile, ytile))
-            status = status_query.fetchone()[0]
-            return status
-        else:
-            return 0
+        return self._get_tile_value('status', zoom, xtile, ytile)
+
+    def get_tile_statuses(self, zoom: int, xtile: int, ytile: int,
+                          final_xtile: int, final_ytile: int) -> dict:
+        """
+        Status of the registered tiles of a box, in one query.
+        :param zoom: zoom grade
+        :param xtile: left most tile
+        :param ytile: top most tile
+        :param final_xtile: right most tile, included
+        :param final_ytile: bottom most tile, included
+        :return: (zoom, x, y): status, tiles not in the database are missing
+        """
+        if not self.cur or not self.conn:
+            LOGGER.error('No connection with data base')
+            return {}  # not connected
+
+        query = """SELECT x, y, status FROM Tiles
+                    WHERE zoom=? AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?
+                """
+        rows = self.cur.execute(query, (zoom, xtile, final_xtile,
+                                        ytile, final_ytile))
+        return {(zoom, x, y): bool(status) for x, y, status in rows}
+
+    def get_tile_validators(self, zoom: int, xtile: int, ytile: int,
+                            final_xtile: int, final_ytile: int) -> dict:
+        """
+        HTTP validators of the valid tiles of a box, in one query.
+        :param zoom: zoom grade
+        :param xtile: left most tile
+        :param ytile: top most tile
+        :param final_xtile: right most tile, included
+        :param final_ytile: bottom most tile, included
+        :return: (zoom, x, y): (ETag, Last-Modified, expiry time)
+        """
+        if not self.cur or not self.conn:
+            LOGGER.error('No connection with data base')
+            return {}  # not connected
+
+        query = """SELECT x, y, etag, last_modified, expires FROM Tiles
+                    WHERE zoom=? AND x BETWEEN ? AND ? AND y BETWEEN ? AND ?
+                        AND status
+                """
+        rows = self.cur.execute(query, (zoom, xtile, final_xtile,
+                                        ytile, final_ytile))
+        return {(zoom, x, y): (etag, last_modified, expires)
+                for x, y, etag, last_modified, expires in rows}
 
     def remove_tile(self, zoom: int, xtile: int, ytile: int) -> bool:
         if not self.cur or not self.conn:
             LOGGER.error('No connection with data base')
             return False  # not connected
 
-        if self._tile_exists(zoom, xtile, ytile):
-            query = 'DELETE FROM Tiles WHERE zoom=? AND x=? and y=?'
-            self.cur.execute(query, (zoom, xtile, ytile))
+        query = 'DELETE FROM Tiles WHERE zoom=? AND x=? and y=?'
+        self.cur.execute(query, (zoom, xtile, ytile))
+        self.conn.commit()
+        if self.cur.rowcount > 0:
             return True
         else:
             LOGGER.warning(
@@ -132,21 +333,22 @@ class DbHandler:
             )
             return False
 
+    def _get_tile_value(self, column: str, zoom: int, xtile: int,
+                        ytile: int) -> int:
+        # Value of a column for a tile, 0 if the tile does not exist
+        if not self.cur or not self.conn:
+            LOGGER.error('No connection with data base')
+            return 0  # not connected
+
+        query = f'SELECT {column} FROM Tiles WHERE zoom=? AND x=? AND y=?'
+        row = self.cur.execute(query, (zoom, xtile, ytile)).fetchone()
+        return row[0] if row else 0
+
     def _tile_exists(self, zoom: int, xtile: int, ytile: int) -> bool:
         if not self.cur or not self.conn:
             LOGGER.error('No connection with data base')
             return False  # not connected
 
-        query = 'SELECT COUNT(*) FROM Tiles WHERE zoom=? AND x=? AND y=?'
-        elements = self.cur.execute(query, (zoom, xtile, ytile))
-        count = elements.fetchone()[0]
-        if count == 1:
-            return True
-        elif count > 1:
-            LOGGER.error(
-                f'More than one coincidence for tile ({zoom},{xtile},{ytile})')
-            return True
-        else:
-            LOGGER.warning(
-                f'Input tile ({zoom},{xtile},{ytile}) is already in  db.')
-            return False
+        query = 'SELECT 1 FROM Tiles WHERE zoom=? AND x=? AND y=?'
+        return self.cur.execute(query, (zoom, xtile, ytile)).fetchone() \
+            is not None
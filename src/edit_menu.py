@@ -12,6 +12,8 @@ import collections
 
 import plots
 import constants
+import speed_models
+import elevation
 import utils
 from split_segment import SplitSegment as SplitSegmentCallback
 
@@ -32,12 +34,24 @@ class EditMenu(tk.Menu):
 
         # Define menu
         self.editmenu = tk.Menu(parent, tearoff=0)
+        self.editmenu.add_command(label='Undo', accelerator='Ctrl+Z',
+                                  command=self.undo)
+        self.editmenu.add_command(label='Redo', accelerator='Ctrl+Y',
+                                  command=self.redo)
+        self.editmenu.add_separator()
         self.editmenu.add_command(label='Reverse',
                                   command=self.reverse_segment)
         self.editmenu.add_command(label='Insert time',
                                   command=self.insert_time)
         self.editmenu.add_command(label='Fix elevation',
                                   command=self.fix_elevation)
+        self.filtermenu = tk.Menu(self.editmenu, tearoff=0)
+        for method in elevation.FILTERS:
+            self.filtermenu.add_command(
+                label=method.replace('_', ' ').capitalize(),
+                command=lambda m=method: self.filter_elevation(m))
+        self.editmenu.add_cascade(label='Filter elevation',
+                                  menu=self.filtermenu)
         self.editmenu.add_command(label='Split segment',
                                   command=self.split_segment)
         self.editmenu.add_command(label='Remove segment',
@@ -45,14 +59,62 @@ class EditMenu(tk.Menu):
         self.editmenu.add_command(label='Change segment order',
                                   command=self.change_order)
         parent.add_cascade(label='Edit', menu=self.editmenu)
+        controller.bind_all('<Control-z>', self._track_shortcut(self.undo))
+        controller.bind_all('<Control-y>', self._track_shortcut(self.redo))
 
         # Time variables initialization
         self.timestamp = dt.datetime(2000, 1, 1, 0, 0, 0)
         self.speed = 0
+        self.speed_model = 'constant'
 
         # Split segment object control
         self.split_segment_interaction = None
 
+    @utils.exception_handler
+    def undo(self):
+        """
+        Revert the last edition of the track.
+        """
+        if self.controller.shared_data.obj_track.undo():
+            self._refresh_track()
+
+    @utils.exception_handler
+    def redo(self):
+        """
+        Apply again the last reverted edition of the track.
+        """
+        if self.controller.shared_data.obj_track.redo():
+            self._refresh_track()
+
+    @staticmethod
+    def _track_shortcut(action):
+        # Text fields keep the keys for themselves, ttk entries, spinboxes
+        # and comboboxes are also tk.Entry
+        def handler(event):
+            if not isinstance(event.widget, (tk.Entry, tk.Spinbox, tk.Text)):
+                action()
+        return handler
+
+    def _refresh_track(self):
+        # Selected segments may not exist anymore
+        obj_track = self.controller.shared_data.obj_track
+        obj_track.selected_segment = []
+        obj_track.selected_segment_idx = []
+
+        if obj_track.size > 0:
+            plots.update_plots(
+                obj_track,
+                self.controller.shared_data.ax_track,
+                self.controller.shared_data.ax_ele,
+                self.controller.shared_data.ax_track_info,
+                canvas=self.controller.shared_data.canvas)
+        else:
+            plots.initial_plots(
+                self.controller.shared_data.ax_track,
+                self.controller.shared_data.ax_ele,
+                self.controller.shared_data.ax_track_info)
+            self.controller.shared_data.canvas.draw()
+
     @utils.exception_handler
     def reverse_segment(self):
         """
@@ -83,8 +145,12 @@ class EditMenu(tk.Menu):
     def insert_time(self):
         """
         Add time data to the whole track.
-        Open a new window to introduce time and speed, then a timestamp is
-        added to the whole track
+        Open a new window to introduce time, speed and speed model, then a
+        timestamp is added to the whole track. Speed models:
+            - constant: same speed for all points
+            - grade: speed on flat terrain, adapted to the slope
+            - segment: comma separated speeds for each segment in track
+            order, the general speed is used for missing ones
         """
         if self.controller.shared_data.obj_track.size == 0:
             message = 'There is no loaded track to insert timestamp'
@@ -94,6 +160,7 @@ class EditMenu(tk.Menu):
 
         self.timestamp = dt.datetime(2000, 1, 1, 0, 0, 0)
         self.speed = 0
+        self.speed_model = 'constant'
 
         spinbox_options = {'year': [1990, 2030, 2000],
                            'month': [1, 12, 1],
@@ -146,6 +213,37 @@ class EditMenu(tk.Menu):
         lbl_label.grid(row=i, column=0, pady=10)
         spn_speed.grid(row=i, column=1)
 
+        # Insert speed model
+        i += 1
+        var_model = tk.StringVar(top)
+        var_model.set(self.speed_model)
+        opt_model = tk.OptionMenu(frm_form, var_model,
+                                  *speed_models.MODELS)
+        lbl_label = tk.Label(master=frm_form, text='speed model', anchor='w')
+        lbl_label.grid(row=i, column=0, pady=10)
+        opt_model.grid(row=i, column=1)
+
+        # Insert speed per segment, only for segment model
+        i += 1
+        ent_segment_speed = tk.Entry(master=frm_form, width=10,
+                                     justify=tk.RIGHT, relief=tk.FLAT)
+        lbl_label = tk.Label(master=frm_form, text='segment speeds (km/h)',
+                             anchor='w')
+        lbl_label.grid(row=i, column=0, pady=10)
+        ent_segment_speed.grid(row=i, column=1)
+
+        def _get_segment_speed() -> dict:
+            # Comma separated speeds, assigned to segments in track order
+            values = [value for value in
+                      ent_segment_speed.get().replace(' ', '').split(',')
+                      if value]
+            segments = list(
+                self.controller.shared_data.obj_track.segment_index)
+            if len(values) > len(segments):
+                raise ValueError('There are more speeds than segments.')
+            return {seg: float(value)
+                    for seg, value in zip(segments, values)}
+
         def _insert_timestamp():
             # Check input data and insert timestamp
             try:
@@ -158,10 +256,15 @@ class EditMenu(tk.Menu):
                 self.speed = float(spn_speed.get())
                 if self.speed <= 0:
                     raise ValueError('Speed must be a positive number.')
+                self.speed_model = var_model.get()
+                segment_speed = _get_segment_speed() \
+                    if self.speed_model == 'segment' else None
 
                 # Insert timestamp
                 self.controller.shared_data.obj_track.\
-                    insert_timestamp(self.timestamp, self.speed)
+                    insert_timestamp(self.timestamp, self.speed,
+                                     model=self.speed_model,
+                                     segment_speed=segment_speed)
                 top.destroy()
 
             except (ValueError, OverflowError) as e:
@@ -173,6 +276,8 @@ class EditMenu(tk.Menu):
                 spn_time[s].insert(0, spinbox_options[s][2])
             spn_speed.delete(0, 8)
             spn_speed.insert(0, 0)
+            var_model.set('constant')
+            ent_segment_speed.delete(0, tk.END)
 
         # Button frame
         frm_button = tk.Frame(top)
@@ -189,39 +294,57 @@ class EditMenu(tk.Menu):
     @utils.exception_handler
     def fix_elevation(self):
         """
-        Apply the elevation correction on the selected segment.
+        Apply the elevation correction on the selected segment. If no
+        segment is selected, all of them are corrected.
         """
-        selected_segment = \
-            self.controller.shared_data.obj_track.selected_segment_idx
-        segment_idx = selected_segment[0]
-        segment = \
-            self.controller.shared_data.obj_track.get_segment(segment_idx)
+        obj_track = self.controller.shared_data.obj_track
+        selected_segment = obj_track.selected_segment_idx
 
-        if len(selected_segment) == 1:
-            if segment.shape[0] > constants.fix_thr:
-                try:
-                    self.controller.shared_data.obj_track.fix_elevation(
-                        segment_idx)
-                except ValueError:
-                    self.controller.shared_data.obj_track.smooth_elevation(
-                        segment_idx)
-            else:
-                self.controller.shared_data.obj_track.smooth_elevation(
-                    segment_idx)
-
-            plots.update_plots(
-                self.controller.shared_data.obj_track,
-                self.controller.shared_data.ax_track,
-                self.controller.shared_data.ax_ele,
-                self.controller.shared_data.ax_track_info,
-                canvas=self.controller.shared_data.canvas)
-
-        elif len(selected_segment) > 1:
+        if len(selected_segment) > 1:
             messagebox.showerror('Warning',
                                  'More than one segment is selected')
+            return
         elif len(selected_segment) == 0:
-            messagebox.showerror('Warning',
-                                 'No segment is selected')
+            if obj_track.size == 0 or not messagebox.askyesno(
+                    'Fix elevation',
+                    'No segment is selected, fix all segments?'):
+                return
+            segments = list(obj_track.segment_index)
+        else:
+            segments = selected_segment
+
+        # Small segments are smoothed, all of them are undone at once
+        obj_track.fix_elevation(segments=segments)
+
+        plots.update_plots(
+            obj_track,
+            self.controller.shared_data.ax_track,
+            self.controller.shared_data.ax_ele,
+            self.controller.shared_data.ax_track_info,
+            canvas=self.controller.shared_data.canvas)
+
+    @utils.exception_handler
+    def filter_elevation(self, method: str):
+        """
+        Apply an elevation filter on the selected segments, or on all of
+        them if no segment is selected.
+        :param method: filter name, see elevation.py
+        """
+        obj_track = self.controller.shared_data.obj_track
+        if obj_track.size == 0:
+            messagebox.showwarning('Warning', 'There is no loaded track')
+            return
+
+        segments = obj_track.selected_segment_idx or None
+        obj_track.filter_elevation(method, segments=segments,
+                                   processes=constants.filter_processes)
+
+        plots.update_plots(
+            obj_track,
+            self.controller.shared_data.ax_track,
+            self.controller.shared_data.ax_ele,
+            self.controller.shared_data.ax_track_info,
+            canvas=self.controller.shared_data.canvas)
 
     @utils.exception_handler
     def remove_segment(self):
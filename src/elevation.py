@@ -0,0 +1,309 @@
+"""ELEVATION
+Elevation corrections working on whole numpy arrays.
+
+Steep zones are spurious jumps in the elevation profile, usually caused by
+barometric or DEM errors. They are detected and replaced by a cubic
+polynomial fitted to the points around each zone. All the zones are fitted
+at the same time with a batched least squares solution.
+
+Filters smooth the whole profile:
+    - moving_average: mean of the last n points.
+    - median: centered median of n points, removes isolated spikes.
+    - savitzky_golay: centered local polynomial fit, keeps peaks better than
+    the moving average.
+    - hysteresis: the elevation only changes when the input moves more than
+    a threshold away from it, removes small oscillations.
+Segments are filtered independently, optionally in a process pool.
+
+Author: alguerre
+License: MIT
+"""
+import concurrent.futures
+import functools
+import multiprocessing
+
+import numpy as np
+
+import constants as c
+import utils
+
+FIT_DEGREE = 3  # polynomial to fill steep zones
+FIT_WINDOW = 10  # points at each side of a steep zone used for fitting
+
+
+def steep_zone(elevation: np.array, distance: np.array) -> np.array:
+    """
+    Points in a steep zone: those with an elevation gap bigger than
+    c.steep_gap and those closer than c.steep_distance to a previous gap,
+    excluding the first c.steep_distance km.
+    :param elevation: elevation in m
+    :param distance: cumulated distance in km
+    :return: boolean array, True for points in a steep zone
+    """
+    n_points = len(elevation)
+    gap = np.zeros(n_points, dtype=bool)
+    gap[1:] = np.abs(np.diff(elevation)) > c.steep_gap
+
+    # Distance of the last gap at each point, 0 before the first one
+    last_gap = np.maximum.accumulate(
+        np.where(gap, np.arange(n_points), -1))
+    last_steep = np.where(last_gap >= 0, distance[last_gap], 0)
+
+    return gap | ((distance - last_steep < c.steep_distance) &
+                  (distance > c.steep_distance))
+
+
+def _zone_bounds(steep: np.array) -> (np.array, np.array):
+    # First and last+1 point of each run of steep points
+    change = np.diff(steep.astype('int8'), prepend=0, append=0)
+    return np.flatnonzero(change == 1), np.flatnonzero(change == -1)
+
+
+def _polynomial_fit(x: np.array, y: np.array, valid: np.array) -> tuple:
+    """
+    Least squares polynomial fit of many independent sets of points at
+    once. Coordinates are normalized for each set to keep the problem well
+    conditioned.
+    :param x: (zones, points) coordinates
+    :param y: (zones, points) values
+    :param valid: (zones, points) mask of points to use
+    :return: coefficients (zones, degree + 1), center and scale of each zone
+    """
+    x_valid = np.where(valid, x, np.nan)
+    center = (np.nanmin(x_valid, axis=1) + np.nanmax(x_valid, axis=1)) / 2
+    scale = np.maximum(np.nanmax(np.abs(x_valid - center[:, None]), axis=1),
+                       1)
+
+    u = (x - center[:, None]) / scale[:, None]
+    vandermonde = u[..., None] ** np.arange(FIT_DEGREE + 1) * valid[..., None]
+    coef = np.linalg.pinv(vandermonde) @ \
+        np.where(valid, y, 0)[..., None].astype('float64')
+
+    return coef[..., 0], center, scale
+
+
+def _fit_zones(fixed: np.array, initial: np.array,
+               starts: np.array, ends: np.array):
+    """
+    Fill closed steep zones with a polynomial fitted to the points before
+    and after each zone. Points before a zone may have been fixed by the
+    previous zone, so zones are processed in rounds: each round fits at once
+    all the zones whose previous neighbours are already done.
+    :param fixed: elevation to modify
+    :param initial: elevation before any fix, read after each zone
+    :param starts: first point of each zone
+    :param ends: last+1 point of each zone
+    """
+    n_points = len(fixed)
+    window = np.arange(FIT_WINDOW)
+    zones = np.arange(len(starts))
+
+    # Depth of each zone in a chain of dependent zones
+    dependent = np.zeros(len(starts), dtype=bool)
+    dependent[1:] = starts[1:] - FIT_WINDOW - 1 < ends[:-1]
+    independent = np.maximum.accumulate(np.where(dependent, -1, zones))
+    depth = zones - independent
+
+    for level in range(depth.max(initial=-1) + 1):
+        zone = depth == level
+        start, end = starts[zone], ends[zone]
+
+        # Windows of points at each side of the zone
+        x_before = start[:, None] - FIT_WINDOW - 1 + window
+        x_after = end[:, None] + window
+        x = np.concatenate((x_before, x_after), axis=1)
+        valid = (x >= 0) & (x < n_points)
+        x_safe = np.clip(x, 0, n_points - 1)
+        y = np.concatenate(
+            (fixed[x_safe[:, :FIT_WINDOW]], initial[x_safe[:, FIT_WINDOW:]]),
+            axis=1)
+        coef, center, scale = _polynomial_fit(x, y, valid)
+
+        # Evaluate from the second point before the zone to its end
+        first = np.maximum(start - 2, 0)
+        length = end - first
+        zone_id = np.repeat(np.arange(len(start)), length)
+        points = np.arange(length.sum()) - \
+            np.repeat(np.cumsum(length) - length, length) + \
+            np.repeat(first, length)
+
+        u = (points - center[zone_id]) / scale[zone_id]
+        fixed[points] = np.sum(
+            coef[zone_id] * u[:, None] ** np.arange(FIT_DEGREE + 1), axis=1)
+
+
+def fix_steep_zones(elevation: np.array, steep: np.array) -> np.array:
+    """
+    Replace steep zones by a cubic fit of the surrounding points. If the
+    track finishes in a steep zone, a moving average is applied from that
+    zone to the end.
+    :param elevation: elevation in m
+    :param steep: boolean array of points in steep zones
+    :return: fixed elevation
+    """
+    initial = np.where(steep, -1, elevation).astype(elevation.dtype)
+    fixed = initial.copy()
+
+    starts, ends = _zone_bounds(steep)
+    open_zone = len(ends) > 0 and ends[-1] == len(steep)
+    if open_zone:
+        tail_start = starts[-1]
+        starts, ends = starts[:-1], ends[:-1]
+
+    if len(starts) > 0:
+        _fit_zones(fixed, initial, starts, ends)
+
+    # Apply moving average on tail
+    if open_zone:
+        first = max(tail_start - 2, 0)
+        n = min(c.steep_k_moving_average, len(elevation) - first)
+        fixed[first:] = np.concatenate((
+            elevation[first:first + n - 1],
+            utils.moving_average(elevation[first:], n)))
+
+    return fixed
+
+
+def moving_average(elevation: np.array, n: int = None) -> np.array:
+    """
+    Moving average of the last n points. The first n-1 points, which have
+    no complete window, are a linear ramp from the first elevation to the
+    first average.
+    :param elevation: elevation in m
+    :param n: window size, by default c.smooth_window of the points
+    :return: filtered elevation
+    """
+    if n is None:
+        n = int(np.ceil(len(elevation) * c.smooth_window))
+    n = min(n, len(elevation))
+    if n <= 1:
+        return elevation.copy()
+
+    elevation_ma = utils.moving_average(elevation, n)
+    ramp = elevation[0] + \
+        np.arange(1, n) * (elevation_ma[0] - elevation[0]) / n
+
+    return np.concatenate((ramp, elevation_ma))
+
+
+def _odd_window(n: int, n_points: int) -> int:
+    # Centered windows need an odd size not bigger than the data
+    n = min(n, n_points)
+    return n if n % 2 == 1 else n - 1
+
+
+def median(elevation: np.array, n: int = c.filter_window) -> np.array:
+    """
+    Centered moving median, edges are extended with the first and last
+    elevation.
+    :param elevation: elevation in m
+    :param n: window size, odd
+    :return: filtered elevation
+    """
+    n = _odd_window(n, len(elevation))
+    if n <= 1:
+        return elevation.copy()
+
+    padded = np.pad(elevation, n // 2, mode='edge')
+    return np.median(np.lib.stride_tricks.sliding_window_view(padded, n),
+                     axis=1)
+
+
+def savitzky_golay(elevation: np.array, n: int = c.filter_window,
+                   order: int = c.savitzky_golay_order) -> np.array:
+    """
+    Savitzky-Golay filter: value at the center of a least squares
+    polynomial fit of each window, computed as a convolution. Edges are
+    extended with the first and last elevation.
+    :param elevation: elevation in m
+    :param n: window size, odd
+    :param order: polynomial degree, lower than n
+    :return: filtered elevation
+    """
+    n = _odd_window(n, len(elevation))
+    order = min(order, n - 1)
+    if n <= 1:
+        return elevation.copy()
+
+    # Convolution coefficients: first row of the Vandermonde pseudo-inverse
+    x = np.arange(-(n // 2), n // 2 + 1)
+    coef = np.linalg.pinv(x[:, None] ** np.arange(order + 1))[0]
+
+    padded = np.pad(elevation.astype('float64'), n // 2, mode='edge')
+    return np.convolve(padded, coef[::-1], mode='valid')
+
+
+def hysteresis(elevation: np.array,
+               threshold: float = c.hysteresis_threshold) -> np.array:
+    """
+    Hysteresis or dead band filter: each output is the previous one clamped
+    to [elevation - threshold, elevation + threshold]. Clamps compose into
+    clamps, so the sequence is solved as a prefix scan in log2(n) vectorized
+    steps.
+    :param elevation: elevation in m
+    :param threshold: maximum distance between input and output in m
+    :return: filtered elevation
+    """
+    elevation = elevation.astype('float64')
+    low = elevation - threshold
+    high = elevation + threshold
+
+    # After each step, point i holds the composition of the clamps from
+    # point i - 2 * shift + 1 to point i
+    shift = 1
+    while shift < len(elevation):
+        new_low = np.clip(low[:-shift], low[shift:], high[shift:])
+        new_high = np.clip(high[:-shift], low[shift:], high[shift:])
+        low[shift:] = new_low
+        high[shift:] = new_high
+        shift *= 2
+
+    return np.clip(elevation[:1], low, high)
+
+
+FILTERS = {'moving_average': moving_average,
+           'median': median,
+           'savitzky_golay': savitzky_golay,
+           'hysteresis': hysteresis}
+
+
+def filter_elevation(elevation: np.array, method: str,
+                     **kwargs) -> np.array:
+    """
+    Apply a filter to an elevation profile.
+    :param elevation: elevation in m
+    :param method: moving_average, median, savitzky_golay or hysteresis
+    :param kwargs: parameters of the filter
+    :return: filtered elevation
+    """
+    try:
+        function = FILTERS[method]
+    except KeyError:
+        raise ValueError(f'Unknown elevation filter: {method}')
+
+    return function(elevation, **kwargs)
+
+
+def filter_segments(elevation: np.array, bounds: list, method: str,
+                    processes: int = None, **kwargs) -> list:
+    """
+    Apply a filter to several segments of a track, each one independently.
+    :param elevation: elevation of the full track in m
+    :param bounds: first and last+1 points of each segment
+    :param method: moving_average, median, savitzky_golay or hysteresis
+    :param processes: number of processes, None or 1 to work in the current
+        process
+    :param kwargs: parameters of the filter
+    :return: filtered elevation of each segment
+    """
+    function = functools.partial(filter_elevation, method=method, **kwargs)
+    segments = [elevation[start:stop] for start, stop in bounds]
+
+    if processes is None or processes <= 1 or len(segments) <= 1:
+        return [function(segment) for segment in segments]
+
+    # Spawn avoids forking the GUI process and its threads
+    with concurrent.futures.ProcessPoolExecutor(
+            processes,
+            mp_context=multiprocessing.get_context('spawn')) as executor:
+        return list(executor.map(function, segments))
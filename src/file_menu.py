@@ -9,10 +9,12 @@ import os
 import tkinter as tk
 import tkinter.filedialog as filedialog
 import tkinter.messagebox as messagebox
-import pandas as pd
-import types
 
+import constants as c
+import iosm
 import plots
+import prefetch
+import session
 import track
 import utils
 
@@ -39,26 +41,30 @@ class FileMenu(tk.Menu):
                                   command=self.save_session)
         self.filemenu.add_command(label='Save gpx',
                                   command=self.save_gpx)
+        self.filemenu.add_command(label='Download map',
+                                  command=self.download_map)
         self.filemenu.add_separator()
         self.filemenu.add_command(label='Exit',
-                                  command=lambda: utils.quit_app(self.parent))
+                                  command=self.controller.close)
         parent.add_cascade(label='File', menu=self.filemenu)
 
     @utils.exception_handler
     def load_track(self):
         """
-        Load a gpx file into the track object.
+        Load one or several gpx files into the track object. Files are
+        parsed in parallel and plots are updated once.
         """
-        # Load gpx file
-        gpx_file = filedialog.askopenfile(
+        # Load gpx files
+        gpx_files = filedialog.askopenfilenames(
             initialdir=os.getcwd(),
-            title='Select gpx file',
+            title='Select gpx files',
             filetypes=[('Gps data file', '*.gpx'), ('All files', '*')])
 
         # def load_track_controller(gpx_file_name):
         #    self.controller.shared_data.obj_track.add_gpx(gpx_file_name)
-        if gpx_file:  # user may close filedialog
-            self.controller.shared_data.obj_track.add_gpx(gpx_file.name)
+        if gpx_files:  # user may close filedialog
+            self.controller.shared_data.obj_track.add_gpx_files(
+                list(gpx_files))
 
             # Insert plot
             track_info_table = plots.update_plots(
@@ -86,9 +92,9 @@ class FileMenu(tk.Menu):
     @utils.exception_handler
     def load_session(self):
         """
-        Load a .h5 file. This file has to be previously created with this same
-        application, since it stores all the data as defined in save_session
-        method.
+        Load a session file. This file has to be previously created with this
+        same application, since it stores all the data as defined in
+        save_session method. Former .h5 sessions are also accepted.
         """
         proceed = True
 
@@ -102,45 +108,30 @@ class FileMenu(tk.Menu):
             session_file = filedialog.askopenfile(
                 initialdir=os.getcwd(),
                 title='Select session file',
-                filetypes=[('Session file', '*.h5;*.hdf5;*he5'),
+                filetypes=[('Session file', f'*{session.EXTENSION}'),
+                           ('Former session file', '*.h5;*.hdf5;*he5'),
                            ('All files', '*')])
             if session_file:
-                with pd.HDFStore(session_file.name) as store:
-                    session_track = store['session']
-                    session_meta = store.get_storer('session').attrs.metadata
-
-                    # Load new track
-                    self.controller.shared_data.obj_track.df_track = \
-                        session_track
-                    self.controller.shared_data.obj_track.size = \
-                        session_meta.size
-                    self.controller.shared_data.obj_track.total_distance = \
-                        session_meta.total_distance
-                    self.controller.shared_data.obj_track.total_uphill = \
-                        session_meta.total_uphill
-                    self.controller.shared_data.obj_track.total_downhill = \
-                        session_meta.total_downhill
-                    self.controller.shared_data.obj_track.last_segment_idx = \
-                        session_meta.last_segment_idx
-                    self.controller.shared_data.obj_track.extremes = \
-                        session_meta.extremes
-
-                    # Insert plot
-                    track_info_table = plots.update_plots(
-                        self.controller.shared_data.obj_track,
-                        self.controller.shared_data.ax_track,
-                        self.controller.shared_data.ax_ele,
-                        self.controller.shared_data.ax_track_info,
-                        canvas=self.controller.shared_data.canvas)
-
-                    cid = plots.segment_selection(
-                        self.controller.shared_data.obj_track,
-                        self.controller.shared_data.ax_track,
-                        self.controller.shared_data.ax_ele,
-                        self.controller.shared_data.fig_track,
-                        track_info_table)
-                    self.controller.shared_data.cid.append(cid)
-                    self.controller.shared_data.canvas.draw()
+                # Load new track
+                self.controller.shared_data.obj_track.load_session(
+                    session_file.name)
+
+                # Insert plot
+                track_info_table = plots.update_plots(
+                    self.controller.shared_data.obj_track,
+                    self.controller.shared_data.ax_track,
+                    self.controller.shared_data.ax_ele,
+                    self.controller.shared_data.ax_track_info,
+                    canvas=self.controller.shared_data.canvas)
+
+                cid = plots.segment_selection(
+                    self.controller.shared_data.obj_track,
+                    self.controller.shared_data.ax_track,
+                    self.controller.shared_data.ax_ele,
+                    self.controller.shared_data.fig_track,
+                    track_info_table)
+                self.controller.shared_data.cid.append(cid)
+                self.controller.shared_data.canvas.draw()
 
     @utils.exception_handler
     def new_session(self):
@@ -157,10 +148,12 @@ class FileMenu(tk.Menu):
 
         if proceed:
             # Delete former objects
+            self.controller.shared_data.obj_track.stop_autosave()
             del self.controller.shared_data.obj_track
 
             # Restart session
             self.controller.shared_data.obj_track = track.Track()
+            self.controller.shared_data.obj_track.start_autosave()
 
             # Plot
             plots.initial_plots(
@@ -179,33 +172,18 @@ class FileMenu(tk.Menu):
     @utils.exception_handler
     def save_session(self):
         """
-        Save data in used in a .h5 file. This file can be loaded later on with
-        the load_session method. All the information will be kept.
+        Save data in used in a session file. This file can be loaded later on
+        with the load_session method. All the information will be kept.
         """
-        session = self.controller.shared_data.obj_track.df_track
-
-        metadata = types.SimpleNamespace()
-        metadata.size = self.controller.shared_data.obj_track.size
-        metadata.extremes = self.controller.shared_data.obj_track.extremes
-        metadata.total_distance = \
-            self.controller.shared_data.obj_track.total_distance
-        metadata.total_uphill = \
-            self.controller.shared_data.obj_track.total_uphill
-        metadata.total_downhill = \
-            self.controller.shared_data.obj_track.total_downhill
-        metadata.last_segment_idx = \
-            self.controller.shared_data.obj_track.last_segment_idx
-
         session_filename = filedialog.asksaveasfilename(
             initialdir=os.getcwd(),
             title='Save session as',
-            filetypes=[('Session file', '*.h5')])
+            defaultextension=session.EXTENSION,
+            filetypes=[('Session file', f'*{session.EXTENSION}')])
 
         if session_filename:  # user may close filedialog
-            store = pd.HDFStore(session_filename)
-            store.put('session', session)
-            store.get_storer('session').attrs.metadata = metadata
-            store.close()
+            self.controller.shared_data.obj_track.save_session(
+                session_filename)
 
         messagebox.showinfo('Info', 'Your session file is ready :)')
 
@@ -224,9 +202,58 @@ class FileMenu(tk.Menu):
         gpx_filename = filedialog.asksaveasfilename(
             initialdir=os.getcwd(),
             title='Save track as',
-            filetypes=[('Gpx file', '*.gpx')])
+            filetypes=[('Gpx file', '*.gpx'),
+                       ('Compressed gpx file', '*.gpx.gz')])
 
         if gpx_filename:  # user may close filedialog
             self.controller.shared_data.obj_track.save_gpx(gpx_filename)
 
         messagebox.showinfo('Info', 'Your file is ready :)')
+
+    @utils.exception_handler
+    def download_map(self):
+        """
+        Download in the background the map tiles around the track, to use
+        the map offline. The plan is shown before starting, and an
+        interrupted download can be resumed.
+        """
+        job = self.controller.shared_data.prefetch_job
+        if job is not None and job.running:
+            messagebox.showinfo(
+                'Download map',
+                f'Map download in progress: {job.done}/{job.total} tiles')
+            return
+
+        if os.path.exists(c.prefetch_state_path) and messagebox.askyesno(
+                'Download map',
+                'A map download was interrupted. Do you wish to resume it?'):
+            job = prefetch.PrefetchJob.resume(c.prefetch_state_path)
+        else:
+            obj_track = self.controller.shared_data.obj_track
+            if obj_track.size == 0:
+                messagebox.showerror('Error', 'There is no track loaded')
+                return
+
+            iosm.DBH.open_db()
+            try:
+                prefetch_plan = prefetch.plan(obj_track.df_track.lat,
+                                              obj_track.df_track.lon,
+                                              db=iosm.DBH)
+            finally:
+                iosm.DBH.close_db()
+
+            if len(prefetch_plan) == 0:
+                messagebox.showinfo('Download map',
+                                    'The map is already downloaded')
+                return
+
+            message = f'Map around the track: {prefetch_plan}.\n' + \
+                'Do you wish to download it?'
+            if not messagebox.askokcancel(title='Download map',
+                                          message=message):
+                return
+            job = prefetch.PrefetchJob(prefetch_plan.tiles,
+                                       c.prefetch_state_path)
+
+        self.controller.shared_data.prefetch_job = job
+        job.start()
@@ -0,0 +1,199 @@
+"""GEODESY
+Vectorized distance computations between coordinates. All the functions work
+on whole numpy arrays of latitude and longitude in degrees and return
+distances in kilometers.
+
+Available methods, sorted from fastest to most accurate:
+    - haversine: spherical earth, error up to 0.6% compared to WGS-84.
+    - andoyer: Andoyer-Lambert flattening correction on the WGS-84
+    ellipsoid, relative error around 1e-5 for track-like distances.
+    - vincenty: iterative solution on the WGS-84 ellipsoid, agrees with
+    geopy geodesic (Karney) below the millimeter. Non converging pairs
+    (nearly antipodal points) are delegated to geopy.
+
+Author: alguerre
+License: MIT
+"""
+import numpy as np
+import geopy.distance
+
+import constants as c
+
+# WGS-84 ellipsoid
+A_AXIS = 6378.137  # km
+FLATTENING = 1 / 298.257223563
+B_AXIS = (1 - FLATTENING) * A_AXIS
+MEAN_RADIUS = 6371.0088  # km
+
+VINCENTY_TOLERANCE = 1e-12
+VINCENTY_MAX_ITERATIONS = 200
+
+
+def haversine(lat1, lon1, lat2, lon2) -> np.array:
+    """
+    Great circle distance on a spherical earth.
+    :param lat1: latitude of origin points in degrees
+    :param lon1: longitude of origin points in degrees
+    :param lat2: latitude of destination points in degrees
+    :param lon2: longitude of destination points in degrees
+    :return: distance in km
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+
+    return 2 * MEAN_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def andoyer(lat1, lon1, lat2, lon2) -> np.array:
+    """
+    Andoyer-Lambert approximation: great circle distance between reduced
+    latitudes plus a first order flattening correction.
+    :param lat1: latitude of origin points in degrees
+    :param lon1: longitude of origin points in degrees
+    :param lat2: latitude of destination points in degrees
+    :param lon2: longitude of destination points in degrees
+    :return: distance in km
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    beta1 = np.arctan((1 - FLATTENING) * np.tan(lat1))
+    beta2 = np.arctan((1 - FLATTENING) * np.tan(lat2))
+
+    # Central angle between reduced latitudes
+    a = np.sin((beta2 - beta1) / 2) ** 2 + \
+        np.cos(beta1) * np.cos(beta2) * np.sin((lon2 - lon1) / 2) ** 2
+    sigma = 2 * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+    p = (beta1 + beta2) / 2
+    q = (beta2 - beta1) / 2
+    sin_half = np.sin(sigma / 2)
+    cos_half = np.cos(sigma / 2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = (sigma - np.sin(sigma)) * \
+            (np.sin(p) * np.cos(q)) ** 2 / cos_half ** 2
+        y = (sigma + np.sin(sigma)) * \
+            (np.cos(p) * np.sin(q)) ** 2 / sin_half ** 2
+        distance = A_AXIS * (sigma - FLATTENING / 2 * (x + y))
+
+    return np.where(sin_half == 0, 0.0, distance)
+
+
+def vincenty(lat1, lon1, lat2, lon2) -> np.array:
+    """
+    Vincenty inverse formula on the WGS-84 ellipsoid. The iteration is
+    carried out for all the points at the same time, only those pairs which
+    have not converged yet are updated.
+    :param lat1: latitude of origin points in degrees
+    :param lon1: longitude of origin points in degrees
+    :param lat2: latitude of destination points in degrees
+    :param lon2: longitude of destination points in degrees
+    :return: distance in km
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(
+        *[np.asarray(x, dtype='float64') for x in (lat1, lon1, lat2, lon2)])
+    u1 = np.arctan((1 - FLATTENING) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - FLATTENING) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+    diff_lon = np.radians(lon2 - lon1)
+
+    lambda_ = diff_lon.copy()
+    sin_sigma = cos_sigma = sigma = cos_sq_alpha = cos_2sigma_m = None
+    pending = np.ones(lambda_.shape, dtype=bool)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for _ in range(VINCENTY_MAX_ITERATIONS):
+            sin_lambda, cos_lambda = np.sin(lambda_), np.cos(lambda_)
+            sin_sigma = np.hypot(
+                cos_u2 * sin_lambda,
+                cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lambda)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lambda
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(
+                sin_sigma == 0, 0.0,
+                cos_u1 * cos_u2 * sin_lambda / sin_sigma)
+            cos_sq_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(
+                cos_sq_alpha == 0, 0.0,
+                cos_sigma - 2 * sin_u1 * sin_u2 / cos_sq_alpha)
+            cc = FLATTENING / 16 * cos_sq_alpha * \
+                (4 + FLATTENING * (4 - 3 * cos_sq_alpha))
+            lambda_new = diff_lon + (1 - cc) * FLATTENING * sin_alpha * \
+                (sigma + cc * sin_sigma *
+                 (cos_2sigma_m + cc * cos_sigma *
+                  (-1 + 2 * cos_2sigma_m ** 2)))
+
+            # Converged pairs keep their lambda
+            moving = np.abs(lambda_new - lambda_) > VINCENTY_TOLERANCE
+            lambda_ = np.where(pending, lambda_new, lambda_)
+            pending &= moving
+            if not pending.any():
+                break
+
+        u_sq = cos_sq_alpha * (A_AXIS ** 2 - B_AXIS ** 2) / B_AXIS ** 2
+        coef_a = 1 + u_sq / 16384 * \
+            (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        coef_b = u_sq / 1024 * \
+            (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = coef_b * sin_sigma * \
+            (cos_2sigma_m + coef_b / 4 *
+             (cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+              coef_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) *
+              (-3 + 4 * cos_2sigma_m ** 2)))
+        distance = B_AXIS * coef_a * (sigma - delta_sigma)
+
+    distance = np.where(sin_sigma == 0, 0.0, distance)
+
+    # Nearly antipodal points do not converge, use geopy for them
+    pending &= np.isfinite(lat1 + lon1 + lat2 + lon2)
+    for i in zip(*np.nonzero(pending)):
+        distance[i] = geopy.distance.geodesic(
+            (lat1[i], lon1[i]), (lat2[i], lon2[i])).km
+
+    return distance
+
+
+METHODS = {'haversine': haversine,
+           'andoyer': andoyer,
+           'vincenty': vincenty}
+
+
+def distance(lat1, lon1, lat2, lon2,
+             method: str = c.distance_method) -> np.array:
+    """
+    Distance between pairs of points with the selected method.
+    :param lat1: latitude of origin points in degrees
+    :param lon1: longitude of origin points in degrees
+    :param lat2: latitude of destination points in degrees
+    :param lon2: longitude of destination points in degrees
+    :param method: haversine, andoyer or vincenty
+    :return: distance in km
+    """
+    try:
+        function = METHODS[method]
+    except KeyError:
+        raise ValueError(f'Unknown distance method: {method}')
+
+    return function(lat1, lon1, lat2, lon2)
+
+
+def point_to_point(lat, lon, method: str = c.distance_method) -> np.array:
+    """
+    Distance between each point and the previous one, the first point is at
+    0 km. Undefined distances (missing coordinates) are set to 0.
+    :param lat: latitude array in degrees
+    :param lon: longitude array in degrees
+    :param method: haversine, andoyer or vincenty
+    :return: distance in km, same length as the input
+    """
+    lat = np.asarray(lat, dtype='float64')
+    lon = np.asarray(lon, dtype='float64')
+
+    p2p_distance = np.zeros(lat.shape[0])
+    if lat.shape[0] > 1:
+        p2p_distance[1:] = distance(lat[:-1], lon[:-1], lat[1:], lon[1:],
+                                    method=method)
+
+    return np.nan_to_num(np.abs(p2p_distance))
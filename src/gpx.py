@@ -1,80 +1,293 @@
 """GPX
 This module manages load and save operations on GPX files.
 
+Files are parsed as a stream: track points are read one by one and moved in
+chunks to typed numpy buffers, so there is no limit on the file size and
+memory does not hold the XML tree. Files are written the same way, from
+chunks of the columns formatted by numpy. Gzip files (.gz) are supported in
+both directions.
+
 Author: alguerre
 License: MIT
 """
 import os
+import gzip
+import time
+import logging
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
 import pandas as pd
 import numpy as np
-import gpxpy
 
-import constants as c
+from column_store import ColumnStore
+
+logger = logging.getLogger(__name__)
+
+CHUNK_POINTS = 2 ** 16  # points parsed or formatted at once
+WRITE_BUFFER = 2 ** 20  # bytes
+
+GPX_HEADER = \
+    '<?xml version="1.0" encoding="UTF-8"?>\n' \
+    '<gpx xmlns="http://www.topografix.com/GPX/1/1" ' \
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" ' \
+    'xsi:schemaLocation="http://www.topografix.com/GPX/1/1 ' \
+    'http://www.topografix.com/GPX/1/1/gpx.xsd" version="1.1" ' \
+    'creator={creator}>\n'
+COLUMNS_TYPE = {'lat': 'float64', 'lon': 'float64', 'ele': 'float64',
+                'time': 'datetime64[ns]', 'track': 'int32',
+                'segment': 'int32'}
 
 
 class LoadGpxError(Exception):
     pass
 
 
+def _flush(chunk: dict, store: ColumnStore):
+    # Move the parsed points to the typed buffers
+    times = pd.to_datetime(chunk['time'], utc=True, errors='coerce')
+    store.append({'lat': np.array(chunk['lat'], dtype='float64'),
+                  'lon': np.array(chunk['lon'], dtype='float64'),
+                  'ele': np.array(chunk['ele'], dtype='float64'),
+                  'time': times.tz_convert(None).to_numpy('datetime64[ns]')})
+    for values in chunk.values():
+        values.clear()
+
+
+def parse(gpx_file, chunk_points: int = CHUNK_POINTS) -> ColumnStore:
+    """
+    Streaming parser of the track points of a GPX file. Elements are
+    discarded once read, so memory only holds the typed buffers and a chunk
+    of points as python objects. Numbering is the one of the former gpxpy
+    based parser: 'track' is the segment number inside its track and
+    'segment' the track number, both starting at 0.
+    :param gpx_file: path or binary file object
+    :param chunk_points: points kept as python objects before conversion
+    :return: column store with lat, lon, ele, time (UTC), track and segment
+    """
+    store = ColumnStore(COLUMNS_TYPE)
+    chunk = {'lat': [], 'lon': [], 'ele': [], 'time': []}
+    local_names = {}  # tag without namespace, GPX 1.0 and 1.1 differ
+    n_track, n_segment = 0, 0
+    runs = []  # points, track and segment number of each segment
+    n_points = 0  # points read in the current segment
+    parent = None  # open segment, read points are removed from it
+
+    # Elements are read on their end event: children are complete and
+    # segments are numbered when they are closed. Start events only keep
+    # the parent of the points.
+    for event, element in ET.iterparse(gpx_file, events=('start', 'end')):
+        tag = element.tag
+        try:
+            name = local_names[tag]
+        except KeyError:
+            name = local_names.setdefault(tag, tag.rpartition('}')[2])
+
+        if event == 'start':
+            if name == 'trkseg':
+                parent = element
+            continue
+
+        if name == 'trkpt':
+            ele, point_time = np.nan, None
+            for child in element:
+                child_name = local_names.get(child.tag)
+                if child_name == 'ele' and child.text:
+                    ele = float(child.text)
+                elif child_name == 'time':
+                    point_time = child.text
+            try:
+                lat = float(element.get('lat'))
+                lon = float(element.get('lon'))
+            except (TypeError, ValueError):
+                raise LoadGpxError(f'Point without valid lat and lon: '
+                                   f'{element.attrib}')
+            chunk['lat'].append(lat)
+            chunk['lon'].append(lon)
+            chunk['ele'].append(ele)
+            chunk['time'].append(point_time)
+            n_points += 1
+
+            # Read points are not needed anymore, neither cleared elements
+            # are kept in their segment
+            element.clear()
+            if parent is not None:
+                del parent[:]
+            if len(chunk['lat']) >= chunk_points:
+                _flush(chunk, store)
+
+        elif name == 'trkseg':
+            runs.append((n_points, n_segment, n_track))
+            n_points = 0
+            n_segment += 1
+            element.clear()
+            parent = None
+
+        elif name == 'trk':
+            n_track += 1
+            n_segment = 0
+            element.clear()
+
+        elif name in ('rte', 'wpt'):
+            element.clear()
+
+    if chunk['lat']:
+        _flush(chunk, store)
+
+    # Points of a segment which is not closed keep number 0
+    runs.append((len(store) - sum(run[0] for run in runs), 0, 0))
+    points, n_segments, n_tracks = np.array(runs).T
+    store.write('track', np.repeat(n_segments, points))
+    store.write('segment', np.repeat(n_tracks, points))
+    return store
+
+
+def _open(file: str, mode: str, compress: bool = None):
+    # Gzip is used for .gz files unless compression is explicitly given
+    if compress is None:
+        compress = str(file).endswith('.gz')
+    if compress:
+        return gzip.open(file, mode, encoding='utf-8' if 't' in mode
+                         else None)
+    if 'b' in mode:
+        return open(file, mode)
+    return open(file, mode, encoding='utf-8', buffering=WRITE_BUFFER)
+
+
+def _metadata(metadata: dict) -> str:
+    xml = '  <metadata>\n'
+    if metadata.get('description'):
+        xml += f'    <desc>{escape(metadata["description"])}</desc>\n'
+    if metadata.get('author_name') or metadata.get('author_email'):
+        xml += '    <author>\n'
+        if metadata.get('author_name'):
+            xml += f'      <name>{escape(metadata["author_name"])}</name>\n'
+        if metadata.get('author_email'):
+            name, _, domain = metadata['author_email'].partition('@')
+            xml += f'      <email id={quoteattr(name)} ' \
+                f'domain={quoteattr(domain)} />\n'
+        xml += '    </author>\n'
+    return xml + '  </metadata>\n'
+
+
+def _time_strings(times: np.array) -> list:
+    # ISO 8601 in UTC, fraction of seconds only when needed
+    nanoseconds = times.astype('int64') % 10 ** 9
+    strings = np.datetime_as_string(times, unit='s', timezone='UTC')
+    fraction = nanoseconds != 0
+    if fraction.any():
+        unit = 'us' if not (nanoseconds % 1000).any() else 'ns'
+        strings = strings.astype(object)
+        strings[fraction] = np.datetime_as_string(
+            times[fraction], unit=unit, timezone='UTC')
+    return strings.tolist()
+
+
+def _format_points(lat: np.array, lon: np.array, ele: np.array,
+                   times: np.array) -> str:
+    # Numbers are converted at once by numpy, with the shortest text which
+    # gives back the same value for their type
+    return ''.join(
+        f'      <trkpt lat="{point_lat}" lon="{point_lon}">\n' +
+        (f'        <ele>{point_ele}</ele>\n' if point_ele != 'nan' else '') +
+        (f'        <time>{point_time}</time>\n' if point_time != 'NaT'
+         else '') +
+        '      </trkpt>\n'
+        for point_lat, point_lon, point_ele, point_time in zip(
+            lat.astype(str).tolist(), lon.astype(str).tolist(),
+            ele.astype(str).tolist(), _time_strings(times)))
+
+
+def write(gpx_file: str, columns: dict, bounds: list,
+          metadata: dict = None, compress: bool = None,
+          chunk_points: int = CHUNK_POINTS):
+    """
+    Streaming writer of a GPX file with one track. Points are formatted
+    and written in chunks, so memory does not depend on the track size.
+    :param gpx_file: output file path
+    :param columns: lat, lon, ele and time arrays of all the points
+    :param bounds: first and last+1 points of each segment
+    :param metadata: creator, description, author_name and author_email
+    :param compress: gzip output, by default for .gz files
+    :param chunk_points: points formatted at once
+    """
+    metadata = metadata or {}
+    with _open(gpx_file, 'wt', compress) as f:
+        f.write(GPX_HEADER.format(
+            creator=quoteattr(metadata.get('creator', ''))))
+        f.write(_metadata(metadata))
+        f.write('  <trk>\n')
+
+        for start, stop in bounds:
+            f.write('    <trkseg>\n')
+            for first in range(start, stop, chunk_points):
+                last = min(first + chunk_points, stop)
+                f.write(_format_points(*[columns[name][first:last] for name
+                                         in ['lat', 'lon', 'ele', 'time']]))
+            f.write('    </trkseg>\n')
+
+        f.write('  </trk>\n</gpx>\n')
+
+
 class Gpx:
     """
     Management of load and save operations for GPX files.
+        - n_points: number of track points
+        - parse_time: time spent parsing the file in s
     """
     def __init__(self, file):
         # Private attributes
         self.filename = os.path.basename(file)
         self.filepath = os.path.abspath(file)
         self._state = False
-        self._gpx = self._load_file()
-        if not self._gpx:
+        self.n_points = 0
+        self.parse_time = 0
+        self._data = self._load_file()
+        if self._data is None:
             raise LoadGpxError(f"Not able to load {self.filename}")
         self._gpx_dict = None
 
         # Public attributes
         self.df = None
 
-    def _load_file(self):
-        if os.stat(self.filepath).st_size < c.maximum_file_size:
-            try:
-                gpx_file = open(self.filepath, 'r')
-                self._state = True
-                return gpxpy.parse(gpx_file)
+    @property
+    def points_per_second(self) -> float:
+        return self.n_points / self.parse_time if self.parse_time > 0 \
+            else 0
 
-            except PermissionError:
-                self._state = False
-                return None
+    def _load_file(self) -> ColumnStore:
+        start = time.perf_counter()
+        try:
+            with _open(self.filepath, 'rb') as gpx_file:
+                data = parse(gpx_file)
 
-        else:
+        except (FileNotFoundError, PermissionError, ET.ParseError,
+                gzip.BadGzipFile, EOFError, TypeError, ValueError,
+                LoadGpxError) as e:
+            logger.error(f'Not able to parse {self.filename}: {e}')
             self._state = False
             return None
 
+        self.parse_time = time.perf_counter() - start
+        self.n_points = len(data)
+        self._state = True
+        logger.info(f'{self.filename}: {self.n_points} points parsed in '
+                    f'{self.parse_time:.2f} s '
+                    f'({self.points_per_second:.0f} points/s)')
+        return data
+
     def to_dict(self):
-        self._gpx_dict = {"lat": [], "lon": [], "ele": [], "time": [],
-                          "track": [], "segment": []}
-
-        n_tracks = len(self._gpx.tracks)
-        n_segments = [len(track.segments) for track in self._gpx.tracks]
-
-        for i_track in range(n_tracks):
-            for i_seg in range(n_segments[i_track]):
-                for i_point in \
-                        self._gpx.tracks[i_track].segments[i_seg].points:
-                    self._gpx_dict["lat"].append(i_point.latitude)
-                    self._gpx_dict["lon"].append(i_point.longitude)
-                    self._gpx_dict["ele"].append(i_point.elevation)
-                    self._gpx_dict["time"].append(i_point.time)  # This is
-                    # datetime.datetime format
-                    self._gpx_dict["track"].append(i_seg)
-                    self._gpx_dict["segment"].append(i_track)
+        # Lists of python objects, as provided by gpxpy: time is
+        # datetime.datetime or None
+        self._gpx_dict = {name: self._data[name].tolist()
+                          for name in ['lat', 'lon', 'ele', 'track',
+                                       'segment']}
+        self._gpx_dict['time'] = [
+            None if pd.isnull(point_time) else point_time.to_pydatetime()
+            for point_time in pd.DatetimeIndex(self._data['time'])]
         return self._gpx_dict
 
     def to_pandas(self):
-        if not self._gpx_dict:
-            self.to_dict()
-
-        self.df = pd.DataFrame(self._gpx_dict,
-                               columns=['lat', 'lon', 'ele',
-                                        'time', 'track', 'segment'])
-        self.df["time"] = self.df["time"].values.astype(np.datetime64)
+        self.df = self._data.to_pandas()
 
         return self.df.copy()
@@ -0,0 +1,128 @@
+"""GPX_CACHE
+Disk cache of parsed GPX files, so that files already seen are loaded
+without parsing XML nor computing geodesic distances again.
+
+Entries are identified by the hash of the file content, not by its name, so
+renamed or copied files are found too. Each entry is a directory with one
+.npy file per column, which is loaded as a read-only memory map: only the
+data really used is read from disk. When the cache is over its size, the
+least recently used entries are removed.
+
+Author: alguerre
+License: MIT
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+import constants as c
+import utils
+
+CACHE_VERSION = 1  # change it when the content of the entries changes
+CACHE_COLUMNS = ['lat', 'lon', 'ele', 'time', 'p2p_distance']
+TMP_PREFIX = '.tmp-'  # entries being written
+
+
+class GpxCache:
+    """
+    Cache of parsed gpx files on disk.
+        - path: directory of the cache, created when needed
+        - max_size: bytes, 0 disables the cache
+        - hits and misses: number of get calls finding or not the entry
+    """
+    def __init__(self, path: str = c.gpx_cache_path,
+                 max_size: float = c.gpx_cache_size):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(file: str) -> str:
+        return GpxCache.keys([file])[0]
+
+    @staticmethod
+    def keys(files: list) -> list:
+        # Same content parsed with the same distance gives the same data.
+        # A short BLAKE2 digest is enough to identify files and faster than
+        # md5.
+        return [f'{digest}-{c.distance_method}-v{CACHE_VERSION}'
+                for digest in utils.hash_files(files, algorithm='blake2b',
+                                               digest_size=16)]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def get(self, key: str) -> dict:
+        """
+        Data of a cached file.
+        :param key: see key method
+        :return: memory mapped arrays, None if the file is not cached
+        """
+        entry = os.path.join(self.path, key)
+        try:
+            data = {column: np.load(os.path.join(entry, f'{column}.npy'),
+                                    mmap_mode='r')
+                    for column in CACHE_COLUMNS}
+            os.utime(entry)  # last access for LRU eviction
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return data
+
+    def put(self, key: str, data: dict):
+        """
+        Store the data of a file, the least recently used entries are
+        removed if the cache gets too big.
+        :param key: see key method
+        :param data: arrays of CACHE_COLUMNS
+        """
+        if self.max_size <= 0:
+            return
+        os.makedirs(self.path, exist_ok=True)
+
+        # Entries are written aside and renamed, so readers never see a
+        # partial one
+        tmp_entry = tempfile.mkdtemp(prefix=TMP_PREFIX, dir=self.path)
+        for column in CACHE_COLUMNS:
+            # Plain dtype, arrays from other processes may have metadata
+            values = np.asarray(data[column])
+            np.save(os.path.join(tmp_entry, f'{column}.npy'),
+                    values.view(values.dtype.str))
+        try:
+            os.rename(tmp_entry, os.path.join(self.path, key))
+        except OSError:  # already cached
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+        self._evict()
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _entries(self) -> list:
+        # Last access, size and path of each entry
+        if not os.path.isdir(self.path):
+            return []
+
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.is_dir() and not entry.name.startswith(TMP_PREFIX):
+                size = sum(column.stat().st_size
+                           for column in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, size, entry.path))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        size = sum(entry_size for _, entry_size, _ in entries)
+
+        for _, entry_size, entry in entries:
+            if size <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            size -= entry_size
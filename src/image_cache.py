@@ -0,0 +1,88 @@
+"""IMAGE_CACHE
+Memory cache of decoded images, so that the map is drawn again without
+reading nor decoding the tiles.
+
+Images are kept as read-only arrays: users get the cached array itself, not
+a copy. When the cache is over its memory budget, the least recently used
+images are removed.
+
+Author: alguerre
+License: MIT
+"""
+import collections
+import threading
+
+import numpy as np
+
+
+class ImageCache:
+    """
+    LRU cache of image arrays, it can be used from several threads.
+        - max_size: bytes, 0 disables the cache
+        - nbytes: bytes of the cached images
+        - hits and misses: number of get calls finding or not the image
+    """
+    def __init__(self, max_size: float):
+        self.max_size = max_size
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._images = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._images)
+
+    def __contains__(self, key) -> bool:
+        return key in self._images
+
+    def get(self, key) -> np.array:
+        """
+        Cached image, it becomes the most recently used.
+        :param key: any hashable, e.g. (zoom, x, y) of a tile
+        :return: read-only array, None if the image is not cached
+        """
+        with self._lock:
+            image = self._images.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+
+            self._images.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key, image: np.array) -> np.array:
+        """
+        Store an image, the least recently used ones are removed if the
+        cache gets too big.
+        :param key: any hashable
+        :param image: array, it must not be modified afterwards
+        :return: read-only image
+        """
+        image.flags.writeable = False
+        if image.nbytes > self.max_size:
+            return image
+
+        with self._lock:
+            if key in self._images:
+                self.nbytes -= self._images.pop(key).nbytes
+            self._images[key] = image
+            self.nbytes += image.nbytes
+
+            while self.nbytes > self.max_size:
+                _, evicted = self._images.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return image
+
+    def remove(self, key):
+        # Forget an image, e.g. when its file changes
+        with self._lock:
+            image = self._images.pop(key, None)
+            if image is not None:
+                self.nbytes -= image.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self.nbytes = 0
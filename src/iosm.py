@@ -1,19 +1,46 @@
 """ IOSM
 refers to Interface with Open Street Map. The tiles to generate the base maps
 are downloaded and registered in the database with this module.
+
+Tiles are downloaded concurrently by a small pool of threads sharing one HTTP
+session, so connections are reused. Requests to each host are limited by a
+token bucket and a number of parallel requests to respect the OSM tile usage
+policy; these limits are shared by all the downloaders, e.g. the map and a
+prefetch job. Only the downloads run in the threads: the database is always
+used from the calling thread.
+
+Tiles expire as told by the cache headers of the server. Expired tiles are
+still used to draw the map, and they are revalidated in the background with
+conditional requests: the server answers not modified without the tile if
+it has not changed.
+
+Tiles are stored as zoom/x/y.png files, or in a single MBTiles file if
+constants.tiles_mbtiles is set.
 """
 import os
 import math
+import time
 import logging
+import email.utils
+import threading
+import concurrent.futures
+import urllib.parse
 import requests
 
 import constants as c
 from db_handler import DbHandler
+from mbtiles import MBTiles
+from tile_cache import TileCache
 
 LOGGER = logging.getLogger(__name__)
 
 DBH = DbHandler(c.db_path)
 
+# Token bucket and parallel requests semaphore of each host, for all the
+# downloaders
+HOST_LIMITS = {}
+_HOST_LIMITS_LOCK = threading.Lock()
+
 
 def deg2num(lat_deg: float, lon_deg: float, zoom: int) -> (int, int):
     """
@@ -45,66 +72,438 @@ def num2deg(xtile: int, ytile: int, zoom: int) -> (float, float):
     return lat_deg, lon_deg
 
 
-def _download_url(zoom: int, xtile: int, ytile: int) -> bool:
+class TokenBucket:
     """
-    Manage URL request to download tiles from OSM
-    :param zoom: zoom grade
-    :param xtile: OSM X-tile
-    :param ytile: OSM Y-tile
-    :return: True if tile is correct
+    Rate limiter shared by threads: each request takes a token, tokens are
+    refilled at a constant rate up to the bucket capacity.
+        - rate: tokens per second
+        - capacity: maximum tokens, requests allowed at once
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # Tokens may be reserved in advance, the wait is outside the lock
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity,
+                               self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+class DownloadReport:
+    """
+    Result of downloading a batch of tiles.
+        - tiles: requested tiles
+        - available: tiles already downloaded, or not modified when they
+          are refreshed
+        - downloaded: valid tiles received
+        - failed: tiles not received or not valid
+        - bytes: size of the downloaded tiles
+        - seconds: duration of the batch
     """
-    # Define path
-    dir_path = f'{c.prj_path}/tiles/{zoom}/{xtile}/'
-    tile_path = f'{dir_path}/{ytile}.png'
-    if not os.path.exists(dir_path):
-        LOGGER.debug(f'Creating directory: {dir_path}')
-        os.makedirs(dir_path)
-
-    # Check if request is needed
-    if os.path.isfile(tile_path):
-        if DBH.get_tile_size(zoom, xtile, ytile) > 0:
-            LOGGER.info(f'Tile ({zoom},{xtile},{ytile}) ' +
-                        f'is already available at {tile_path}')
-            return True
-        else:
-            DBH.remove_tile(zoom, xtile, ytile)
-    else:
-        DBH.remove_tile(zoom, xtile, ytile)
-
-    # Request
-
-    url = f'https://c.tile.openstreetmap.org/{zoom}/{xtile}/{ytile}.png'
-    LOGGER.debug(f'Request to: {url}')
-    response = requests.get(url)
-
-    # Store content
-    with open(tile_path, 'wb') as destination:
-        if response.status_code == 200:
-            destination.write(response.content)
+    def __init__(self, tiles: int):
+        self.tiles = tiles
+        self.available = 0
+        self.downloaded = 0
+        self.failed = 0
+        self.bytes = 0
+        self.seconds = 0
+
+    @property
+    def valid(self) -> int:
+        return self.available + self.downloaded
+
+    def add(self, other):
+        # Accumulate the report of another batch
+        self.tiles += other.tiles
+        self.available += other.available
+        self.downloaded += other.downloaded
+        self.failed += other.failed
+        self.bytes += other.bytes
+        self.seconds += other.seconds
+
+    @property
+    def tiles_per_second(self) -> float:
+        return self.downloaded / self.seconds if self.seconds > 0 else 0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.seconds if self.seconds > 0 else 0
+
+    def __str__(self):
+        return (f'{self.tiles} tiles: {self.available} available, '
+                f'{self.downloaded} downloaded, {self.failed} failed, '
+                f'{self.bytes / 1024:.1f} kB in {self.seconds:.2f} s '
+                f'({self.tiles_per_second:.1f} tiles/s, '
+                f'{self.bytes_per_second / 1024:.1f} kB/s)')
+
+
+class TileDownloader:
+    """
+    Concurrent download of tiles.
+        - db: tiles database, the caller must open it
+        - url: tile server, with zoom, x and y fields
+        - tiles_path: tiles are stored as zoom/x/y.png
+        - store: single file of the tiles instead, see mbtiles
+        - workers: parallel requests
+        - rate and burst: requests per second and host, see TokenBucket
+        Limits of a host are set by the first downloader using it.
+        - hits and misses: requested tiles found or not on disk
+        - on_update: called with (zoom, x, y) when a refresh replaces a
+          tile, e.g. to drop its decoded image
+    """
+    def __init__(self, db: DbHandler, url: str = c.tiles_url,
+                 tiles_path: str = c.tiles_path,
+                 workers: int = c.download_workers,
+                 rate: float = c.download_rate,
+                 burst: float = c.download_burst,
+                 timeout: float = c.download_timeout,
+                 store: MBTiles = None):
+        self.db = db
+        self.store = store
+        self.url = url
+        self.tiles_path = tiles_path
+        self.workers = workers
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.on_update = None
+
+        # Connections are kept alive and shared by the workers and the
+        # background refresh
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=workers,
+                                                pool_maxsize=workers + 1)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['User-Agent'] = \
+            f'{c.tool}/{c.version} ({c.email})'
+
+        self._refreshing = set()
+        self._refresh_threads = []
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def hit_rate(self) -> float:
+        requested = self.hits + self.misses
+        return self.hits / requested if requested > 0 else 0
+
+    def tile_path(self, zoom: int, xtile: int, ytile: int) -> str:
+        return f'{self.tiles_path}/{zoom}/{xtile}/{ytile}.png'
+
+    def _registered_path(self, zoom: int, xtile: int, ytile: int) -> str:
+        # Tiles of the single file have no path of their own
+        return self.tile_path(zoom, xtile, ytile) if self.store is None \
+            else ''
+
+    def _stored(self, tile: tuple) -> bool:
+        if self.store is not None:
+            return tile in self.store
+        return os.path.isfile(self.tile_path(*tile))
+
+    def download(self, tiles: list) -> DownloadReport:
+        """
+        Download the tiles which are not available yet and register them in
+        the database. Expired tiles are available, they are refreshed in the
+        background.
+        :param tiles: (zoom, x, y) of each tile
+        :return: report of the batch
+        """
+        report = DownloadReport(len(tiles))
+        start = time.monotonic()
+
+        statuses = tile_statuses(self.db, tiles)
+        missing = [tile for tile in tiles if not (
+            statuses.get(tile) and self._stored(tile))]
+        report.available = len(tiles) - len(missing)
+        self.hits += report.available
+        self.misses += len(missing)
+        if report.available:
+            # Last access for the eviction of the least recently used
+            available = set(tiles) - set(missing)
+            self.db.touch_tiles(available)
+
+            # Tiles without expiry were downloaded before it was registered
+            now = time.time()
+            stale = {tile: validators for tile, validators in
+                     tile_validators(self.db, available).items()
+                     if tile in available and
+                     (validators[2] is None or validators[2] <= now)}
+            if stale:
+                self.refresh_in_background(stale)
+
+        downloaded = []
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+            futures = {executor.submit(self._fetch, *tile): tile
+                       for tile in missing}
+            for future in concurrent.futures.as_completed(futures):
+                zoom, xtile, ytile = futures[future]
+                try:
+                    valid, size, validators = future.result()
+                except Exception as e:
+                    LOGGER.error('Error downloading tile ' +
+                                 f'({zoom},{xtile},{ytile}): {e}')
+                    valid, size, validators = False, 0, ()
+
+                downloaded.append((zoom, xtile, ytile, valid,
+                                   self._registered_path(zoom, xtile, ytile),
+                                   size, *validators))
+                if valid:
+                    report.downloaded += 1
+                    report.bytes += size
+                else:
+                    report.failed += 1
+
+        # All the tiles are registered at once
+        self.db.insert_tiles(downloaded)
+        report.seconds = time.monotonic() - start
+        if missing:
+            LOGGER.info(f'Tiles download: {report}, '
+                        f'{100 * self.hit_rate:.1f}% hit rate')
+        return report
+
+    def refresh(self, tiles: dict, db: DbHandler) -> DownloadReport:
+        """
+        Revalidate tiles with conditional requests, one after the other.
+        Tiles which cannot be refreshed are kept as they are.
+        :param tiles: (zoom, x, y): (ETag, Last-Modified, expiry time)
+        :param db: tiles database, open in the calling thread
+        :return: report, not modified tiles are available
+        """
+        report = DownloadReport(len(tiles))
+        start = time.monotonic()
+
+        not_modified, modified = [], []
+        for (zoom, xtile, ytile), (etag, last_modified, _) in tiles.items():
+            try:
+                valid, size, validators = self._fetch(zoom, xtile, ytile,
+                                                      etag, last_modified)
+            except Exception as e:
+                LOGGER.error('Error refreshing tile ' +
+                             f'({zoom},{xtile},{ytile}): {e}')
+                valid, size = False, 0
+
+            if not valid:
+                report.failed += 1
+            elif size is None:
+                not_modified.append((zoom, xtile, ytile, *validators))
+                report.available += 1
+            else:
+                modified.append((zoom, xtile, ytile, True,
+                                 self._registered_path(zoom, xtile, ytile),
+                                 size, *validators))
+                report.downloaded += 1
+                report.bytes += size
+
+        db.update_tile_validators(not_modified)
+        db.insert_tiles(modified)
+        if self.on_update is not None:
+            for tile in modified:
+                self.on_update(tile[:3])
+
+        report.seconds = time.monotonic() - start
+        LOGGER.info(f'Tiles refresh: {report}')
+        return report
+
+    def refresh_in_background(self, tiles: dict):
+        """
+        Refresh tiles in a thread with its own database connection. Tiles
+        already being refreshed are skipped.
+        :param tiles: (zoom, x, y): (ETag, Last-Modified, expiry time)
+        """
+        with self._refresh_lock:
+            tiles = {tile: validators for tile, validators in tiles.items()
+                     if tile not in self._refreshing}
+            if not tiles:
+                return
+            self._refreshing.update(tiles)
+            thread = threading.Thread(target=self._refresh, args=(tiles,),
+                                      daemon=True)
+            self._refresh_threads = [
+                t for t in self._refresh_threads if t.is_alive()] + [thread]
+        thread.start()
+
+    def wait_refresh(self, timeout: float = None):
+        for thread in list(self._refresh_threads):
+            thread.join(timeout)
+
+    def _refresh(self, tiles: dict):
+        db = DbHandler(self.db.db_path)
+        db.open_db()
+        try:
+            self.refresh(tiles, db)
+        except Exception as e:
+            LOGGER.error(f'Tiles refresh failed: {e}')
+        finally:
+            db.close_db()
+            with self._refresh_lock:
+                self._refreshing.difference_update(tiles)
+
+    def _host_limits(self, url: str) -> (TokenBucket, threading.Semaphore):
+        host = urllib.parse.urlsplit(url).netloc
+        with _HOST_LIMITS_LOCK:
+            if host not in HOST_LIMITS:
+                HOST_LIMITS[host] = (TokenBucket(self.rate, self.burst),
+                                     threading.BoundedSemaphore(self.workers))
+            return HOST_LIMITS[host]
+
+    def _fetch(self, zoom: int, xtile: int, ytile: int, etag: str = None,
+               last_modified: str = None) -> (bool, int, tuple):
+        """
+        Request a tile and store it, it runs in the worker threads. The
+        request is conditional if the validators of the stored tile are
+        given.
+        :return: True if the tile is correct, its size, None if it is not
+            modified, and its validators: ETag, Last-Modified and expiry time
+        """
+        url = self.url.format(zoom=zoom, x=xtile, y=ytile)
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        bucket, connections = self._host_limits(url)
+        bucket.acquire()
+
+        LOGGER.debug(f'Request to: {url}')
+        with connections, self.session.get(url, headers=headers,
+                                           timeout=self.timeout) as response:
+            validators = (response.headers.get('ETag'),
+                          response.headers.get('Last-Modified'),
+                          expiry_time(response.headers))
+            if response.status_code == 304:
+                LOGGER.debug(f'Tile ({zoom},{xtile},{ytile}) not modified')
+                return True, None, validators
+
+            if response.status_code != 200:
+                LOGGER.error(f'Error in request url={url},' +
+                             f'reason={response.reason},' +
+                             f'status={response.status_code}')
+                return False, 0, ()
+
+            # Check downloaded info, the size is unknown with chunked
+            # transfer and it is the compressed one with content encoding
+            content = response.content
+            request_size = response.headers.get('Content-Length')
+            if request_size is not None and \
+                    'Content-Encoding' not in response.headers and \
+                    int(request_size) != len(content):
+                LOGGER.error('Size check has failed for tile ' +
+                             f'({zoom},{xtile},{ytile}) at {url}')
+                return False, 0, ()
+
+            self._write(zoom, xtile, ytile, content)
             LOGGER.info(f'Tile ({zoom},{xtile},{ytile})' +
                         f'has been downloaded at {url}')
-        else:
-            # empty file has been created
-            LOGGER.error(f'Error in request url={url},' +
-                         f'reason={response.reason},' +
-                         f'status={response.status_code}')
-        destination.close()
 
-    # Check downloaded info
-    valid_tail = False
-    request_size = response.headers.get("Content-Length")
-    tile_size = os.stat(tile_path).st_size
+        return True, len(content), validators
+
+    def _write(self, zoom: int, xtile: int, ytile: int, content: bytes):
+        # Replaced at once, a map being drawn never reads half a tile
+        if self.store is not None:
+            self.store.put_tiles([(zoom, xtile, ytile, content)])
+            return
+
+        tile_path = self.tile_path(zoom, xtile, ytile)
+        os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+        temp_path = f'{tile_path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as destination:
+            destination.write(content)
+        os.replace(temp_path, tile_path)
+
+
+def expiry_time(headers: dict) -> float:
+    """
+    Expiry time of a response from its cache headers: max-age of
+    Cache-Control first, then Expires.
+    :param headers: HTTP response headers
+    :return: seconds since epoch, c.tiles_max_age from now if the server
+        does not tell
+    """
+    now = time.time()
+    for directive in headers.get('Cache-Control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        if name.lower() in ('no-cache', 'no-store'):
+            return now
+        if name.lower() == 'max-age':
+            try:
+                return now + int(value.strip('"'))
+            except ValueError:
+                break
+
+    expires = headers.get('Expires')
+    if expires:
+        try:
+            return email.utils.parsedate_to_datetime(expires).timestamp()
+        except (TypeError, ValueError):
+            return now  # invalid dates mean already expired
+
+    return now + c.tiles_max_age
+
+
+STORE = MBTiles(c.tiles_mbtiles) if c.tiles_mbtiles else None
+if STORE is not None:
+    STORE.open()  # kept open, tiles are read through this connection
+DOWNLOADER = TileDownloader(DBH, store=STORE)
+TILE_CACHE = TileCache(c.db_path, store=STORE)
+
+
+def tile_statuses(db: DbHandler, tiles: list) -> dict:
+    """
+    Status of the tiles in the database, with one query per zoom.
+    :param db: tiles database
+    :param tiles: (zoom, x, y) of each tile
+    :return: (zoom, x, y): status, tiles not in the database are missing
+    """
+    return _query_boxes(tiles, db.get_tile_statuses)
+
+
+def tile_validators(db: DbHandler, tiles: list) -> dict:
+    """
+    HTTP validators of the valid tiles, with one query per zoom.
+    :param db: tiles database
+    :param tiles: (zoom, x, y) of each tile
+    :return: (zoom, x, y): (ETag, Last-Modified, expiry time), other tiles
+        of the bounding boxes may be included
+    """
+    return _query_boxes(tiles, db.get_tile_validators)
 
-    if int(request_size) == tile_size:
-        valid_tail = True
-    else:
-        LOGGER.error('Size check has failed for tail ' +
-                     f'({zoom},{xtile},{ytile}) at {tile_path}')
 
-    DBH.insert_tile(zoom, xtile, ytile, valid_tail, tile_path, tile_size)
-    response.close()
+def _query_boxes(tiles, query) -> dict:
+    # Query the bounding box of the tiles of each zoom
+    boxes = {}
+    for zoom, xtile, ytile in tiles:
+        box = boxes.get(zoom, (xtile, ytile, xtile, ytile))
+        boxes[zoom] = (min(box[0], xtile), min(box[1], ytile),
+                       max(box[2], xtile), max(box[3], ytile))
 
-    return valid_tail
+    result = {}
+    for zoom, box in boxes.items():
+        result.update(query(zoom, *box))
+    return result
+
+
+def _download_url(zoom: int, xtile: int, ytile: int) -> bool:
+    """
+    Manage URL request to download tiles from OSM
+    :param zoom: zoom grade
+    :param xtile: OSM X-tile
+    :param ytile: OSM Y-tile
+    :return: True if tile is correct
+    """
+    return DOWNLOADER.download([(zoom, xtile, ytile)]).valid == 1
 
 
 def download_tiles_by_deg(lat_min: float, lon_min: float,
@@ -121,20 +520,19 @@ def download_tiles_by_deg(lat_min: float, lon_min: float,
     :param extra_tiles: surrounding tiles to download
     :return: total number of tiles in the area
     """
-    DBH.open_db()  # open database for tiles
-    total_tiles = 0  # initialize output counter
-
+    tiles = []
     for zoom in range(max_zoom + 1):
         xtile, ytile = deg2num(lat_max, lon_min, zoom)
         final_xtile, final_ytile = deg2num(lat_min, lon_max, zoom)
+        tiles += _square_tiles(zoom, xtile, ytile, final_xtile, final_ytile,
+                               extra_tiles)
 
-        for x in range(xtile - extra_tiles, final_xtile + 1 + extra_tiles, 1):
-            for y in range(ytile - extra_tiles, final_ytile + 1 + extra_tiles,
-                           1):
-                if x >= 0 and y >= 0:
-                    if _download_url(zoom, x, y):
-                        total_tiles += 1
+    DBH.open_db()  # open database for tiles
+    report = DOWNLOADER.download(tiles)
     DBH.close_db()
+    if report.downloaded:
+        TILE_CACHE.evict_in_background()
+    total_tiles = report.valid
 
     return total_tiles
 
@@ -153,15 +551,23 @@ def download_tiles_by_num(xtile: int, ytile: int,
     :param extra_tiles: surrounding tiles to download
     :return: total number of tiles in the area
     """
+    tiles = _square_tiles(max_zoom, xtile, ytile, final_xtile, final_ytile,
+                          extra_tiles)
+
     DBH.open_db()  # open database for tiles
-    total_tiles = 0  # initialize output counter
-
-    for x in range(xtile - extra_tiles, final_xtile + 1 + extra_tiles, 1):
-        for y in range(ytile - extra_tiles, final_ytile + 1 + extra_tiles,
-                       1):
-            if x >= 0 and y >= 0:
-                if _download_url(max_zoom, x, y):
-                    total_tiles += 1
+    report = DOWNLOADER.download(tiles)
     DBH.close_db()
+    if report.downloaded:
+        TILE_CACHE.evict_in_background()
+    total_tiles = report.valid
 
     return total_tiles
+
+
+def _square_tiles(zoom: int, xtile: int, ytile: int, final_xtile: int,
+                  final_ytile: int, extra_tiles: int) -> list:
+    # Tiles of a square with its surrounding tiles
+    return [(zoom, x, y)
+            for x in range(xtile - extra_tiles, final_xtile + 1 + extra_tiles)
+            for y in range(ytile - extra_tiles, final_ytile + 1 + extra_tiles)
+            if x >= 0 and y >= 0]
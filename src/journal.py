@@ -0,0 +1,158 @@
+"""JOURNAL
+Undo and redo of track edits. Each edit is recorded as its inverse: the
+operations on the column store which bring the data back plus the small
+track state (segment index and summary). Only the points modified by the
+edit are kept, never a full copy of the track.
+
+Operations on the store are tuples:
+    - ('write', column, start, values): overwrite rows from start
+    - ('insert', start, columns): insert rows, columns is a dict of arrays
+    - ('delete', start, stop): remove rows
+    - ('shift', column, start, amount): add amount to a column from start
+    - ('blocks', [(start, stop), ...]): reorder rows, new order is the
+    concatenation of the given ranges
+Applying an operation returns its inverse, so undo provides the redo data.
+
+Author: alguerre
+License: MIT
+"""
+import collections
+
+import numpy as np
+
+import constants as c
+
+STATE_NBYTES = 200  # estimated size of the state of one segment
+
+
+def apply(store, operation: tuple) -> tuple:
+    """
+    Apply an operation to a column store.
+    :param store: ColumnStore
+    :param operation: see module documentation
+    :return: inverse operation
+    """
+    kind = operation[0]
+
+    if kind == 'write':
+        _, column, start, values = operation
+        inverse = ('write', column, start,
+                   store[column][start:start + len(values)].copy())
+        store.write(column, values, start)
+
+    elif kind == 'insert':
+        _, start, columns = operation
+        inverse = ('delete', *store.insert(start, columns))
+
+    elif kind == 'delete':
+        _, start, stop = operation
+        inverse = ('insert', start, {column: store[column][start:stop].copy()
+                                     for column in store.columns})
+        store.delete(start, stop)
+
+    elif kind == 'shift':
+        _, column, start, amount = operation
+        inverse = ('shift', column, start, -amount)
+        store.write(column, store[column][start:] + amount, start)
+
+    elif kind == 'blocks':
+        _, blocks = operation
+        # Each block goes back to its original position
+        new_start = np.cumsum([0] + [stop - start for start, stop in blocks])
+        inverse = ('blocks', [(new_start[i], new_start[i + 1]) for i in
+                              np.argsort([start for start, _ in blocks])])
+        store.take(np.concatenate(
+            [np.arange(start, stop) for start, stop in blocks]))
+
+    else:
+        raise ValueError(f'Unknown journal operation: {kind}')
+
+    return inverse
+
+
+def _operation_nbytes(operation: tuple) -> int:
+    if operation[0] == 'write':
+        return operation[3].nbytes
+    elif operation[0] == 'insert':
+        return sum(values.nbytes for values in operation[2].values())
+    elif operation[0] == 'blocks':
+        return 16 * len(operation[1])
+    return 0
+
+
+class Edit:
+    """
+    Data needed to revert an edit:
+        - operations: to be applied in order on the store
+        - state: track attributes before the edit
+        - first_row: cumulated columns must be updated from the segment
+        containing this row, None if they are not affected
+    """
+    def __init__(self, operations: list, state: dict, first_row: int = None):
+        self.operations = operations
+        self.state = state
+        self.first_row = first_row
+
+    @property
+    def nbytes(self) -> int:
+        return sum(_operation_nbytes(operation)
+                   for operation in self.operations) + \
+            STATE_NBYTES * len(self.state.get('segment_index', {}))
+
+
+class EditJournal:
+    """
+    Undo and redo stacks of edits. The oldest edits are forgotten when the
+    memory used by both stacks is over the budget.
+    """
+    def __init__(self, budget: float = c.undo_memory_budget):
+        self.budget = budget
+        self.undo_stack = collections.deque()
+        self.redo_stack = []
+
+    @property
+    def nbytes(self) -> int:
+        return sum(edit.nbytes for edit in self.undo_stack) + \
+            sum(edit.nbytes for edit in self.redo_stack)
+
+    def can_undo(self) -> bool:
+        return len(self.undo_stack) > 0
+
+    def can_redo(self) -> bool:
+        return len(self.redo_stack) > 0
+
+    def record(self, edit: Edit):
+        """
+        Store a new edit, redo is no longer possible.
+        :param edit: inverse of the edit
+        """
+        self.redo_stack = []
+        self.undo_stack.append(edit)
+        self._apply_budget()
+
+    def pop_undo(self) -> Edit:
+        return self.undo_stack.pop()
+
+    def pop_redo(self) -> Edit:
+        return self.redo_stack.pop()
+
+    def push_undo(self, edit: Edit):
+        # Used by redo, it must not clear the redo stack
+        self.undo_stack.append(edit)
+        self._apply_budget()
+
+    def push_redo(self, edit: Edit):
+        self.redo_stack.append(edit)
+        self._apply_budget()
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack = []
+
+    def _apply_budget(self):
+        # Forget oldest undo edits first, then farthest redo edits
+        nbytes = self.nbytes
+        while nbytes > self.budget and self.undo_stack:
+            nbytes -= self.undo_stack.popleft().nbytes
+        while nbytes > self.budget and self.redo_stack:
+            nbytes -= self.redo_stack.pop(0).nbytes
@@ -5,6 +5,8 @@ made of Open Street Map tiles, which are loaded with iosm module.
 Author: alguerre
 License: MIT
 """
+import concurrent.futures
+import io
 import logging
 from typing import Tuple
 import pandas as pd
@@ -15,10 +17,16 @@ import geopy.distance
 import constants as c
 import iosm
 import track
+from image_cache import ImageCache
 
 
 logger = logging.getLogger(__name__)
 
+# Decoded tiles by (zoom, x, y), shared by all the maps
+TILE_IMAGES = ImageCache(c.tile_images_size)
+# Tiles replaced by a background refresh are decoded again
+iosm.DOWNLOADER.on_update = TILE_IMAGES.remove
+
 
 def point_reduction(df_segment: pd.DataFrame):
     positions = sorted(list(set([int(pos) for pos in
@@ -51,10 +59,7 @@ def generate_map(ob_track: track.Track) -> np.array:
     logger.debug(f'{extreme_tiles}, {zoom}')
 
     # Download missing tiles
-    logger.debug('download tiles')
-    iosm.download_tiles_by_num(extreme_tiles[0], extreme_tiles[1],
-                               extreme_tiles[2], extreme_tiles[3],
-                               max_zoom=zoom, extra_tiles=c.margin_outbounds)
+    download_tiles(extreme_tiles, zoom, extra_tiles=c.margin_outbounds)
     logger.debug('generate map')
     # Generate map image
     map_img = create_map_img(extreme_tiles, zoom)
@@ -113,24 +118,79 @@ def get_extreme_tiles(ob_track: track.Track, zoom: int):
     return xtile, ytile, final_xtile, final_ytile
 
 
-def create_map_img(extreme_tiles: Tuple[int, int, int, int],
-                   zoom: int) -> np.array:
+def download_tiles(extreme_tiles: Tuple[int, int, int, int], zoom: int,
+                   extra_tiles: int = 0):
+    """
+    Download the tiles of a map unless they are already decoded in memory,
+    then neither the database nor the files are used.
+    :param extreme_tiles: x, y, final x and final y tiles
+    :param zoom: zoom grade
+    :param extra_tiles: surrounding tiles to download
+    """
     xtile, ytile, final_xtile, final_ytile = extreme_tiles
-    map_img = None
+    if all((zoom, x, y) in TILE_IMAGES
+           for x in range(xtile, final_xtile + 1)
+           for y in range(ytile, final_ytile + 1)):
+        return
 
-    for x in range(xtile, final_xtile + 1, 1):
-
-        y_img = mpimg.imread(f'{c.prj_path}/tiles/{zoom}/{x}/{ytile}.png')
+    logger.debug('download tiles')
+    iosm.download_tiles_by_num(xtile, ytile, final_xtile, final_ytile,
+                               max_zoom=zoom, extra_tiles=extra_tiles)
+
+
+def read_tile(zoom: int, xtile: int, ytile: int) -> np.array:
+    # Decoded tile, read-only. It is only read from disk once.
+    tile_img = TILE_IMAGES.get((zoom, xtile, ytile))
+    if tile_img is None:
+        if iosm.STORE is not None:
+            tile_img = mpimg.imread(
+                io.BytesIO(iosm.STORE.get_tile(zoom, xtile, ytile)),
+                format='png')
+        else:
+            tile_img = mpimg.imread(
+                f'{c.tiles_path}/{zoom}/{xtile}/{ytile}.png')
+        tile_img = TILE_IMAGES.put((zoom, xtile, ytile), tile_img)
+    return tile_img
 
-        for y in range(ytile + 1, final_ytile + 1, 1):
-            local_img_path = f'{c.prj_path}/tiles/{zoom}/{x}/{y}.png'
-            local_img = mpimg.imread(local_img_path)
-            y_img = np.vstack((y_img, local_img))
 
-        if map_img is not None:
-            map_img = np.hstack((map_img, y_img))
-        else:
-            map_img = y_img
+def create_map_img(extreme_tiles: Tuple[int, int, int, int],
+                   zoom: int) -> np.array:
+    """
+    Mosaic of tiles in a preallocated RGBA image. Tiles which are not in
+    memory yet are decoded in parallel.
+    :param extreme_tiles: x, y, final x and final y tiles
+    :param zoom: zoom grade
+    :return: map image
+    """
+    xtile, ytile, final_xtile, final_ytile = extreme_tiles
+    tiles = [(x, y) for x in range(xtile, final_xtile + 1)
+             for y in range(ytile, final_ytile + 1)]
+
+    decoded = {}
+    missing = [tile for tile in tiles if (zoom, *tile) not in TILE_IMAGES]
+    if len(missing) > 1:
+        with concurrent.futures.ThreadPoolExecutor(
+                c.tile_decode_workers) as executor:
+            decoded = dict(zip(missing, executor.map(
+                lambda tile: read_tile(zoom, *tile), missing)))
+
+    # Each tile is copied once into its position
+    map_img = None
+    for x, y in tiles:
+        tile_img = decoded[(x, y)] if (x, y) in decoded \
+            else read_tile(zoom, x, y)
+        height, width = tile_img.shape[:2]
+        if map_img is None:
+            map_img = np.ones(((final_ytile - ytile + 1) * height,
+                               (final_xtile - xtile + 1) * width, 4),
+                              dtype='float32')
+
+        row, column = (y - ytile) * height, (x - xtile) * width
+        block = map_img[row:row + height, column:column + width]
+        if tile_img.ndim == 2:  # grayscale
+            block[..., :3] = tile_img[..., np.newaxis]
+        else:  # RGB or RGBA
+            block[..., :tile_img.shape[2]] = tile_img
 
     return map_img
 
@@ -0,0 +1,265 @@
+"""MBTILES
+Store of tiles in a single SQLite file, following the MBTiles layout: the
+images are blobs of a tiles table and the rows are numbered from the south
+(TMS scheme), unlike the OSM tiles.
+
+One file per tile costs an inode, a directory lookup and an open per tile;
+here every tile is read through one connection which is kept open, and a
+region can be copied between machines as one file. Tiles can be imported
+from and exported to the zoom/x/y.png directory layout, also from the
+command line:
+    python mbtiles.py import tiles_path file.mbtiles
+    python mbtiles.py export file.mbtiles tiles_path
+
+Author: alguerre
+License: MIT
+"""
+import logging
+import os
+import sqlite3
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+SCHEMA = ["""CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY,
+                                                   value TEXT)""",
+          """CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER,
+                                                tile_column INTEGER,
+                                                tile_row INTEGER,
+                                                tile_data BLOB,
+                                   PRIMARY KEY (zoom_level, tile_column,
+                                                tile_row))"""]
+IMPORT_BATCH = 500  # tiles inserted per transaction
+
+
+def tms_row(zoom: int, ytile: int) -> int:
+    # OSM rows are numbered from the north, MBTiles rows from the south,
+    # the conversion is its own inverse
+    return 2 ** zoom - 1 - ytile
+
+
+class MBTiles:
+    """
+    Tiles of a single file, it can be used from several threads.
+        - path: MBTiles file
+        - name: metadata name of the tileset, for new files
+    """
+    def __init__(self, path: str, name: str = 'tiles'):
+        self.path = path
+        self.name = name
+        self.conn = None
+        self._lock = threading.Lock()
+
+    def open(self) -> bool:
+        try:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            with self._lock, self.conn:
+                # Space of removed tiles can be given back, new files only
+                self.conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                self.conn.execute('PRAGMA journal_mode=WAL')
+                self.conn.execute('PRAGMA synchronous=NORMAL')
+                for query in SCHEMA:
+                    self.conn.execute(query)
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO metadata VALUES (?, ?)',
+                    [('name', self.name), ('format', 'png'),
+                     ('type', 'baselayer')])
+        except sqlite3.DatabaseError as e:
+            LOGGER.error(f'Unexpected error opening {self.path}: {e}')
+            return False
+        return True
+
+    def close(self):
+        if self.conn is not None:
+            with self._lock:
+                self.conn.close()
+                self.conn = None
+
+    def __len__(self):
+        return self._fetch('SELECT COUNT(*) FROM tiles')[0][0]
+
+    def __contains__(self, tile: tuple) -> bool:
+        zoom, xtile, ytile = tile
+        return bool(self._fetch(
+            """SELECT 1 FROM tiles
+               WHERE zoom_level=? AND tile_column=? AND tile_row=?""",
+            (zoom, xtile, tms_row(zoom, ytile))))
+
+    def get_tile(self, zoom: int, xtile: int, ytile: int) -> bytes:
+        """
+        :param zoom: zoom grade
+        :param xtile: OSM X-tile
+        :param ytile: OSM Y-tile
+        :return: image file content, None if the tile is not stored
+        """
+        rows = self._fetch(
+            """SELECT tile_data FROM tiles
+               WHERE zoom_level=? AND tile_column=? AND tile_row=?""",
+            (zoom, xtile, tms_row(zoom, ytile)))
+        return rows[0][0] if rows else None
+
+    def put_tiles(self, tiles) -> int:
+        """
+        Insert or replace tiles in one transaction.
+        :param tiles: zoom, x, y (OSM) and image file content of each tile
+        :return: number of tiles
+        """
+        rows = [(zoom, xtile, tms_row(zoom, ytile), sqlite3.Binary(data))
+                for zoom, xtile, ytile, data in tiles]
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def remove_tiles(self, tiles: list):
+        """
+        Remove tiles and give their space back to the file system.
+        :param tiles: zoom, x and y (OSM) of each tile
+        """
+        with self._lock:
+            with self.conn:
+                self.conn.executemany(
+                    """DELETE FROM tiles
+                       WHERE zoom_level=? AND tile_column=? AND tile_row=?""",
+                    ((zoom, xtile, tms_row(zoom, ytile))
+                     for zoom, xtile, ytile in tiles))
+            # Run as a script, the pragma frees one page per step
+            self.conn.executescript('PRAGMA incremental_vacuum;')
+
+    def tiles(self, min_zoom: int = 0, max_zoom: int = None):
+        """
+        Iterate over the stored tiles. Tiles are read in chunks, so other
+        threads can use the file meanwhile.
+        :param min_zoom: lowest zoom grade
+        :param max_zoom: highest zoom grade, None for all
+        :return: zoom, x, y (OSM) and image file content of each tile
+        """
+        last = (min_zoom, -1, -1)
+        while True:
+            rows = self._fetch(
+                """SELECT zoom_level, tile_column, tile_row, tile_data
+                   FROM tiles
+                   WHERE (zoom_level, tile_column, tile_row) > (?, ?, ?)
+                       AND zoom_level <= ?
+                   ORDER BY zoom_level, tile_column, tile_row LIMIT ?""",
+                (*last, max_zoom if max_zoom is not None else 2 ** 31,
+                 IMPORT_BATCH))
+            if not rows:
+                return
+            for zoom, xtile, row, data in rows:
+                yield zoom, xtile, tms_row(zoom, row), data
+            last = rows[-1][:3]
+
+    def get_metadata(self) -> dict:
+        return dict(self._fetch('SELECT name, value FROM metadata'))
+
+    def set_metadata(self, **metadata):
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO metadata VALUES (?, ?)',
+                [(name, str(value)) for name, value in metadata.items()])
+
+    def zoom_range(self) -> (int, int):
+        """
+        :return: lowest and highest zoom grades, None if there are no tiles
+        """
+        return tuple(self._fetch(
+            'SELECT MIN(zoom_level), MAX(zoom_level) FROM tiles')[0])
+
+    def _fetch(self, query: str, parameters: tuple = ()) -> list:
+        # Rows are fetched before the lock is released
+        with self._lock:
+            return self.conn.execute(query, parameters).fetchall()
+
+
+def import_directory(tiles_path: str, mbtiles: MBTiles) -> int:
+    """
+    Copy the tiles of a zoom/x/y.png directory into an MBTiles file,
+    existing tiles are replaced.
+    :param tiles_path: root of the directory layout
+    :param mbtiles: open MBTiles file
+    :return: number of imported tiles
+    """
+    imported = 0
+    batch = []
+    for zoom, xtile, ytile, tile_path in _tile_files(tiles_path):
+        with open(tile_path, 'rb') as f:
+            batch.append((zoom, xtile, ytile, f.read()))
+        if len(batch) >= IMPORT_BATCH:
+            imported += mbtiles.put_tiles(batch)
+            batch = []
+    imported += mbtiles.put_tiles(batch)
+
+    min_zoom, max_zoom = mbtiles.zoom_range()
+    if min_zoom is not None:
+        mbtiles.set_metadata(minzoom=min_zoom, maxzoom=max_zoom)
+    LOGGER.info(f'{imported} tiles imported from {tiles_path} to '
+                f'{mbtiles.path}')
+    return imported
+
+
+def export_directory(mbtiles: MBTiles, tiles_path: str,
+                     min_zoom: int = 0, max_zoom: int = None) -> int:
+    """
+    Write the tiles of an MBTiles file as zoom/x/y.png files, existing
+    files are replaced.
+    :param mbtiles: open MBTiles file
+    :param tiles_path: root of the directory layout
+    :param min_zoom: lowest zoom grade
+    :param max_zoom: highest zoom grade, None for all
+    :return: number of exported tiles
+    """
+    exported = 0
+    for zoom, xtile, ytile, data in mbtiles.tiles(min_zoom, max_zoom):
+        tile_path = f'{tiles_path}/{zoom}/{xtile}/{ytile}.png'
+        os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+        with open(tile_path, 'wb') as f:
+            f.write(data)
+        exported += 1
+    LOGGER.info(f'{exported} tiles exported from {mbtiles.path} to '
+                f'{tiles_path}')
+    return exported
+
+
+def _tile_files(tiles_path: str):
+    # zoom, x, y and path of the files named as tiles
+    for zoom in _numeric_entries(tiles_path):
+        for xtile in _numeric_entries(f'{tiles_path}/{zoom}'):
+            for ytile in _numeric_entries(f'{tiles_path}/{zoom}/{xtile}',
+                                          '.png'):
+                yield zoom, xtile, ytile, \
+                    f'{tiles_path}/{zoom}/{xtile}/{ytile}.png'
+
+
+def _numeric_entries(path: str, suffix: str = '') -> list:
+    entries = []
+    with os.scandir(path) as scan:
+        for entry in scan:
+            name = entry.name[:-len(suffix)] if suffix else entry.name
+            if name.isdigit() and entry.name.endswith(suffix) and \
+                    (entry.is_file() if suffix else entry.is_dir()):
+                entries.append(int(name))
+    return sorted(entries)
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) != 4 or sys.argv[1] not in ('import', 'export'):
+        sys.exit('usage: mbtiles.py import tiles_path file.mbtiles\n'
+                 '       mbtiles.py export file.mbtiles tiles_path')
+
+    command, source, destination = sys.argv[1:]
+    if not os.path.exists(source):
+        sys.exit(f'{source} does not exist')
+    mbtiles_file = MBTiles(destination if command == 'import' else source)
+    if not mbtiles_file.open():
+        sys.exit(f'{mbtiles_file.path} cannot be opened')
+    try:
+        if command == 'import':
+            count = import_directory(source, mbtiles_file)
+        else:
+            count = export_directory(mbtiles_file, destination)
+    finally:
+        mbtiles_file.close()
+    print(f'{source} -> {destination}: {count} tiles')
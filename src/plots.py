@@ -8,15 +8,11 @@ License: MIT
 """
 
 import logging
-from typing import Tuple
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
-import geopy.distance
 from matplotlib.font_manager import FontProperties
 import matplotlib.ticker as mticker
 
-import iosm
 import track
 import map_generator as mg
 
@@ -181,19 +177,6 @@ def plot_track(ob_track: track.Track, ax: plt.Figure.gca):
     ax.tick_params(axis='y', left=False, right=False, labelleft=False)
 
 
-def get_closest_segment(df_track: pd.DataFrame, point: Tuple[float, float]):
-    df_track['point_distance'] = df_track.apply(
-        lambda row: geopy.distance.geodesic((row.lat, row.lon), point).km,
-        axis=1)
-    min_row = \
-        df_track[df_track.point_distance == df_track.point_distance.min()]
-    min_distance = min_row.point_distance.iloc[0]
-    min_segment = min_row.segment.iloc[0]
-    df_track.drop('point_distance', axis=1, inplace=True)
-
-    return min_distance, int(min_segment)
-
-
 def _deselect_segment(ob_track: track.Track):
     if ob_track.selected_segment:
         for selected_track in ob_track.selected_segment:
@@ -241,8 +224,6 @@ def segment_selection(ob_track: track.Track, ax_track: plt.Figure.gca,
                       track_info_table):
 
     def on_click(event):
-        reduced_df = mg.point_reduction(ob_track.df_track.copy())
-
         # Check click limits before operation
         xlim = ax_track.get_xlim()
         ylim = ax_track.get_ylim()
@@ -256,8 +237,8 @@ def segment_selection(ob_track: track.Track, ax_track: plt.Figure.gca,
         # Click position to distance
         if event.xdata and event.ydata:
             point_distance, seg2select = \
-                get_closest_segment(reduced_df,
-                                    (event.ydata, event.xdata))
+                ob_track.closest_segment((event.ydata, event.xdata),
+                                         CLICK_DISTANCE)
         else:  # click outside plot
             point_distance = 1e+10
             seg2select = 0
@@ -337,7 +318,7 @@ def plot_elevation(ob_track: track.Track, ax: plt.Figure.gca,
 
 
 def plot_world(ax: plt.Figure.gca):
-    iosm.download_tiles_by_num(0, 0, 1, 1, max_zoom=1)
+    mg.download_tiles((0, 0, 1, 1), 1)
 
     ax.clear()
     world_img = mg.create_map_img((0, 0, 1, 1), 1)
@@ -0,0 +1,247 @@
+"""PREFETCH
+Download in advance the tiles around a track, to use the map offline.
+
+Instead of all the tiles of the bounding box, only the tiles close to the
+track are planned: at each zoom the track is rasterized into tiles, sampling
+every segment so that no crossed tile is skipped, and the result is widened
+by a buffer distance. Tiles already registered in the database are not
+planned again.
+
+The plan is downloaded by a background job in batches. The pending tiles
+and the progress are saved after every batch, so an interrupted job is
+resumed from its state file. The job shares the limits of each host with the
+other downloads (see iosm), and the tiles quota is checked after every
+batch.
+
+Author: alguerre
+License: MIT
+"""
+import json
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+
+import constants as c
+import iosm
+from db_handler import DbHandler
+from tile_cache import TileCache
+
+LOGGER = logging.getLogger(__name__)
+
+EARTH_CIRCUMFERENCE = 40075.017  # km, equator
+SAMPLES_PER_TILE = 4  # track samples per crossed tile
+
+
+def track_tiles(lat: np.array, lon: np.array, zoom: int,
+                buffer: float = c.prefetch_buffer) -> np.array:
+    """
+    Tiles crossed by a polyline and the tiles around it.
+    :param lat: latitude of the points
+    :param lon: longitude of the points
+    :param zoom: zoom grade
+    :param buffer: km around the track
+    :return: x and y of each tile, shape (n, 2), sorted
+    """
+    lat = np.asarray(lat, dtype='float64')
+    lon = np.asarray(lon, dtype='float64')
+    valid = np.isfinite(lat) & np.isfinite(lon)
+    return _corridor(*_world_coordinates(lat[valid], lon[valid]),
+                     np.abs(lat[valid]).max(initial=0), zoom, buffer)
+
+
+def _world_coordinates(lat: np.array,
+                       lon: np.array) -> (np.array, np.array):
+    # Position in the map of the world from 0 to 1, as in iosm.deg2num
+    return (lon + 180) / 360, \
+        (1 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2
+
+
+def _corridor(world_x: np.array, world_y: np.array, max_lat: float,
+              zoom: int, buffer: float) -> np.array:
+    n = 2 ** zoom
+    x, y = world_x * n, world_y * n
+
+    # Points are sampled, and the segments crossing several tiles are
+    # sampled several times per tile so that no tile is skipped
+    steps = np.ceil(SAMPLES_PER_TILE * np.maximum(
+        np.abs(np.diff(x)), np.abs(np.diff(y)))).astype('int64')
+    long = np.flatnonzero(steps > 1)
+    first = np.repeat(long, steps[long])
+    fraction = (np.arange(len(first)) - np.repeat(
+        np.cumsum(steps[long]) - steps[long], steps[long])) / steps[first]
+    x = np.concatenate([x, x[first] + (x[first + 1] - x[first]) * fraction])
+    y = np.concatenate([y, y[first] + (y[first + 1] - y[first]) * fraction])
+
+    # Tiles as keys x * n + y
+    keys = np.unique(np.clip(np.floor(x), 0, n - 1).astype('int64') * n +
+                     np.clip(np.floor(y), 0, n - 1).astype('int64'))
+
+    # Buffer in tiles at the track latitude
+    tile_size = EARTH_CIRCUMFERENCE * math.cos(math.radians(max_lat)) / n
+    radius = min(math.ceil(buffer / tile_size), n) if buffer > 0 else 0
+    tiles_x, tiles_y = keys // n, keys % n
+    if radius > 0:
+        offsets = np.arange(-radius, radius + 1)
+        keys = np.unique(
+            np.clip(tiles_x[:, np.newaxis] + np.repeat(offsets, len(offsets)),
+                    0, n - 1) * n +
+            np.clip(tiles_y[:, np.newaxis] + np.tile(offsets, len(offsets)),
+                    0, n - 1))
+        tiles_x, tiles_y = keys // n, keys % n
+
+    return np.stack([tiles_x, tiles_y], axis=1)
+
+
+class PrefetchPlan:
+    """
+    Tiles to download around a track.
+        - tiles: (zoom, x, y) of each tile, lower zooms first
+        - estimated_bytes: expected download size
+    """
+    def __init__(self, tiles: list):
+        self.tiles = tiles
+        self.estimated_bytes = len(tiles) * c.tile_size_estimate
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def __str__(self):
+        return (f'{len(self.tiles)} tiles, about '
+                f'{self.estimated_bytes / 1e6:.1f} MB')
+
+
+def plan(lat: np.array, lon: np.array, max_zoom: int = c.max_zoom,
+         buffer: float = c.prefetch_buffer, min_zoom: int = 0,
+         db: DbHandler = None) -> PrefetchPlan:
+    """
+    Plan the download of the tiles around a track.
+    :param lat: latitude of the points
+    :param lon: longitude of the points
+    :param max_zoom: highest zoom grade
+    :param buffer: km around the track
+    :param min_zoom: lowest zoom grade
+    :param db: open tiles database, registered valid tiles are skipped
+    :return: plan of the tiles to download
+    """
+    lat = np.asarray(lat, dtype='float64')
+    lon = np.asarray(lon, dtype='float64')
+    valid = np.isfinite(lat) & np.isfinite(lon)
+    world_x, world_y = _world_coordinates(lat[valid], lon[valid])
+    max_lat = np.abs(lat[valid]).max(initial=0)
+
+    tiles = [(zoom, x, y) for zoom in range(min_zoom, max_zoom + 1)
+             for x, y in _corridor(world_x, world_y, max_lat, zoom,
+                                   buffer).tolist()]
+
+    if db is not None:
+        statuses = iosm.tile_statuses(db, tiles)
+        tiles = [tile for tile in tiles if not statuses.get(tile)]
+
+    prefetch_plan = PrefetchPlan(tiles)
+    LOGGER.info(f'Prefetch plan: {prefetch_plan}')
+    return prefetch_plan
+
+
+class PrefetchJob:
+    """
+    Background download of a plan, in batches.
+        - state_file: pending tiles and progress, removed when finished
+        - done: tiles processed
+        - report: sum of the reports of the batches, see iosm.DownloadReport
+        - error: exception which stopped the job, if any
+        - tile_cache: evicts tiles over the quota after every batch
+        - downloader_options: see iosm.TileDownloader, tiles go to
+          iosm.STORE unless other store is given
+    The database is opened by the job thread, sqlite connections cannot be
+    shared between threads.
+    """
+    def __init__(self, tiles: list, state_file: str, db_path: str = c.db_path,
+                 batch_size: int = c.prefetch_batch_size, done: int = 0,
+                 tile_cache: TileCache = iosm.TILE_CACHE,
+                 **downloader_options):
+        self.tiles = [tuple(tile) for tile in tiles]
+        self.state_file = state_file
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.done = done
+        self.tile_cache = tile_cache
+        self.downloader_options = dict({'store': iosm.STORE},
+                                       **downloader_options)
+        self.report = iosm.DownloadReport(0)
+        self.error = None
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def resume(cls, state_file: str, **options):
+        """
+        Job of an interrupted prefetch.
+        :param state_file: state file of the job
+        :param options: see PrefetchJob
+        :return: job, to be started
+        """
+        with open(state_file) as f:
+            state = json.load(f)
+        return cls(state['tiles'], state_file, done=state['done'], **options)
+
+    @property
+    def total(self) -> int:
+        return len(self.tiles)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stop.clear()
+        self._save_state()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # The current batch is finished, then the job can be resumed
+        self._stop.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait for the job to finish or stop.
+        :param timeout: seconds
+        :return: True if the job is not running anymore
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return not self.running
+
+    def run(self):
+        db = DbHandler(self.db_path)
+        db.open_db()
+        downloader = iosm.TileDownloader(db, **self.downloader_options)
+        try:
+            while self.done < self.total and not self._stop.is_set():
+                batch = self.tiles[self.done:self.done + self.batch_size]
+                report = downloader.download(batch)
+                self.report.add(report)
+                self.done += len(batch)
+                self._save_state()
+                if report.downloaded and self.tile_cache is not None:
+                    self.tile_cache.evict_in_background()
+        except Exception as e:
+            LOGGER.error(f'Prefetch stopped at {self.done}/{self.total}: '
+                         f'{e}')
+            self.error = e
+        finally:
+            db.close_db()
+
+        if self.done >= self.total and os.path.exists(self.state_file):
+            os.remove(self.state_file)
+        LOGGER.info(f'Prefetch {self.done}/{self.total}: {self.report}')
+
+    def _save_state(self):
+        # Replaced at once, a crash leaves the previous state
+        with open(f'{self.state_file}.tmp', 'w') as f:
+            json.dump({'tiles': self.tiles, 'done': self.done}, f)
+        os.replace(f'{self.state_file}.tmp', self.state_file)
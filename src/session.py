@@ -0,0 +1,154 @@
+"""SESSION
+Session files store a whole track to be loaded later on.
+
+The format is a single binary file:
+    - MAGIC bytes and the length of the header as a little endian uint64
+    - JSON header: track metadata and the type, offset and length of each
+    column. Offsets start at the first aligned byte after the header.
+    - One contiguous array per column, aligned to ALIGNMENT bytes
+Columns are loaded as copy-on-write memory maps: opening a session does not
+read the data, only the pages really used are read from disk and edits are
+never written back to the file.
+
+Former sessions are HDF5 files written by pandas (PyTables is needed to read
+them), they can be converted to the new format.
+
+Author: alguerre
+License: MIT
+"""
+import json
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b'TRKSESS\x00'
+VERSION = 1
+ALIGNMENT = 64  # bytes
+EXTENSION = '.session'
+H5_EXTENSIONS = ('.h5', '.hdf5', '.he5')
+H5_METADATA = ['size', 'extremes', 'total_distance', 'total_uphill',
+               'total_downhill', 'last_segment_idx']
+
+
+class SessionError(Exception):
+    pass
+
+
+def _aligned(position: int) -> int:
+    return -(-position // ALIGNMENT) * ALIGNMENT
+
+
+def _json_default(value):
+    # Numpy scalars are stored as python numbers
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def write(file: str, columns: dict, metadata: dict):
+    """
+    Write a session file. The file is written aside and then renamed, so
+    a session loaded from the same file keeps its memory maps valid. Some
+    systems (e.g. Windows) do not allow to replace a mapped file, the maps
+    must be read into memory before, see ColumnStore.unmap.
+    :param file: session file path
+    :param columns: name and array of each column, same length
+    :param metadata: JSON serializable track information
+    """
+    columns = {name: np.ascontiguousarray(values)
+               for name, values in columns.items()}
+    header = {'version': VERSION, 'metadata': metadata, 'columns': []}
+
+    offset = 0
+    for name, values in columns.items():
+        header['columns'].append({'name': name, 'dtype': values.dtype.str,
+                                  'offset': offset, 'length': len(values)})
+        offset = _aligned(offset + values.nbytes)
+
+    header_bytes = json.dumps(header, default=_json_default).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 8 + len(header_bytes))
+
+    tmp_file = f'{file}.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for column, values in zip(header['columns'], columns.values()):
+            f.seek(data_start + column['offset'])
+            f.write(values.view('uint8'))
+        f.truncate(data_start + offset)
+    os.replace(tmp_file, file)
+
+
+def read(file: str) -> (dict, dict):
+    """
+    Open a session file.
+    :param file: session file path
+    :return: columns as copy-on-write memory maps and track metadata
+    """
+    with open(file, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise SessionError(f'{os.path.basename(file)} is not a session '
+                               f'file')
+        header_size, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_size).decode('utf-8'))
+    data_start = _aligned(len(MAGIC) + 8 + header_size)
+
+    if header['version'] > VERSION:
+        raise SessionError(f'Session version {header["version"]} is not '
+                           f'supported')
+
+    columns = {}
+    for column in header['columns']:
+        if column['length'] == 0:
+            columns[column['name']] = np.empty(0, dtype=column['dtype'])
+        else:
+            columns[column['name']] = np.memmap(
+                file, dtype=column['dtype'], mode='c',
+                offset=data_start + column['offset'],
+                shape=(column['length'],))
+    return columns, header['metadata']
+
+
+def read_h5(file: str) -> (pd.DataFrame, dict):
+    """
+    Read a former HDF5 session.
+    :param file: .h5 session file
+    :return: track data and metadata
+    """
+    with pd.HDFStore(file, mode='r') as store:
+        df_track = store['session']
+        session_meta = store.get_storer('session').attrs.metadata
+
+    # Old files may miss some of the fields
+    return df_track.reset_index(drop=True), \
+        {key: value for key, value in vars(session_meta).items()
+         if key in H5_METADATA}
+
+
+def convert_h5(h5_file: str, session_file: str = None) -> str:
+    """
+    Convert a former HDF5 session to the new format. The segment summary is
+    not available in these files, it is computed on the first edit.
+    :param h5_file: .h5 session file
+    :param session_file: output, by default the same name with the new
+        extension
+    :return: output file path
+    """
+    if session_file is None:
+        session_file = os.path.splitext(h5_file)[0] + EXTENSION
+
+    df_track, metadata = read_h5(h5_file)
+    write(session_file,
+          {name: df_track[name].to_numpy() for name in df_track.columns},
+          metadata)
+    return session_file
+
+
+if __name__ == '__main__':
+    import sys
+
+    for h5_session in sys.argv[1:]:
+        print(f'{h5_session} -> {convert_h5(h5_session)}')
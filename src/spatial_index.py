@@ -0,0 +1,173 @@
+"""SPATIAL_INDEX
+Nearest point queries over the track, used to select segments by clicking
+on the map. Points of each segment are projected to a local equirectangular
+plane in km and hashed into a uniform grid: points are sorted by cell key so
+the points of any cell are found with a binary search. A query only looks at
+the occupied columns of cells around the clicked point, so its cost does not
+grow with the search radius, and the exact distance is computed for the
+candidates.
+
+Grids are kept per segment and identified by a signature of their points
+(size and end points). Synchronizing with the track only builds grids for
+segments whose points have changed; renamed or moved segments reuse their
+grid.
+
+Author: alguerre
+License: MIT
+"""
+import numpy as np
+
+import constants as c
+import geodesy
+
+EARTH_RADIUS = geodesy.MEAN_RADIUS  # km
+KEY_FACTOR = 2 ** 31  # cell key = x cell * KEY_FACTOR + y cell
+PLANE_TOLERANCE = 1.01  # relative error of the plane distance
+
+
+def _signature(lat: np.array, lon: np.array) -> tuple:
+    # Segment edits keep the end points unless the points are changed
+    if len(lat) == 0:
+        return 0,
+    return len(lat), lat[0], lon[0], lat[-1], lon[-1]
+
+
+class SegmentGrid:
+    """
+    Uniform grid over the points of a segment.
+        - signature: identifies the points of the segment
+        - bbox: projected bounding box (x min, x max, y min, y max)
+        - keys: sorted cell keys of the points
+        - columns: sorted x cells with points
+        - order: position in the segment of the points sorted by key
+    """
+    def __init__(self, lat: np.array, lon: np.array, cell_size: float):
+        self.signature = _signature(lat, lon)
+        self.cell_size = cell_size
+        self.lat = np.asarray(lat, dtype='float64')
+        self.lon = np.asarray(lon, dtype='float64')
+        self.cos_lat = np.cos(np.radians(np.nanmean(self.lat))) \
+            if len(lat) > 0 else 1.0
+
+        x, y = self.project(self.lat, self.lon)
+        valid = np.isfinite(x) & np.isfinite(y)
+        x, y = x[valid], y[valid]
+        self.bbox = (x.min(), x.max(), y.min(), y.max()) if len(x) > 0 \
+            else (np.inf, -np.inf, np.inf, -np.inf)
+
+        x_cells = np.floor(x / cell_size).astype('int64')
+        keys = self._keys(x_cells, np.floor(y / cell_size))
+        sort = np.argsort(keys, kind='stable')
+        self.keys = keys[sort]
+        self.order = np.flatnonzero(valid)[sort]
+        self.columns = np.unique(x_cells)
+
+    def project(self, lat, lon) -> (np.array, np.array):
+        x = EARTH_RADIUS * np.radians(lon) * self.cos_lat
+        y = EARTH_RADIUS * np.radians(lat)
+        return x, y
+
+    @staticmethod
+    def _keys(x_cell: np.array, y_cell: np.array) -> np.array:
+        return x_cell.astype('int64') * KEY_FACTOR + y_cell.astype('int64')
+
+    def nearest(self, lat: float, lon: float,
+                max_distance: float) -> (float, int):
+        """
+        Closest point of the segment.
+        :param lat: latitude of the query point
+        :param lon: longitude of the query point
+        :param max_distance: search radius in km
+        :return: distance in km and position in the segment of the closest
+            point, (inf, -1) if there is no point inside the radius
+        """
+        x, y = self.project(lat, lon)
+        x_min, x_max, y_min, y_max = self.bbox
+        if x < x_min - max_distance or x > x_max + max_distance or \
+                y < y_min - max_distance or y > y_max + max_distance:
+            return np.inf, -1
+
+        # Cells around the point covering the search radius, with one more
+        # ring for the projection error. Keys of a column are contiguous,
+        # each occupied column is one range of the sorted keys.
+        n_cells = int(np.ceil(max_distance / self.cell_size)) + 1
+        x_cell = int(np.floor(x / self.cell_size))
+        y_cell = int(np.floor(y / self.cell_size))
+        columns = self.columns[
+            np.searchsorted(self.columns, x_cell - n_cells, side='left'):
+            np.searchsorted(self.columns, x_cell + n_cells, side='right')]
+        first = np.searchsorted(self.keys, columns * KEY_FACTOR + y_cell -
+                                n_cells, side='left')
+        last = np.searchsorted(self.keys, columns * KEY_FACTOR + y_cell +
+                               n_cells, side='right')
+
+        lengths = last - first
+        if lengths.sum() == 0:
+            return np.inf, -1
+        candidates = self.order[
+            np.arange(lengths.sum()) +
+            np.repeat(first - np.cumsum(lengths) + lengths, lengths)]
+
+        # Exact distance only for the closest candidates in a plane
+        # projection centered on the query point
+        dx = np.radians(self.lon[candidates] - lon) * np.cos(np.radians(lat))
+        dy = np.radians(self.lat[candidates] - lat)
+        plane_distance = EARTH_RADIUS * np.hypot(dx, dy)
+        candidates = candidates[plane_distance <= PLANE_TOLERANCE *
+                                plane_distance.min() + 1e-3]
+
+        distance = geodesy.distance(lat, lon, self.lat[candidates],
+                                    self.lon[candidates])
+        closest = np.argmin(distance)
+        if distance[closest] > max_distance:
+            return np.inf, -1
+        return distance[closest], candidates[closest]
+
+
+class SpatialIndex:
+    """
+    Grids of all the segments of a track, by segment index.
+    """
+    def __init__(self, cell_size: float = c.spatial_cell_size):
+        self.cell_size = cell_size
+        self.grids = {}
+
+    def clear(self):
+        self.grids = {}
+
+    def sync(self, segment_index: dict, lat: np.array, lon: np.array):
+        """
+        Update the grids to the current segments of the track.
+        :param segment_index: segment: (start, stop) rows
+        :param lat: latitude of all the points of the track
+        :param lon: longitude of all the points of the track
+        """
+        known = {grid.signature: grid for grid in self.grids.values()}
+        grids = {}
+        for seg, (start, stop) in segment_index.items():
+            signature = _signature(lat[start:stop], lon[start:stop])
+            if signature in known:
+                grids[seg] = known[signature]
+            else:
+                grids[seg] = SegmentGrid(lat[start:stop], lon[start:stop],
+                                         self.cell_size)
+        self.grids = grids
+
+    def nearest(self, lat: float, lon: float,
+                max_distance: float) -> (float, int, int):
+        """
+        Closest point of the track.
+        :param lat: latitude of the query point
+        :param lon: longitude of the query point
+        :param max_distance: search radius in km
+        :return: distance in km, segment and position in the segment of the
+            closest point. If there is no point inside the radius: inf, 0
+            and -1.
+        """
+        closest = (np.inf, 0, -1)
+        for seg, grid in self.grids.items():
+            distance, position = grid.nearest(lat, lon, max_distance)
+            if distance < closest[0]:
+                closest = (distance, seg, position)
+
+        return closest
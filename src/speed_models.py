@@ -0,0 +1,125 @@
+"""SPEED_MODELS
+Synthesis of timestamps for tracks without time information. A speed model
+provides the speed at each point and the elapsed time is the cumulated sum of
+the time spent between consecutive points. All the computation is done on
+whole numpy arrays.
+
+Available models:
+    - constant: the same speed for all the track.
+    - grade: the speed is adapted to the slope using Tobler's hiking
+    function, the input speed is the one on flat terrain.
+    - segment: a different speed for each segment, segments without a given
+    speed use the default one.
+
+Author: alguerre
+License: MIT
+"""
+import numpy as np
+
+# Tobler's hiking function: exp(-3.5 * |grade + 0.05|), normalized to flat
+TOBLER_SLOPE = 3.5
+TOBLER_OFFSET = 0.05
+MIN_SPEED_FACTOR = 0.1  # lowest allowed fraction of the flat speed
+
+
+def constant_model(speed: float, p2p_distance: np.array, ele_diff: np.array,
+                   segment: np.array, segment_speed: dict = None) -> np.array:
+    """
+    Same speed in all the points.
+    :param speed: speed in km/h
+    :param p2p_distance: distance to the previous point in km
+    :param ele_diff: elevation difference with the previous point in m
+    :param segment: segment of each point
+    :param segment_speed: not used
+    :return: speed of each point in km/h
+    """
+    return np.full(p2p_distance.shape, speed, dtype='float64')
+
+
+def grade_model(speed: float, p2p_distance: np.array, ele_diff: np.array,
+                segment: np.array, segment_speed: dict = None) -> np.array:
+    """
+    Speed adjusted to the slope of the terrain, maximum speed is reached on
+    a gentle downhill.
+    :param speed: speed on flat terrain in km/h
+    :param p2p_distance: distance to the previous point in km
+    :param ele_diff: elevation difference with the previous point in m
+    :param segment: segment of each point
+    :param segment_speed: not used
+    :return: speed of each point in km/h
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = ele_diff / (p2p_distance * 1000)
+    slope = np.where(np.isfinite(slope), slope, 0)
+
+    factor = np.exp(-TOBLER_SLOPE * np.abs(slope + TOBLER_OFFSET)) / \
+        np.exp(-TOBLER_SLOPE * TOBLER_OFFSET)
+
+    return speed * np.maximum(factor, MIN_SPEED_FACTOR)
+
+
+def segment_model(speed: float, p2p_distance: np.array, ele_diff: np.array,
+                  segment: np.array, segment_speed: dict = None) -> np.array:
+    """
+    Constant speed per segment.
+    :param speed: default speed in km/h
+    :param p2p_distance: distance to the previous point in km
+    :param ele_diff: elevation difference with the previous point in m
+    :param segment: segment of each point
+    :param segment_speed: speed in km/h of each segment
+    :return: speed of each point in km/h
+    """
+    segment_speed = segment_speed or {}
+    if any(value <= 0 for value in segment_speed.values()):
+        raise ValueError('Speed must be a positive number.')
+
+    # Look up table from segment index to speed
+    n_segments = max([*segment_speed, segment.max(initial=0)]) + 1
+    lookup = np.full(n_segments, speed, dtype='float64')
+    for seg, value in segment_speed.items():
+        lookup[seg] = value
+
+    return lookup[segment]
+
+
+MODELS = {'constant': constant_model,
+          'grade': grade_model,
+          'segment': segment_model}
+
+
+def timestamps(initial_time, speed: float, distance: np.array,
+               ele: np.array, segment: np.array, model: str = 'constant',
+               segment_speed: dict = None) -> np.array:
+    """
+    Timestamp of each point of a track.
+    :param initial_time: time of the first point
+    :param speed: speed in km/h, its meaning depends on the model
+    :param distance: cumulated distance in km
+    :param ele: elevation in m
+    :param segment: segment of each point
+    :param model: constant, grade or segment
+    :param segment_speed: speed of each segment for segment model
+    :return: datetime64[ns] array
+    """
+    try:
+        function = MODELS[model]
+    except KeyError:
+        raise ValueError(f'Unknown speed model: {model}')
+
+    if speed <= 0:
+        raise ValueError('Speed must be a positive number.')
+
+    distance = np.asarray(distance, dtype='float64')
+    p2p_distance = np.nan_to_num(np.diff(distance, prepend=distance[:1]))
+    ele = np.asarray(ele, dtype='float64')
+    ele_diff = np.nan_to_num(np.diff(ele, prepend=ele[:1]))
+
+    point_speed = function(speed, p2p_distance, ele_diff,
+                           np.asarray(segment), segment_speed)
+
+    # Elapsed time in microseconds, as datetime.timedelta resolution
+    elapsed = np.cumsum(p2p_distance / point_speed) * 3600e6
+    elapsed = np.round(elapsed).astype('int64').astype('timedelta64[us]')
+
+    return np.datetime64(initial_time, 'ns') + elapsed.astype(
+        'timedelta64[ns]')
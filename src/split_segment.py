@@ -6,7 +6,7 @@ included in the elevation axis.
 Author: alguerre
 License: MIT
 """
-from bisect import bisect
+import numpy as np
 import pandas as pd
 
 import plots
@@ -19,6 +19,7 @@ class SplitSegment:
         self.df_segment = df_segment
         self.segment_idx = self.df_segment.segment.iloc[0]  # idx selected seg
         self.max_index = df_segment.index[-1]  # last index in dataframe
+        self.distance = df_segment.distance.to_numpy()  # sorted, for search
         self.ax = [shared_data.ax_track, shared_data.ax_ele]
         self.track = shared_data.obj_track
         self.canvas = shared_data.canvas
@@ -116,8 +117,8 @@ class SplitSegment:
         # Move objects
         distance = self.df_segment.distance
         first_index = distance.index[0]
-        self.index = \
-            bisect(distance.reset_index(drop=True), x0 + dx) + first_index
+        self.index = np.searchsorted(self.distance, x0 + dx,
+                                     side='right') + first_index
 
         if self.index < 0:
             self.index = 0
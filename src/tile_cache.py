@@ -0,0 +1,127 @@
+"""TILE_CACHE
+Disk quota of the downloaded tiles.
+
+The database keeps the size and the last access of every tile. When the
+tiles use more than the quota, the least recently used ones are removed
+until the usage is under a fraction of the quota, so that passes are not
+run after every download. Tiles are removed in batches: files first, then
+their rows in one transaction, a tile without file is just downloaded
+again. Tiles of a single MBTiles file are removed from it. Low zoom tiles
+are few, small and needed by any map, they can be protected.
+
+Author: alguerre
+License: MIT
+"""
+import logging
+import os
+import threading
+
+import constants as c
+from db_handler import DbHandler
+from mbtiles import MBTiles
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TileCache:
+    """
+    Eviction of tiles over the disk quota.
+        - db_path: tiles database, opened by each pass
+        - quota: bytes, 0 disables the eviction
+        - protected_zoom: tiles up to this zoom are never removed
+        - store: single file of the tiles, if they are not one file each
+        - evicted_tiles and evicted_bytes: removed by all the passes
+    """
+    def __init__(self, db_path: str = c.db_path, quota: float = c.tiles_quota,
+                 protected_zoom: int = c.tiles_protected_zoom,
+                 target: float = c.tiles_evict_target,
+                 batch_size: int = c.tiles_evict_batch,
+                 store: MBTiles = None):
+        self.db_path = db_path
+        self.quota = quota
+        self.protected_zoom = protected_zoom
+        self.target = target
+        self.batch_size = batch_size
+        self.store = store
+        self.evicted_tiles = 0
+        self.evicted_bytes = 0
+
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def usage(self) -> (int, int):
+        """
+        :return: number of tiles and their size in bytes
+        """
+        db = DbHandler(self.db_path)
+        db.open_db()
+        try:
+            return db.get_usage()
+        finally:
+            db.close_db()
+
+    def evict(self) -> (int, int):
+        """
+        Remove least recently used tiles if the quota is exceeded.
+        :return: number of removed tiles and their size in bytes
+        """
+        if self.quota <= 0:
+            return 0, 0
+
+        db = DbHandler(self.db_path)
+        db.open_db()
+        removed, freed = 0, 0
+        try:
+            _, size = db.get_usage()
+            if size <= self.quota:
+                return 0, 0
+
+            while size > self.target * self.quota:
+                tiles = db.get_lru_tiles(self.batch_size,
+                                         min_zoom=self.protected_zoom + 1)
+                if not tiles:
+                    LOGGER.warning('Tiles quota cannot be met without '
+                                   'removing protected zooms')
+                    break
+
+                batch = []
+                for zoom, xtile, ytile, path, tile_size in tiles:
+                    if size <= self.target * self.quota:
+                        break
+                    if path and os.path.isfile(path):
+                        os.remove(path)
+                    batch.append((zoom, xtile, ytile))
+                    size -= tile_size
+                    freed += tile_size
+                if self.store is not None:
+                    self.store.remove_tiles(batch)
+                db.remove_tiles(batch)
+                removed += len(batch)
+        finally:
+            db.close_db()
+
+        with self._lock:
+            self.evicted_tiles += removed
+            self.evicted_bytes += freed
+        LOGGER.info(f'Tiles cache: {removed} tiles removed, '
+                    f'{freed / 1e6:.1f} MB freed, '
+                    f'{size / 1e6:.1f} MB of {self.quota / 1e6:.1f} MB used')
+        return removed, freed
+
+    def evict_in_background(self):
+        # Only one pass at a time, a pass already running is enough
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._evict, daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout: float = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _evict(self):
+        try:
+            self.evict()
+        except Exception as e:
+            LOGGER.error(f'Tiles cache eviction failed: {e}')
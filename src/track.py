@@ -7,34 +7,121 @@ carried out througout the Edit Menu.
 Author: alguerre
 License: MIT
 """
-import datetime as dt
+import concurrent.futures
+import functools
+import multiprocessing
+import os
+
 import pandas as pd
 import numpy as np
-import geopy.distance
-import gpxpy.gpx
 
-import utils
 import gpx
+import geodesy
+import speed_models
+import elevation as elevation_tools
+import journal
+import session
+import autosave
+from spatial_index import SpatialIndex
+from gpx_cache import GpxCache
 import constants as c
+from column_store import ColumnStore
+
+# Columns of the track and their types
+COLUMNS_TYPE = {'lat': 'float32',
+                'lon': 'float32',
+                'ele': 'float32',
+                'segment': 'int32',
+                'time': 'datetime64[ns]',
+                'ele_pos_cum': 'float32',
+                'ele_neg_cum': 'float32',
+                'distance': 'float32'}
+
+# Columns computed by the summary
+CUMULATED_COLUMNS = ['distance', 'ele_pos_cum', 'ele_neg_cum']
+
+# Under this amount of data, starting processes costs more than parsing
+PARALLEL_LOAD_BYTES = 5e+6
+
+
+def _autosaved(method):
+    # Track edits are written to the autosave, if any, once finished
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._autosave_checkpoint()
+        return result
+    return wrapper
+
+
+def read_gpx(file: str) -> dict:
+    """
+    Parse a gpx file and compute its point to point distance. It is
+    independent of any track, so that it can run in other processes.
+    :param file: gpx file path
+    :return: lat, lon, ele, time and p2p_distance arrays
+    """
+    df_gpx = gpx.Gpx(file).to_pandas()
+    data = {column: df_gpx[column].to_numpy()
+            for column in ['lat', 'lon', 'ele', 'time']}
+
+    # Distance is computed before storing coordinates as float32
+    data['p2p_distance'] = geodesy.point_to_point(data['lat'], data['lon'])
+    return data
+
+
+def read_gpx_files(files: list, processes: int = 1) -> list:
+    """
+    Read several gpx files, see read_gpx.
+    :param files: gpx file paths
+    :param processes: size of the process pool, small loads are done in
+        the current process
+    :return: data of each file
+    """
+    processes = min(processes or 1, len(files))
+
+    if processes > 1 and \
+            sum(os.path.getsize(file) for file in files) > \
+            PARALLEL_LOAD_BYTES:
+        # Spawn avoids forking the GUI process and its threads
+        with concurrent.futures.ProcessPoolExecutor(
+                processes,
+                mp_context=multiprocessing.get_context('spawn')) as executor:
+            return list(executor.map(read_gpx, files))
+
+    return [read_gpx(file) for file in files]
 
 
 class Track:
     """
     This class is designed to store gpx like data consisting of latitude-
     longitude-elevation-time and manipulate them. All these operations are
-    done with pandas.
+    done with numpy arrays.
     The data representation is:
-        - A pandas dataframe stores all data
+        - A column store (one numpy array per column) stores all data.
+        df_track provides a pandas view of it.
         - segments: each compoment of the track, each gpx file is a segment
-        - The dataframe have some extra columns not from gpx file, like
-        cumulated distance or elevation.
+        - Segments are contiguous in the store, an index keeps the first
+        and last+1 row of each segment in track order
+        - There are some extra columns not from gpx file, like cumulated
+        distance or elevation.
+        - Edits are recorded in a journal to be undone, see journal.py
         - Properties to store overall information
+        - Partial sums per segment, so that overall information is updated
+        only for the edited segments
     """
     def __init__(self):
-        # Define dataframe and types
+        # Define storage and types
         self.columns = ['lat', 'lon', 'ele', 'segment', 'time']
-        self.df_track = pd.DataFrame(columns=self.columns)
-        self._force_columns_type()
+        self.segment_index = {}  # segment: (start, stop) rows in df_track
+        self.segment_summary = {}  # partial sums and extremes per segment
+        self._store = ColumnStore(COLUMNS_TYPE)
+        self._df_track = None  # pandas view, built on demand
+        self._df_version = -1  # store version of the pandas view
+        self.journal = journal.EditJournal()
+        self.spatial_index = SpatialIndex()  # synchronized on queries
+        self.gpx_cache = GpxCache()
+        self.autosave = None  # see start_autosave
 
         # General purpose properties
         self.size = 0  # number of gpx in track
@@ -47,276 +134,722 @@ class Track:
         self.selected_segment_idx = []  # index of the segment
 
     def add_gpx(self, file: str):
-        gpx_track = gpx.Gpx(file)
-        df_gpx = gpx_track.to_pandas()
-        df_gpx = df_gpx[self.columns]
-        self.size += 1
-        self.last_segment_idx += 1
-        df_gpx['segment'] = self.last_segment_idx
+        self.add_gpx_files([file], processes=1)
 
-        self.df_track = pd.concat([self.df_track, df_gpx])
-        self.df_track = self.df_track.reset_index(drop=True)
-        self._update_summary()  # for full track
-        self._force_columns_type()
+    @_autosaved
+    def add_gpx_files(self, files: list, processes: int = None):
+        """
+        Load several gpx files, each one as a new segment. Files already
+        in the cache are not parsed, the rest are read in a process pool.
+        All of them are added at once: one append to the store, one
+        summary update and one undo step. If any file cannot be loaded the
+        track is not modified.
+        :param files: gpx file paths, segments follow this order
+        :param processes: size of the process pool, c.load_processes by
+            default. Small loads are done in the current process.
+        """
+        if processes is None:
+            processes = c.load_processes
+
+        keys = self.gpx_cache.keys(files)
+        loaded = [self.gpx_cache.get(key) for key in keys]
+        missing = [i for i, data in enumerate(loaded) if data is None]
+
+        parsed = read_gpx_files([files[i] for i in missing], processes)
+        for i, data in zip(missing, parsed):
+            self.gpx_cache.put(keys[i], data)
+            loaded[i] = data
+
+        if not loaded:
+            return
+
+        n_points = len(self._store)
+        new_points = sum(len(data['lat']) for data in loaded)
+        self._record_edit([('delete', n_points, n_points + new_points)])
+
+        segments = list(range(self.last_segment_idx + 1,
+                              self.last_segment_idx + len(loaded) + 1))
+        self.size += len(loaded)
+        self.last_segment_idx += len(loaded)
+
+        columns = {column: np.concatenate([data[column] for data in loaded])
+                   for column in ['lat', 'lon', 'ele', 'time']}
+        columns['segment'] = np.repeat(
+            segments, [len(data['lat']) for data in loaded])
+        start, _ = self._store.append(columns)
+
+        for seg, data in zip(segments, loaded):
+            self.segment_index[seg] = (start, start + len(data['lat']))
+            start += len(data['lat'])
+
+        self._update_summary(
+            changed=segments,
+            p2p_distance={seg: data['p2p_distance']
+                          for seg, data in zip(segments, loaded)})
+
+    @property
+    def df_track(self) -> pd.DataFrame:
+        # Pandas view of the store, only built again after modifications.
+        # It must not be modified.
+        if self._df_version != self._store.version:
+            self._df_track = self._store.to_pandas()
+            self._df_version = self._store.version
+        return self._df_track
+
+    @df_track.setter
+    def df_track(self, df_track: pd.DataFrame):
+        self._set_store(ColumnStore.from_pandas(df_track, COLUMNS_TYPE))
+
+    def save_session(self, session_file: str):
+        """
+        Save all the data of the track, see session.py.
+        :param session_file: output file
+        """
+        # The session may be saved over the file it was loaded from
+        self._unmap(session_file)
+        session.write(session_file,
+                      {column: self._store[column]
+                       for column in self._store.columns},
+                      self._session_metadata())
+
+    @_autosaved
+    def load_session(self, session_file: str):
+        """
+        Replace the track by a saved session. Session files are memory
+        mapped, former .h5 sessions are fully read.
+        :param session_file: session or .h5 file
+        """
+        if session_file.lower().endswith(session.H5_EXTENSIONS):
+            df_track, metadata = session.read_h5(session_file)
+            self.df_track = df_track
+        else:
+            columns, metadata = session.read(session_file)
+            self._set_store(ColumnStore.from_arrays(columns),
+                            metadata.get('segment_index'))
+        self._restore_metadata(metadata)
+
+    def start_autosave(self, file: str = c.autosave_path):
+        """
+        Keep an autosave of the track up to date: after every edit only the
+        modified data is written, in the background. See autosave.py.
+        :param file: autosave session file, it is overwritten
+        """
+        self.stop_autosave()
+        self.autosave = autosave.AutosaveJournal(file)
+        self._autosave_snapshot()
 
-    def get_segment(self, index: int):
-        return self.df_track[self.df_track['segment'] == index]
+    def stop_autosave(self, remove: bool = False):
+        """
+        Write the pending autosave data and stop updating it.
+        :param remove: delete the autosave files
+        """
+        if self.autosave is not None:
+            self.autosave.close(remove=remove)
+            self.autosave = None
+        self._store.log = None
 
+    def recover_session(self, file: str = c.autosave_path):
+        """
+        Replace the track by its autosave, e.g. after a crash.
+        :param file: autosave session file
+        """
+        store, metadata = autosave.recover(file)
+        self._set_store(store, metadata['segment_index'])
+        self._restore_metadata(metadata)
+
+    def _session_metadata(self) -> dict:
+        # Track information saved along with the columns
+        missing = [seg for seg in self.segment_index
+                   if seg not in self.segment_summary]
+        self._refresh_segment_summary(missing)
+
+        return {
+            'size': self.size,
+            'last_segment_idx': self.last_segment_idx,
+            'extremes': self.extremes,
+            'total_distance': self.total_distance,
+            'total_uphill': self.total_uphill,
+            'total_downhill': self.total_downhill,
+            'segment_index': [[seg, start, stop] for seg, (start, stop) in
+                              self.segment_index.items()],
+            'segment_summary': [
+                [seg, summary['distance'], summary['uphill'],
+                 summary['downhill'], summary['extremes']]
+                for seg, summary in self.segment_summary.items()]}
+
+    def _restore_metadata(self, metadata: dict):
+        # Missing information is computed from the data
+        self.size = metadata.get('size', len(self.segment_index))
+        self.last_segment_idx = metadata.get(
+            'last_segment_idx', max(self.segment_index, default=0))
+
+        if 'segment_summary' in metadata:
+            self.segment_summary = {
+                seg: {'distance': distance, 'uphill': uphill,
+                      'downhill': downhill, 'extremes': tuple(extremes)}
+                for seg, distance, uphill, downhill, extremes in
+                metadata['segment_summary']}
+        else:
+            self._refresh_segment_summary(list(self.segment_index))
+        self._update_totals()
+
+    def _autosave_snapshot(self):
+        # Whole track as the new autosave base, the store logs the next
+        # edits. Columns are copied since the store is modified in place
+        # while they are being written.
+        metadata = self._session_metadata()
+        self._unmap(self.autosave.file)  # e.g. a recovered track
+        self._store.log = []
+        self.autosave.snapshot({column: self._store[column].copy()
+                                for column in self._store.columns},
+                               metadata)
+
+    def _unmap(self, file: str):
+        # Memory maps of the file are released, the pandas view keeps them
+        self._store.unmap(file)
+        self._df_track = None
+        self._df_version = -1
+
+    def _autosave_checkpoint(self):
+        if self.autosave is None:
+            return
+
+        # A new store (e.g. loaded session) is not logged yet
+        if self._store.log is None or \
+                self.autosave.needs_compaction(self._store.log):
+            self._autosave_snapshot()
+        else:
+            metadata = self._session_metadata()
+            operations, self._store.log = self._store.log, []
+            self.autosave.append(operations, metadata)
+
+    def _set_store(self, store: ColumnStore, segment_index: list = None):
+        # External data (e.g. a loaded session) must be indexed if the index
+        # is not provided, its summary will be fully computed on next update
+        self._store = store
+        self._force_columns_type()
+        self._df_version = -1
+        self.journal.clear()
+        if segment_index is None:
+            self._index_segments()
+        else:
+            self.segment_index = {seg: (start, stop) for seg, start, stop
+                                  in segment_index}
+        self.segment_summary = {}
+
+    def get_segment(self, index: int) -> pd.DataFrame:
+        # Slice of the track, no data is copied
+        start, stop = self.segment_index[index]
+        return self.df_track.iloc[start:stop]
+
+    def closest_segment(self, point: tuple,
+                        max_distance: float) -> (float, int):
+        """
+        Segment of the closest point of the track.
+        :param point: latitude and longitude
+        :param max_distance: search radius in km
+        :return: distance in km and segment of the closest point, inf and 0
+            if no point is closer than max_distance
+        """
+        self.spatial_index.sync(self.segment_index,
+                                self._store['lat'], self._store['lon'])
+        distance, segment, _ = self.spatial_index.nearest(*point,
+                                                          max_distance)
+        return distance, segment
+
+    @_autosaved
     def reverse_segment(self, index: int):
-        segment = self.get_segment(index)
-        time = self.df_track.time  # using time is problematic, is managed
-        # separately
-        segment = segment.drop(columns=['time'])
-
-        rev_segment = pd.DataFrame(segment.values[::-1],
-                                   segment.index,
-                                   segment.columns)
-        rev_segment['time'] = time[::-1]
-        self.df_track.loc[self.df_track['segment'] == index] = rev_segment
-        self._force_columns_type()  # ensure proper type for columns
-
-        self._update_summary()  # for full track
-
-    def insert_timestamp(self, initial_time, speed):
-        self.df_track['time'] = \
-            self.df_track.apply(
-                lambda row:
-                initial_time + dt.timedelta(hours=row['distance']/speed),
-                axis=1)
-
-    def save_gpx(self, gpx_filename: str):
-        # Create track
-        ob_gpxpy = gpxpy.gpx.GPX()
-        gpx_track = gpxpy.gpx.GPXTrack()
-        ob_gpxpy.tracks.append(gpx_track)
-
-        # Insert default metadata
-        ob_gpxpy.creator = c.device
-        ob_gpxpy.author_email = c.author_email
-        ob_gpxpy.description = c.description
-        ob_gpxpy.author_name = c.author_name
-
-        # Create segments in track
-        for seg_id in self.df_track.segment.unique():
-            gpx_segment = gpxpy.gpx.GPXTrackSegment()
-            gpx_track.segments.append(gpx_segment)
-
-            df_segment = self.get_segment(seg_id)
-
-            # Insert points to segment
-            for idx in df_segment.index:
-                latitude = df_segment.loc[idx, 'lat']
-                longitude = df_segment.loc[idx, 'lon']
-                elevation = df_segment.loc[idx, 'ele']
-                time = df_segment.loc[idx, 'time']
-                gpx_point = gpxpy.gpx.GPXTrackPoint(latitude, longitude,
-                                                    elevation=elevation,
-                                                    time=time)
-                gpx_segment.points.append(gpx_point)
-
-        # Write file
-        with open(gpx_filename, 'w') as f:
-            f.write(ob_gpxpy.to_xml())
+        start, stop = self.segment_index[index]
+        self._record_edit(
+            self._saved_rows(start, stop,
+                             ['lat', 'lon', 'ele'] + CUMULATED_COLUMNS),
+            first_row=start)
+
+        # Using time is problematic, it is kept in its position
+        for column in ['lat', 'lon', 'ele']:
+            self._store.write(column,
+                              self._store[column][start:stop][::-1].copy(),
+                              start)
+
+        self._update_summary(changed=[index])
+
+    @_autosaved
+    def insert_timestamp(self, initial_time, speed: float,
+                         model: str = 'constant', segment_speed: dict = None):
+        """
+        Overwrite the time of all the points according to a speed model.
+        :param initial_time: time of the first point
+        :param speed: speed in km/h, see speed_models.py
+        :param model: constant, grade or segment
+        :param segment_speed: speed of each segment for segment model
+        """
+        time = speed_models.timestamps(initial_time, speed,
+                                       self._store['distance'],
+                                       self._store['ele'],
+                                       self._store['segment'],
+                                       model=model,
+                                       segment_speed=segment_speed)
+        self._record_edit(self._saved_rows(0, len(self._store), ['time']))
+        self._store.write('time', time)
+
+    def save_gpx(self, gpx_filename: str, compress: bool = None):
+        """
+        Write the track as a gpx file, each segment of the track is a
+        segment of the gpx track.
+        :param gpx_filename: output file, gzip is used for .gz files
+        :param compress: force or disable gzip
+        """
+        gpx.write(gpx_filename,
+                  {column: self._store[column]
+                   for column in ['lat', 'lon', 'ele', 'time']},
+                  list(self.segment_index.values()),
+                  metadata={'creator': c.device,
+                            'description': c.description,
+                            'author_name': c.author_name,
+                            'author_email': c.author_email},
+                  compress=compress)
 
     def smooth_elevation(self, index: int):
         # Apply moving average to fix elevation
+        self.filter_elevation('moving_average', segments=[index])
 
-        df_segment = self.get_segment(index)
-        elevation = df_segment.ele.to_numpy()
+    @_autosaved
+    def filter_elevation(self, method: str, segments: list = None,
+                         processes: int = None, **kwargs):
+        """
+        Filter the elevation of several segments in one call.
+        :param method: filter name, see elevation.py
+        :param segments: segments to filter, all by default
+        :param processes: filter segments in parallel with a process pool
+        :param kwargs: filter parameters
+        """
+        if segments is None:
+            segments = list(self.segment_index)
+        bounds = [self.segment_index[seg] for seg in segments]
+
+        filtered = elevation_tools.filter_segments(
+            self._store['ele'], bounds, method, processes=processes,
+            **kwargs)
+        self._record_edit(
+            [operation for start, stop in bounds for operation in
+             self._saved_rows(start, stop, ['ele'] + CUMULATED_COLUMNS)],
+            first_row=min([start for start, _ in bounds], default=None))
 
-        # Moving average
-        n = int(np.ceil(df_segment.shape[0]*0.05))
-        elevation_ma = utils.moving_average(elevation, n)
+        # Insert new elevation in track
+        for (start, _), elevation in zip(bounds, filtered):
+            self._store.write('ele', elevation, start)
+        self._update_summary(changed=segments)
 
-        # Concatenate moving average and initial line
-        smooth_elevation = np.concatenate(
-            (np.array([elevation[0] + i*(elevation_ma[0]-elevation[0])/n
-                       for i in range(1, n)]),
-             elevation_ma)
-        )
+    @_autosaved
+    def fix_elevation(self, index: int = None, segments: list = None):
+        """
+        Fix the steep zones of the elevation of several segments in one
+        call: one edit and one summary update. Segments with up to
+        c.fix_thr points, or whose steep zones cannot be fixed, are smoothed
+        with a moving average instead.
+        :param index: segment to fix
+        :param segments: segments to fix, all by default
+        """
+        if segments is None:
+            segments = list(self.segment_index) if index is None \
+                else [index]
+        bounds = [self.segment_index[seg] for seg in segments]
 
-        # Insert new elevation in track
-        df_segment = df_segment.drop(columns=['ele'])
-        df_segment['ele'] = smooth_elevation
-        self.df_track.loc[self.df_track['segment'] == index] = df_segment
-
-    def fix_elevation(self, index: int):
-        df_segment = self.get_segment(index)
-
-        # Identify and remove steep zones
-        steep_zone = [False] * df_segment.shape[0]
-        last_steep = 0
-
-        for i, (e, d) in enumerate(zip(df_segment['ele'].diff(),
-                                       df_segment['distance'])):
-            if abs(e) > c.steep_gap:
-                steep_zone[i] = True
-                last_steep = d
-
-            elif d - last_steep < c.steep_distance:
-                if d > c.steep_distance:
-                    steep_zone[i] = True
-
-        df_segment['steep_zone'] = steep_zone
-        df_no_steep = df_segment.copy()
-        df_no_steep['ele_to_fix'] = np.where(df_segment['steep_zone'] == False,
-                                             df_segment['ele'], -1)
-
-        # Fill steep zones
-        fixed_elevation = df_no_steep['ele_to_fix'].copy().to_numpy()
-        original_elevation = df_no_steep['ele'].copy().to_numpy()
-        fixed_steep_zone = df_no_steep['steep_zone'].copy()
-        before_x = before_y = after_x = after_y = None
-
-        for i in range(1, len(fixed_elevation)):
-            if not df_no_steep['steep_zone'].loc[i - 1] and \
-                    df_no_steep['steep_zone'].loc[i]:
-                before_x = np.arange(i - 11, i - 1)
-                before_y = fixed_elevation[i - 11:i - 1]
-                after_x = None
-                after_y = None
-
-            if df_no_steep['steep_zone'].loc[i - 1] and not \
-                    df_no_steep['steep_zone'].loc[i]:
-                after_x = np.arange(i, i + 10)
-                after_y = fixed_elevation[i:i + 10]
-                coef = np.polyfit(np.concatenate((before_x, after_x)),
-                                  np.concatenate((before_y, after_y)),
-                                  3)
-                for i in range(before_x[-1], after_x[0]):
-                    fixed_elevation[i] = np.polyval(coef, i)
-                    fixed_steep_zone[i] = False
-
-        # Apply moving average on tail
-        if after_y is None and after_x is None:
-            n = c.steep_k_moving_average
-            fixed_elevation[before_x[-1]:] = np.concatenate((
-                original_elevation[before_x[-1]:before_x[-1] + n - 1],
-                utils.moving_average(original_elevation[before_x[-1]:], n)))
-            fixed_steep_zone[before_x[-1]:] = True
+        fixed = [self._fixed_elevation(start, stop) for start, stop in bounds]
+        self._record_edit(
+            [operation for start, stop in bounds for operation in
+             self._saved_rows(start, stop, ['ele'] + CUMULATED_COLUMNS)],
+            first_row=min([start for start, _ in bounds], default=None))
 
         # Insert new elevation in track
-        df_segment['ele'] = fixed_elevation
-        self.df_track.loc[self.df_track['segment'] == index] = df_segment
+        for (start, _), elevation in zip(bounds, fixed):
+            self._store.write('ele', elevation, start)
+        self._update_summary(changed=segments)
+
+    def _fixed_elevation(self, start: int, stop: int) -> np.array:
+        # Identify and fill steep zones, or smooth small segments
+        elevation = self._store['ele'][start:stop]
+        if stop - start > c.fix_thr:
+            try:
+                steep_zone = elevation_tools.steep_zone(
+                    elevation, self._store['distance'][start:stop])
+                return elevation_tools.fix_steep_zones(elevation, steep_zone)
+            except ValueError:
+                pass
+        return elevation_tools.moving_average(elevation)
 
+    @_autosaved
     def remove_segment(self, index: int):
-        # Drop rows in dataframe
-        idx_segment = self.df_track[(self.df_track['segment'] == index)].index
-        self.df_track = self.df_track.drop(idx_segment)
-        self.df_track = self.df_track.reset_index(drop=True)
+        # Next segment is linked to a new one after the removal
+        start, stop = self.segment_index[index]
+        if stop < len(self._store):
+            next_segment = self._store['segment'][stop]
+        else:
+            next_segment = None
+
+        # Drop rows in store
+        self._record_edit(
+            [('insert', start,
+              {column: self._store[column][start:stop].copy()
+               for column in self._store.columns})],
+            first_row=start)
+        self._store.delete(start, stop)
         self.size -= 1
 
+        # Following segments are moved backwards
+        del self.segment_index[index]
+        for seg, (seg_start, seg_stop) in self.segment_index.items():
+            if seg_start >= stop:
+                self.segment_index[seg] = \
+                    (seg_start - (stop - start), seg_stop - (stop - start))
+
         # Update metadata
-        self._update_summary()
+        self._update_summary(changed=[], first=next_segment)
 
         # Clean full track if needed
         if self.size == 0:
-            self.df_track = self.df_track.drop(self.df_track.index)
+            self._store.delete(0, len(self._store))
 
         return self.size
 
+    @_autosaved
     def divide_segment(self, div_index: int):
         """
         :param div_index: refers to the index of the full df_track, not segment
         """
-        self.df_track['index'] = self.df_track.index
-
-        def segment_index_modifier(row):
-            if row['index'] < div_index:
-                return row['segment']
-            else:
-                return row['segment'] + 1
+        index = self._store['segment'][div_index]
+        self._record_edit([('shift', 'segment', div_index, -1)])
 
-        self.df_track['segment'] = \
-            self.df_track.apply(lambda row: segment_index_modifier(row),
-                                axis=1)
+        # Points from the division on belong to the following segment
+        self._store.write('segment',
+                          self._store['segment'][div_index:] + 1,
+                          div_index)
 
-        self.df_track = self.df_track.drop(['index'], axis=1)
         self.size += 1
-        self.last_segment_idx = max(self.df_track['segment'])
+
+        # Divided segment is split in the index, next ones are renamed
+        segment_index = {}
+        for seg, (start, stop) in self.segment_index.items():
+            if seg == index:
+                segment_index[seg] = (start, div_index)
+                segment_index[seg + 1] = (div_index, stop)
+            else:
+                segment_index[seg + 1 if seg > index else seg] = (start, stop)
+        self.segment_index = {seg: (start, stop) for seg, (start, stop) in
+                              segment_index.items() if stop > start}
+        self.last_segment_idx = max(self.segment_index)
+
+        # Cumulated columns do not change, only the divided segment summary
+        self.segment_summary = {seg + 1 if seg > index else seg: summary
+                                for seg, summary in
+                                self.segment_summary.items()
+                                if seg != index}
+        self._refresh_segment_summary(
+            [seg for seg in (index, index + 1) if seg in self.segment_index])
 
         return True
 
+    @_autosaved
     def change_order(self, new_order: dict):
-        self.df_track.segment = self.df_track.apply(
-            lambda row: new_order[row.segment],
-            axis=1)
-
-        self.df_track['index1'] = self.df_track.index
-        self.df_track = self.df_track.sort_values(by=['segment', 'index1'])
-        self.df_track = self.df_track.drop(labels=['index1'], axis=1)
-        self.df_track = self.df_track.reset_index(drop=True)
-        self._update_summary()  # for full track
-
-    def _update_summary(self):
-        self._insert_positive_elevation()
-        self._insert_negative_elevation()
-        self._insert_distance()
+        if not self.segment_index:
+            return
+
+        # First segment in a new position is the first one with a new link
+        moved = [new_order[seg] for position, seg in
+                 enumerate(self.segment_index)
+                 if sorted(new_order.values())[position] != new_order[seg]]
+
+        # Segments are placed one after another in the new order, points
+        # are moved as blocks
+        blocks = sorted((new_order[seg], start, stop)
+                        for seg, (start, stop) in self.segment_index.items())
+        state = self._state()
+        segment = self._store['segment'].copy()
+        inverse = journal.apply(
+            self._store,
+            ('blocks', [(start, stop) for _, start, stop in blocks]))
+        self._store.write('segment', np.repeat(
+            [seg for seg, _, _ in blocks],
+            [stop - start for _, start, stop in blocks]))
+
+        self.segment_index = {}
+        start = 0
+        for seg, block_start, block_stop in blocks:
+            self.segment_index[seg] = (start,
+                                       start + block_stop - block_start)
+            start += block_stop - block_start
+
+        self.segment_summary = {new_order[seg]: summary
+                                for seg, summary in
+                                self.segment_summary.items()}
+
+        # Rows before the first moved or renamed segment are not modified
+        renamed = [new_order[seg] for seg in state['segment_index']
+                   if new_order[seg] != seg]
+        first_row = min((self.segment_index[seg][0]
+                         for seg in moved + renamed), default=None)
+        self._record_edit(
+            [inverse, ('write', 'segment', first_row or 0,
+                       segment[first_row or 0:])],
+            first_row=first_row, state=state)
+
+        if moved:
+            self._update_summary(changed=[], first=min(moved))
+
+    @_autosaved
+    def undo(self) -> bool:
+        """
+        Revert the last edit.
+        :return: False if there is nothing to undo
+        """
+        if not self.journal.can_undo():
+            return False
+
+        self.journal.push_redo(self._revert(self.journal.pop_undo()))
+        return True
+
+    @_autosaved
+    def redo(self) -> bool:
+        """
+        Apply again the last undone edit.
+        :return: False if there is nothing to redo
+        """
+        if not self.journal.can_redo():
+            return False
+
+        self.journal.push_undo(self._revert(self.journal.pop_redo()))
+        return True
+
+    def _revert(self, edit: journal.Edit) -> journal.Edit:
+        """
+        Apply the inverse operations of an edit and restore the previous
+        state. Cumulated columns are only updated from the first modified
+        row, using the restored segment summary.
+        :param edit: edit to revert
+        :return: edit which reverts this one
+        """
+        state = self._state()
+        inverse = [journal.apply(self._store, operation)
+                   for operation in edit.operations]
+
+        self.segment_index = dict(edit.state['segment_index'])
+        self.segment_summary = dict(edit.state['segment_summary'])
+        self.size = edit.state['size']
+        self.last_segment_idx = edit.state['last_segment_idx']
+
+        first = None
+        if edit.first_row is not None:
+            first = next((seg for seg, (_, stop) in
+                          self.segment_index.items()
+                          if stop > edit.first_row), None)
+        self._update_summary(changed=[], first=first)
+
+        return journal.Edit(inverse[::-1], state, edit.first_row)
+
+    def _state(self) -> dict:
+        # Track attributes modified by edits, apart from the store
+        return {'segment_index': dict(self.segment_index),
+                'segment_summary': dict(self.segment_summary),
+                'size': self.size,
+                'last_segment_idx': self.last_segment_idx}
+
+    def _record_edit(self, operations: list, first_row: int = None,
+                     state: dict = None):
+        """
+        Store in the journal how to revert an edit, it must be called
+        before modifying the track unless the previous state is provided.
+        :param operations: inverse operations, see journal.py
+        :param first_row: first row whose cumulated values change
+        :param state: track state before the edit
+        """
+        self.journal.record(journal.Edit(operations,
+                                         state or self._state(),
+                                         first_row))
+
+    def _saved_rows(self, start: int, stop: int, columns: list) -> list:
+        # Operations to write back the current values of some rows
+        return [('write', column, start,
+                 self._store[column][start:stop].copy())
+                for column in columns]
+
+    def _update_summary(self, changed: list = None, first: int = None,
+                        p2p_distance: dict = None):
+        """
+        Incremental update of the cumulated columns (distance, ele_pos_cum,
+        ele_neg_cum) and the overall information. Segments before the first
+        affected one are not touched. After it, only changed segments are
+        fully recomputed, the rest just need the link with their previous
+        segment and the new offset of the cumulated values.
+        :param changed: segments whose points have been modified, new
+            segments are always considered as changed. None means all.
+        :param first: segment whose previous segment has changed (e.g. after
+            removing or reordering segments)
+        :param p2p_distance: already known point to point distance of some
+            changed segments, the link with previous segment is not used
+        """
+        segments = list(self.segment_index)
+
+        # Forget removed segments and find affected ones
+        self.segment_summary = {seg: summary for seg, summary in
+                                self.segment_summary.items()
+                                if seg in segments}
+        changed = set(segments if changed is None else changed)
+        changed |= set(segments) - set(self.segment_summary)
+
+        affected = [i for i, seg in enumerate(segments)
+                    if seg in changed or seg == first]
+
+        if affected:
+            self._update_cumulated(segments[min(affected):], changed,
+                                   p2p_distance or {})
+
+        self._update_totals()
+
+    def _update_cumulated(self, segments: list, changed: set,
+                          known_distance: dict):
+        """
+        Compute the cumulated columns from the first point of the first
+        input segment to the end of the track.
+        :param segments: all the segments from the first affected one
+        :param changed: segments whose points must be fully recomputed
+        :param known_distance: point to point distance of some changed
+            segments
+        """
+        bounds = [self.segment_index[seg] for seg in segments]
+        start = bounds[0][0]
+        n_points = len(self._store)
+
+        # Point to point distance: new geodesic distance is only computed for
+        # changed segments and links between segments
+        lat = self._store['lat'].astype('float64')
+        lon = self._store['lon'].astype('float64')
+        previous = self._store['distance'].astype('float64')
+        p2p_distance = np.zeros(n_points - start)
+        p2p_distance[1:] = np.diff(previous[start:])
+        links = []
+
+        for seg, (seg_start, seg_end) in zip(segments, bounds):
+            if seg in known_distance:
+                p2p_distance[seg_start - start + 1:seg_end - start] = \
+                    known_distance[seg][1:]
+                if seg_start > 0:
+                    links.append(seg_start)
+            elif seg in changed:
+                first_point = max(seg_start - 1, 0)
+                distance = geodesy.point_to_point(lat[first_point:seg_end],
+                                                  lon[first_point:seg_end])
+                p2p_distance[seg_start - start:seg_end - start] = \
+                    distance[seg_start - first_point:]
+            elif seg_start > 0:
+                links.append(seg_start)
+
+        if links:
+            links = np.array(links)
+            p2p_distance[links - start] = geodesy.distance(
+                lat[links - 1], lon[links - 1], lat[links], lon[links])
+
+        # Elevation difference, first point of the track has no previous one
+        ele = self._store['ele'].astype('float64')
+        if start > 0:
+            ele_diff = np.diff(ele[start - 1:])
+        else:
+            ele_diff = np.concatenate(([np.nan], np.diff(ele)))
+        ele_pos = np.where(ele_diff < 0, 0, ele_diff)
+        ele_neg = np.where(ele_diff > 0, 0, ele_diff)
+
+        # Per segment partial sums, including the link with previous segment
+        offsets = [seg_start - start for seg_start, _ in bounds]
+        partial_distance = np.add.reduceat(p2p_distance, offsets)
+        partial_uphill = np.add.reduceat(np.nan_to_num(ele_pos), offsets)
+        partial_downhill = np.add.reduceat(np.nan_to_num(ele_neg), offsets)
+
+        for i, (seg, (seg_start, seg_end)) in enumerate(zip(segments,
+                                                            bounds)):
+            if seg in changed:
+                extremes = self._segment_extremes(seg_start, seg_end)
+            else:
+                extremes = self.segment_summary[seg]['extremes']
+
+            self.segment_summary[seg] = {'distance': partial_distance[i],
+                                         'uphill': partial_uphill[i],
+                                         'downhill': partial_downhill[i],
+                                         'extremes': extremes}
+
+        # Cumulated values start where previous segments finish
+        previous = [summary for seg, summary in self.segment_summary.items()
+                    if seg not in segments]
+        base_distance = sum(summary['distance'] for summary in previous)
+        base_uphill = sum(summary['uphill'] for summary in previous)
+        base_downhill = sum(summary['downhill'] for summary in previous)
+
+        self._set_cumulated('distance', p2p_distance, base_distance, start)
+        self._set_cumulated('ele_pos_cum', ele_pos, base_uphill, start)
+        self._set_cumulated('ele_neg_cum', ele_neg, base_downhill, start)
+
+    def _set_cumulated(self, column: str, increment: np.array,
+                       base: float, start: int):
+        # Cumulated sum skipping NaN, as done by pandas
+        cumulated = base + np.nancumsum(increment)
+        cumulated[np.isnan(increment)] = np.nan
+
+        self._store.write(column, cumulated.astype('float32'), start)
+
+    def _refresh_segment_summary(self, segments: list):
+        # Partial sums from the current cumulated columns, no distance needs
+        # to be computed
+        for seg in segments:
+            seg_start, seg_end = self.segment_index[seg]
+            first_point = max(seg_start - 1, 0)
+            distance = self._store['distance'][first_point:seg_end].astype(
+                'float64')
+            ele_diff = np.diff(
+                self._store['ele'][first_point:seg_end].astype('float64'))
+            if seg_start == 0:
+                distance = np.concatenate(([0], distance))
+
+            self.segment_summary[seg] = {
+                'distance': distance[-1] - distance[0],
+                'uphill': np.nansum(np.where(ele_diff < 0, 0, ele_diff)),
+                'downhill': np.nansum(np.where(ele_diff > 0, 0, ele_diff)),
+                'extremes': self._segment_extremes(seg_start, seg_end)}
+
+    def _segment_extremes(self, seg_start: int, seg_end: int) -> tuple:
+        lat = self._store['lat'][seg_start:seg_end]
+        lon = self._store['lon'][seg_start:seg_end]
+        return lat.min(), lat.max(), lon.min(), lon.max()
+
+    def _update_totals(self):
+        if len(self._store) == 0:
+            self.segment_summary = {}
+            self.extremes = (0, 0, 0, 0)
+            self.total_distance = 0
+            self.total_uphill = 0
+            self.total_downhill = 0
+            return
+
+        self.total_distance = self._store['distance'][-1]
+        self.total_uphill = self._store['ele_pos_cum'][-1]
+        self.total_downhill = self._store['ele_neg_cum'][-1]
         self._update_extremes()
-        self.total_distance = self.df_track.distance.iloc[-1]
-        self.total_uphill = self.df_track.ele_pos_cum.iloc[-1]
-        self.total_downhill = self.df_track.ele_neg_cum.iloc[-1]
 
-    def _force_columns_type(self):
-        # At some points it is needed to ensure the data type of each column
-        self.df_track['lat'] = self.df_track['lat'].astype('float32')
-        self.df_track['lon'] = self.df_track['lon'].astype('float32')
-        self.df_track['ele'] = self.df_track['ele'].astype('float32')
-        self.df_track['segment'] = self.df_track['segment'].astype('int32')
-        self.df_track['time'] = self.df_track['time'].astype('datetime64[ns]')
-
-    def _insert_positive_elevation(self):
-        self.df_track['ele diff'] = self.df_track['ele'].diff()
-        negative_gain = self.df_track['ele diff'] < 0
-        self.df_track.loc[negative_gain, 'ele diff'] = 0
-
-        # Define new column
-        self.df_track['ele_pos_cum'] = \
-            self.df_track['ele diff'].cumsum().astype('float32')
-
-        # Drop temporary columns
-        self.df_track = self.df_track.drop(labels=['ele diff'], axis=1)
-
-    def _insert_negative_elevation(self):
-        self.df_track['ele diff'] = self.df_track['ele'].diff()
-        negative_gain = self.df_track['ele diff'] > 0
-        self.df_track.loc[negative_gain, 'ele diff'] = 0
-
-        # Define new column
-        self.df_track['ele_neg_cum'] = \
-            self.df_track['ele diff'].cumsum().astype('float32')
-
-        # Drop temporary columns
-        self.df_track = self.df_track.drop(labels=['ele diff'], axis=1)
-
-    def _insert_distance(self):
-        # Shift latitude and longitude (such way that first point is 0km)
-        self.df_track['lat_shift'] = pd.concat(
-            [pd.Series(np.nan), self.df_track.lat[0:-1]]). \
-            reset_index(drop=True)
-        self.df_track['lon_shift'] = pd.concat(
-            [pd.Series(np.nan), self.df_track.lon[0:-1]]). \
-            reset_index(drop=True)
-
-        def compute_distance(row):
-            from_coor = (row.lat, row.lon)
-            to_coor = (row.lat_shift, row.lon_shift)
-            try:
-                return abs(geopy.distance.geodesic(from_coor, to_coor).km)
-            except ValueError:
-                return 0
+    def _index_segments(self):
+        # Full scan of the segment column, segments must be contiguous
+        segment = self._store['segment']
+        starts = np.concatenate(
+            ([0], np.flatnonzero(segment[1:] != segment[:-1]) + 1))
+        stops = np.append(starts[1:], len(segment))
 
-        # Define new columns
-        self.df_track['p2p_distance'] = self.df_track.apply(compute_distance,
-                                                            axis=1)
-        self.df_track['distance'] = \
-            self.df_track.p2p_distance.cumsum().astype('float32')
+        self.segment_index = {
+            int(segment[start]): (int(start), int(stop))
+            for start, stop in zip(starts, stops) if stop > start}
 
-        # Drop temporary columns
-        self.df_track = self.df_track.drop(
-            labels=['lat_shift', 'lon_shift', 'p2p_distance'], axis=1)
+    def _force_columns_type(self):
+        # At some points it is needed to ensure the data type of each column
+        self._store.astype(COLUMNS_TYPE)
 
     def _update_extremes(self):
-        self.extremes = \
-            (self.df_track["lat"].min(), self.df_track["lat"].max(),
-             self.df_track["lon"].min(), self.df_track["lon"].max())
+        # Extremes of the track are extremes of its segments
+        extremes = np.array([summary['extremes'] for summary in
+                             self.segment_summary.values()])
+        self.extremes = (extremes[:, 0].min(), extremes[:, 1].max(),
+                         extremes[:, 2].min(), extremes[:, 3].max())
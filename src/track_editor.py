@@ -15,6 +15,7 @@ import logging
 import datetime as dt
 import os
 import tkinter as tk
+import tkinter.messagebox as messagebox
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
 import matplotlib.backends.backend_tkagg as backend_tkagg
@@ -26,6 +27,7 @@ import plots
 import track
 from file_menu import FileMenu
 from edit_menu import EditMenu
+import utils
 from utils import quit_app
 
 
@@ -52,6 +54,7 @@ class MainApplication(tk.Frame):
                                                                   self)
         self.shared_data.obj_track = track.Track()
         self.shared_data.cid = []
+        self.shared_data.prefetch_job = None  # map download, see file menu
 
         # Initialize user interface
         self.init_ui()  # Insert default image
@@ -62,6 +65,44 @@ class MainApplication(tk.Frame):
         EditMenu(self.menubar, self)
         self.parent.config(menu=self.menubar)
 
+        # The autosave is only left when the app was not properly closed
+        if os.path.exists(c.autosave_path) and messagebox.askyesno(
+                'Recover session',
+                'Track Editor was not properly closed. Do you wish to '
+                'recover the last session?'):
+            self.recover_session()
+        self.shared_data.obj_track.start_autosave()
+
+    @utils.exception_handler
+    def recover_session(self):
+        self.shared_data.obj_track.recover_session()
+        if self.shared_data.obj_track.size == 0:
+            return
+
+        track_info_table = plots.update_plots(
+            self.shared_data.obj_track,
+            self.shared_data.ax_track,
+            self.shared_data.ax_ele,
+            self.shared_data.ax_track_info,
+            canvas=self.shared_data.canvas)
+
+        cid = plots.segment_selection(
+            self.shared_data.obj_track,
+            self.shared_data.ax_track,
+            self.shared_data.ax_ele,
+            self.shared_data.fig_track,
+            track_info_table)
+        self.shared_data.cid.append(cid)
+        self.shared_data.canvas.draw()
+
+    def close(self):
+        # Properly closed, nothing to recover. A map download is resumed
+        # from its last batch.
+        self.shared_data.obj_track.stop_autosave(remove=True)
+        if self.shared_data.prefetch_job is not None:
+            self.shared_data.prefetch_job.stop()
+        quit_app(self.parent)
+
     def init_ui(self):
         # Prepare plot grid distribution
         gspec = gridspec.GridSpec(4, 8)
@@ -118,7 +159,8 @@ if __name__ == '__main__':
         root.iconbitmap(c.ico_path)
 
     # root.geometry('1200x800')
-    MainApplication(root).pack(side='top', fill='both', expand=True)
+    main_application = MainApplication(root)
+    main_application.pack(side='top', fill='both', expand=True)
 
-    root.protocol("WM_DELETE_WINDOW", lambda: quit_app(root))
+    root.protocol("WM_DELETE_WINDOW", main_application.close)
     root.mainloop()
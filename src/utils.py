@@ -4,7 +4,10 @@ General purpose functions
 Author: alguerre
 License: MIT
 """
+import concurrent.futures
 import hashlib
+import mmap
+import os
 import tkinter as tk
 from tkinter import ttk
 import tkinter.messagebox as messagebox
@@ -16,6 +19,62 @@ import queue
 import numpy as np
 import matplotlib.colors as mcolors
 
+import constants as c
+
+HASH_CHUNK_SIZE = 2 ** 20  # bytes read at once to compute a hash
+
+
+def file_hash(file: str, algorithm: str = 'md5', digest_size: int = None,
+              use_mmap: bool = False,
+              chunk_size: int = HASH_CHUNK_SIZE) -> str:
+    """
+    Hash of the content of a file, read in chunks so memory does not
+    depend on the file size.
+    :param file: filename of the file whose hash is computed for
+    :param algorithm: any hashlib algorithm, e.g. md5 or blake2b
+    :param digest_size: bytes of the digest for blake2b and blake2s, e.g. 16
+        for short cache keys
+    :param use_mmap: map the file in memory instead of reading it
+    :param chunk_size: bytes hashed at once
+    :return: hexadecimal digest
+    """
+    if digest_size is None:
+        file_hash_obj = hashlib.new(algorithm)
+    else:
+        file_hash_obj = hashlib.new(algorithm, digest_size=digest_size)
+
+    with open(file, 'rb') as a_file:
+        if use_mmap and os.fstat(a_file.fileno()).st_size > 0:
+            with mmap.mmap(a_file.fileno(), 0,
+                           access=mmap.ACCESS_READ) as content:
+                view = memoryview(content)
+                for start in range(0, len(content), chunk_size):
+                    file_hash_obj.update(view[start:start + chunk_size])
+                view.release()
+        else:
+            for chunk in iter(lambda: a_file.read(chunk_size), b''):
+                file_hash_obj.update(chunk)
+
+    return file_hash_obj.hexdigest()
+
+
+def hash_files(files: list, workers: int = c.hash_workers,
+               **kwargs) -> list:
+    """
+    Hash several files concurrently. Threads are enough since hashlib and
+    file reading release the GIL.
+    :param files: filenames
+    :param workers: number of threads
+    :param kwargs: see file_hash
+    :return: hexadecimal digest of each file
+    """
+    if workers <= 1 or len(files) <= 1:
+        return [file_hash(file, **kwargs) for file in files]
+
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(lambda file: file_hash(file, **kwargs),
+                                 files))
+
 
 def md5sum(file: str) -> str:
     """
@@ -23,15 +82,7 @@ def md5sum(file: str) -> str:
     :param file: filename of the file whose md5 is computed for
     :return: md5 string
     """
-    md5_hash = hashlib.md5()
-
-    a_file = open(file, "rb")
-    content = a_file.read()
-    md5_hash.update(content)
-
-    digest = md5_hash.hexdigest()
-
-    return digest
+    return file_hash(file, 'md5')
 
 
 def print_progress_bar(iteration: int, total: int,
@@ -0,0 +1,72 @@
+import pytest
+import time
+import functools
+import threading
+import http.server
+
+import iosm
+import track
+from gpx_cache import GpxCache
+
+
+@pytest.fixture(autouse=True)
+def gpx_cache(tmp_path, monkeypatch):
+    # Parsed files are cached in the temporary directory of each test
+    monkeypatch.setattr(track, 'GpxCache',
+                        functools.partial(GpxCache,
+                                          str(tmp_path / 'gpx_cache')))
+
+
+class TileHandler(http.server.BaseHTTPRequestHandler):
+    # Stand-in tile server: tiles content is their path, and the version of
+    # the server once tiles are changed
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+
+        time.sleep(0.01)  # round trip
+        zoom, x, y = map(int, self.path.strip('/').split('.')[0].split('/'))
+        etag = f'"{server.version}"'
+        if not (0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom):
+            self.send_error(404)
+        elif self.headers.get('If-None-Match') == etag:
+            with server.lock:
+                server.not_modified += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', f'max-age={server.max_age}')
+            self.end_headers()
+        else:
+            content = self.path.encode() * 100 + b'v' * server.version
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', f'max-age={server.max_age}')
+            if server.content_length:
+                self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        with server.lock:
+            server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def tile_server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), TileHandler)
+    server.lock = threading.Lock()
+    server.requests = server.active = server.max_active = 0
+    server.not_modified = server.version = 0
+    server.max_age = 3600
+    server.content_length = True
+    iosm.HOST_LIMITS.clear()  # ports of former servers may be reused
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,138 @@
+import os
+import pytest
+import numpy as np
+import datetime as dt
+
+import autosave
+import track
+from column_store import ColumnStore
+from constants import prj_path
+
+FILES = [f'{prj_path}/test/test_cases/Innacessible_Island_part{n}.gpx'
+         for n in range(1, 6)]
+
+
+def edit_track(obj_track: track.Track):
+    obj_track.add_gpx_files(FILES[:3])
+    obj_track.insert_timestamp(dt.datetime(2010, 1, 1), 4)
+    obj_track.reverse_segment(2)
+    obj_track.filter_elevation('moving_average', segments=[1])
+    obj_track.divide_segment(30)
+    obj_track.change_order({1: 3, 2: 1, 3: 4, 4: 2})
+    obj_track.remove_segment(1)
+    obj_track.undo()
+    obj_track.undo()
+    obj_track.redo()
+    obj_track.add_gpx_files(FILES[3:])
+
+
+def check_same_track(obj_track: track.Track, expected: track.Track):
+    assert obj_track.segment_index == expected.segment_index
+    assert obj_track.size == expected.size
+    assert obj_track.last_segment_idx == expected.last_segment_idx
+    assert obj_track.total_distance == pytest.approx(expected.total_distance)
+    assert obj_track.total_uphill == pytest.approx(expected.total_uphill)
+    assert obj_track.df_track.equals(expected.df_track)
+
+
+def test_recover(tmp_path):
+    file = str(tmp_path / 'autosave.session')
+    obj_track = track.Track()
+    obj_track.start_autosave(file)
+    edit_track(obj_track)
+    obj_track.autosave.flush()
+
+    # Only the base and the edits are written, no compaction
+    assert os.path.getsize(file + autosave.LOG_SUFFIX) > 0
+    assert obj_track.autosave.snapshots == 1
+
+    recovered_track = track.Track()
+    recovered_track.recover_session(file)
+    check_same_track(recovered_track, obj_track)
+
+    # Files are removed when the track is properly closed
+    obj_track.stop_autosave(remove=True)
+    assert not os.path.exists(file)
+    assert not os.path.exists(file + autosave.LOG_SUFFIX)
+
+
+def test_torn_record(tmp_path):
+    file = str(tmp_path / 'autosave.session')
+    obj_track = track.Track()
+    obj_track.start_autosave(file)
+    obj_track.add_gpx_files(FILES[:2])
+    obj_track.autosave.flush()
+    expected = track.Track()
+    expected.recover_session(file)
+
+    # Crash while writing the last edit
+    obj_track.reverse_segment(1)
+    obj_track.stop_autosave()
+    with open(file + autosave.LOG_SUFFIX, 'r+b') as f:
+        f.truncate(os.path.getsize(file + autosave.LOG_SUFFIX) - 10)
+
+    recovered_track = track.Track()
+    recovered_track.recover_session(file)
+    check_same_track(recovered_track, expected)
+
+
+def test_stale_log(tmp_path):
+    file = str(tmp_path / 'autosave.session')
+    crashed_track = track.Track()
+    crashed_track.start_autosave(file)
+    edit_track(crashed_track)
+    crashed_track.stop_autosave()
+    with open(file + autosave.LOG_SUFFIX, 'rb') as f:
+        stale_log = f.read()
+
+    # New session crashing after writing its base, before its log
+    obj_track = track.Track()
+    obj_track.start_autosave(file)
+    obj_track.add_gpx_files(FILES[:2])
+    obj_track.stop_autosave()
+    with open(file + autosave.LOG_SUFFIX, 'wb') as f:
+        f.write(stale_log)
+
+    recovered_track = track.Track()
+    recovered_track.recover_session(file)
+    assert recovered_track.segment_index == {}
+
+
+def test_compaction(tmp_path):
+    file = str(tmp_path / 'autosave.session')
+    obj_track = track.Track()
+    obj_track.start_autosave(file)
+    obj_track.autosave.compact_size = 0
+    edit_track(obj_track)
+    obj_track.autosave.flush()
+
+    # Every edit writes a new base and empties the log
+    assert obj_track.autosave.snapshots > 1
+    assert os.path.getsize(file + autosave.LOG_SUFFIX) == \
+        len(autosave.MAGIC) + autosave.LOG_HEADER.size
+
+    recovered_track = track.Track()
+    recovered_track.recover_session(file)
+    check_same_track(recovered_track, obj_track)
+    obj_track.stop_autosave(remove=True)
+
+
+def test_replay():
+    dtypes = {'x': 'float32', 'n': 'int32'}
+    store = ColumnStore(dtypes)
+    copy = store.copy()
+    store.log = []
+
+    store.append({'x': np.arange(10), 'n': 1})
+    store.insert(2, {'x': np.array([-1, -2])})
+    store.take(np.r_[8:12, 0:2, 4:8, 2:4])
+    store.write('n', np.int32(5), start=3)
+    store.delete(0, 1)
+    store.astype({'x': 'float64'})
+
+    for operation in store.log:
+        autosave.replay(copy, operation)
+
+    for column in dtypes:
+        assert copy[column].dtype == store[column].dtype
+        assert copy[column].tolist() == store[column].tolist()
@@ -0,0 +1,77 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+import column_store
+
+DTYPES = {'x': 'float32', 'n': 'int32', 'time': 'datetime64[ns]'}
+
+
+def test_append_grow():
+    store = column_store.ColumnStore(DTYPES, capacity=4)
+
+    assert store.append({'x': np.arange(3), 'n': 1}) == (0, 3)
+    assert store.append({'x': np.arange(5), 'n': 2}) == (3, 8)
+
+    # Data is kept after growing, missing columns are filled
+    assert len(store) == 8
+    assert store['x'].tolist() == [0, 1, 2, 0, 1, 2, 3, 4]
+    assert store['n'].tolist() == [1] * 3 + [2] * 5
+    assert np.isnat(store['time']).all()
+    assert store['x'].dtype == np.float32
+
+
+def test_delete_take_write():
+    store = column_store.ColumnStore(DTYPES)
+    store.append({'x': np.arange(6), 'n': np.arange(6) * 10})
+    version = store.version
+
+    store.delete(1, 3)
+    assert store['x'].tolist() == [0, 3, 4, 5]
+    assert store['n'].tolist() == [0, 30, 40, 50]
+
+    store.take(np.array([3, 2, 1, 0]))
+    assert store['x'].tolist() == [5, 4, 3, 0]
+    assert store['n'].tolist() == [50, 40, 30, 0]
+
+    store.write('x', np.array([-1, -2]), start=1)
+    assert store['x'].tolist() == [5, -1, -2, 0]
+
+    # New columns
+    store.write('y', np.float64(7))
+    assert store['y'].tolist() == [7, 7, 7, 7]
+
+    assert store.version > version
+
+
+def test_pandas_round_trip():
+    df = pd.DataFrame({'x': [1.5, 2.5, 3.5],
+                       'n': [1, 1, 2],
+                       'time': pd.to_datetime(['2020-01-01'] * 3)})
+
+    store = column_store.ColumnStore.from_pandas(df, DTYPES)
+    df_store = store.to_pandas()
+
+    assert df_store.columns.tolist() == ['x', 'n', 'time']
+    assert df_store['n'].dtype == np.int32
+    assert df_store['x'].tolist() == pytest.approx(df['x'].tolist())
+    assert (df_store['time'] == df['time']).all()
+
+    # Partial views keep the row number as index
+    assert store.to_pandas(1, 3).index.tolist() == [1, 2]
+
+    # Copies are independent
+    copy = store.copy()
+    store.write('n', 0)
+    assert copy['n'].tolist() == [1, 1, 2]
+
+
+def test_insert():
+    store = column_store.ColumnStore(DTYPES, capacity=4)
+    store.append({'x': np.arange(4), 'n': 1})
+
+    assert store.insert(1, {'x': np.array([10, 11]), 'n': 2}) == (1, 3)
+
+    assert store['x'].tolist() == [0, 10, 11, 1, 2, 3]
+    assert store['n'].tolist() == [1, 2, 2, 1, 1, 1]
+    assert np.isnat(store['time']).all()
@@ -1,4 +1,5 @@
 import pytest
+import sqlite3
 import pandas as pd
 
 from db_handler import DbHandler
@@ -123,3 +124,45 @@ def test_tile_exists():
 
     assert dbh._tile_exists(1, 1, 0)
     assert not dbh._tile_exists(1, 1, 4)
+
+
+def test_insert_tiles(tmp_path):
+    dbh = DbHandler(str(tmp_path / 'tiles.sqlite'))
+    dbh.open_db()
+    tiles = [(12, x, y, True, f'/{x}/{y}', 100)
+             for x in range(100) for y in range(100)]
+    assert dbh.insert_tiles(tiles)
+
+    # Upsert: existing tiles are replaced
+    dbh.insert_tiles([(12, 5, 5, False, '/5/5', 100),
+                      (13, 5, 5, True, '/13/5/5', 200)])
+
+    statuses = dbh.get_tile_statuses(12, 3, 4, 6, 5)
+    assert len(statuses) == 8
+    assert statuses[(12, 3, 4)]
+    assert not statuses[(12, 5, 5)]
+    assert dbh.get_tile_size(12, 5, 5) == 0
+    assert dbh.get_tile_size(13, 5, 5) == 200
+    assert len(dbh.print_tiles(verbose=False)) == 100 * 100 + 1
+    assert dbh.cur.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+
+def test_add_primary_key(tmp_path):
+    # Former tables have no key and may have repeated tiles
+    db_path = str(tmp_path / 'tiles.sqlite')
+    conn = sqlite3.connect(db_path)
+    conn.execute("""CREATE TABLE Tiles (zoom INTEGER, x INTEGER, y INTEGER,
+                                        status BOOLEAN, path TEXT,
+                                        size INTEGER)""")
+    conn.executemany('INSERT INTO Tiles VALUES(?, ?, ?, ?, ?, ?)',
+                     [(1, 0, 0, False, '/a', 0), (1, 0, 0, True, '/a', 10),
+                      (1, 1, 0, True, '/b', 20)])
+    conn.commit()
+    conn.close()
+
+    dbh = DbHandler(db_path)
+    assert dbh.open_db()
+    assert dbh.get_tile_statuses(1, 0, 0, 1, 1) == {(1, 0, 0): True,
+                                                    (1, 1, 0): True}
+    assert dbh.get_tile_size(1, 0, 0) == 10
+    assert 'last_access' in dbh.print_tiles(verbose=False).columns
@@ -0,0 +1,152 @@
+import pytest
+import numpy as np
+
+import elevation
+import track
+import constants as c
+from constants import prj_path
+
+
+def get_segment(file: str):
+    obj_track = track.Track()
+    obj_track.add_gpx(f'{prj_path}/test/test_cases/{file}')
+    return obj_track.df_track.ele.to_numpy(), \
+        obj_track.df_track.distance.to_numpy()
+
+
+def loop_steep_zone(ele: np.array, distance: np.array) -> np.array:
+    # Point by point definition of steep zones
+    steep_zone = [False] * len(ele)
+    last_steep = 0
+    for i, (e, d) in enumerate(zip(np.diff(ele, prepend=np.nan), distance)):
+        if abs(e) > c.steep_gap:
+            steep_zone[i] = True
+            last_steep = d
+        elif d - last_steep < c.steep_distance:
+            if d > c.steep_distance:
+                steep_zone[i] = True
+    return np.array(steep_zone)
+
+
+def loop_fix_steep_zones(ele: np.array, steep_zone: np.array) -> np.array:
+    # Point by point fit of each closed steep zone
+    fixed = np.where(steep_zone, -1, ele).astype(ele.dtype)
+    before_x = before_y = None
+    for i in range(1, len(fixed)):
+        if not steep_zone[i - 1] and steep_zone[i]:
+            before_x = np.arange(i - 11, i - 1)
+            before_y = fixed[i - 11:i - 1]
+        if steep_zone[i - 1] and not steep_zone[i]:
+            after_x = np.arange(i, i + 10)
+            after_y = fixed[i:i + 10]
+            coef = np.polyfit(np.concatenate((before_x, after_x)),
+                              np.concatenate((before_y, after_y)), 3)
+            for j in range(before_x[-1], after_x[0]):
+                fixed[j] = np.polyval(coef, j)
+    return fixed
+
+
+@pytest.mark.parametrize('file', ['basic_sample.gpx', 'nominal_route.gpx'])
+def test_steep_zone(file):
+    ele, distance = get_segment(file)
+
+    steep_zone = elevation.steep_zone(ele, distance)
+
+    assert steep_zone.any()
+    assert (steep_zone == loop_steep_zone(ele, distance)).all()
+
+
+@pytest.mark.parametrize('file', ['basic_sample.gpx', 'nominal_route.gpx'])
+def test_fix_steep_zones(file):
+    ele, distance = get_segment(file)
+    steep_zone = elevation.steep_zone(ele, distance)
+    if steep_zone[-1]:  # open zone at the end is not fitted
+        steep_zone[np.flatnonzero(~steep_zone)[-1] + 1:] = False
+
+    fixed = elevation.fix_steep_zones(ele, steep_zone)
+
+    assert fixed == pytest.approx(loop_fix_steep_zones(ele, steep_zone),
+                                  abs=1e-3)
+
+
+def test_fix_steep_zones_tail():
+    # Moving average from the steep zone at the end of a short track
+    ele = np.array([10, 10, 10, 10, 20, 30, 40, 50], dtype='float32')
+    steep_zone = np.array([False] * 4 + [True] * 4)
+
+    fixed = elevation.fix_steep_zones(ele, steep_zone)
+
+    assert fixed[:-1] == pytest.approx(ele[:-1])
+    assert fixed[-1] == pytest.approx(np.mean(ele[2:]))
+
+
+def noisy_profile(n: int = 2000) -> np.array:
+    rng = np.random.default_rng(3)
+    x = np.linspace(0, 10, n)
+    return (500 + 100 * np.sin(x) + rng.normal(0, 3, n)).astype('float32')
+
+
+@pytest.mark.parametrize('method', list(elevation.FILTERS))
+def test_filters(method):
+    ele = noisy_profile()
+
+    filtered = elevation.filter_elevation(ele, method)
+
+    # Same length, less noise and same trend
+    assert filtered.shape == ele.shape
+    assert np.std(np.diff(filtered)) < np.std(np.diff(ele))
+    assert np.corrcoef(filtered, ele)[0, 1] > 0.95
+
+
+def test_filters_short_input():
+    ele = np.array([10, 12, 11], dtype='float32')
+
+    for method in elevation.FILTERS:
+        assert elevation.filter_elevation(ele, method).shape == (3,)
+
+    with pytest.raises(ValueError):
+        elevation.filter_elevation(ele, 'unknown')
+
+
+def test_median_spike():
+    ele = np.full(50, 100, dtype='float32')
+    ele[20] = 400
+
+    assert elevation.median(ele, 5) == pytest.approx(np.full(50, 100))
+
+
+def test_savitzky_golay_polynomial():
+    # Polynomials up to the order of the filter are not modified
+    x = np.arange(100, dtype='float64')
+    ele = 0.001 * (x - 50) ** 3 + 2 * x
+
+    filtered = elevation.savitzky_golay(ele, 11, 3)
+
+    assert filtered[5:-5] == pytest.approx(ele[5:-5])
+
+
+def test_hysteresis():
+    ele = noisy_profile()
+    threshold = 4
+
+    # Point by point definition
+    expected = [ele[0]]
+    for e in ele[1:]:
+        expected.append(min(max(expected[-1], e - threshold), e + threshold))
+
+    assert elevation.hysteresis(ele, threshold) == pytest.approx(expected)
+
+
+def test_filter_segments():
+    ele = noisy_profile()
+    bounds = [(0, 700), (700, 1500), (1500, 2000)]
+
+    serial = elevation.filter_segments(ele, bounds, 'savitzky_golay')
+    parallel = elevation.filter_segments(ele, bounds, 'savitzky_golay',
+                                         processes=2)
+
+    for (start, stop), segment, parallel_segment in zip(bounds, serial,
+                                                        parallel):
+        assert segment == pytest.approx(
+            elevation.savitzky_golay(ele[start:stop]))
+        assert parallel_segment == pytest.approx(segment)
@@ -0,0 +1,78 @@
+import pytest
+import numpy as np
+import geopy.distance
+
+import geodesy
+import gpx
+from constants import prj_path
+
+# Maximum relative error allowed for each method compared to geopy
+TOLERANCE = {'haversine': 6e-3,
+             'andoyer': 1e-5,
+             'vincenty': 1e-9}
+
+
+def random_pairs(scale: float, n: int = 500):
+    rng = np.random.default_rng(1)
+    lat1 = rng.uniform(-85, 85, n)
+    lon1 = rng.uniform(-180, 180, n)
+    lat2 = np.clip(lat1 + rng.normal(0, scale, n), -89.9, 89.9)
+    lon2 = lon1 + rng.normal(0, scale, n)
+    return lat1, lon1, lat2, lon2
+
+
+def geopy_distance(lat1, lon1, lat2, lon2):
+    return np.array([geopy.distance.geodesic((a, b), (c, d)).km
+                     for a, b, c, d in zip(lat1, lon1, lat2, lon2)])
+
+
+@pytest.mark.parametrize('method', list(TOLERANCE))
+@pytest.mark.parametrize('scale', [0.001, 0.1, 10])
+def test_distance_against_geopy(method, scale):
+    lat1, lon1, lat2, lon2 = random_pairs(scale)
+    reference = geopy_distance(lat1, lon1, lat2, lon2)
+
+    computed = geodesy.distance(lat1, lon1, lat2, lon2, method=method)
+
+    assert computed == pytest.approx(reference, rel=TOLERANCE[method])
+
+
+def test_distance_same_point():
+    for method in geodesy.METHODS:
+        assert geodesy.distance(np.array([45.0]), np.array([7.0]),
+                                np.array([45.0]), np.array([7.0]),
+                                method=method)[0] == 0
+
+
+def test_distance_unknown_method():
+    with pytest.raises(ValueError):
+        geodesy.distance(0, 0, 1, 1, method='flat_earth')
+
+
+def test_vincenty_antipodal():
+    # Vincenty does not converge here, geopy is used as fallback
+    computed = geodesy.vincenty(np.array([0.0]), np.array([0.0]),
+                                np.array([0.5]), np.array([179.7]))
+    reference = geopy.distance.geodesic((0, 0), (0.5, 179.7)).km
+
+    assert computed[0] == pytest.approx(reference)
+
+
+def test_point_to_point():
+    df = gpx.Gpx(
+        f'{prj_path}/test/test_cases/Innacessible_Island_Full.gpx'
+    ).to_pandas()
+    lat = df.lat.to_numpy()
+    lon = df.lon.to_numpy()
+
+    p2p_distance = geodesy.point_to_point(lat, lon)
+    reference = geopy_distance(lat[:-1], lon[:-1], lat[1:], lon[1:])
+
+    assert p2p_distance.shape == lat.shape
+    assert p2p_distance[0] == 0
+    assert p2p_distance[1:] == pytest.approx(reference, abs=1e-6)  # 1 mm
+
+
+def test_point_to_point_short_input():
+    assert len(geodesy.point_to_point([], [])) == 0
+    assert geodesy.point_to_point([46.2], [6.03])[0] == 0
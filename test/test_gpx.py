@@ -1,6 +1,7 @@
 import pytest
 import datetime as dt
 import os
+import numpy as np
 
 import gpx
 
@@ -12,9 +13,78 @@ def test_load_file():
     assert route._load_file()
 
 
-def test_load_file_big():
+def write_gpx(file, n_tracks: int, n_segments: int, n_points: int):
+    with open(file, 'w') as gpx_file:
+        gpx_file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                       '<gpx version="1.0" '
+                       'xmlns="http://www.topografix.com/GPX/1/0">\n')
+        for i_track in range(n_tracks):
+            gpx_file.write('<trk><name>Track</name>\n')
+            for i_seg in range(n_segments):
+                gpx_file.write('<trkseg>\n')
+                gpx_file.write(''.join(
+                    f'<trkpt lat="{40 + i * 1e-5:.7f}" '
+                    f'lon="{-3 - i * 1e-5:.7f}"><ele>{i % 1000}.5</ele>'
+                    f'<time>2020-01-01T00:00:{i % 60:02d}Z</time></trkpt>\n'
+                    for i in range(n_points)))
+                gpx_file.write('</trkseg>\n')
+            gpx_file.write('</trk>\n')
+        gpx_file.write('</gpx>\n')
+
+
+def test_load_file_big(tmp_path):
+    # No size limit, 120k points are over 10 MB
+    file = tmp_path / 'big.gpx'
+    write_gpx(file, n_tracks=1, n_segments=2, n_points=60000)
+    assert os.stat(file).st_size > 10e+6
+
+    route = gpx.Gpx(file)
+    route_df = route.to_pandas()
+
+    assert route.n_points == 120000
+    assert route.points_per_second > 0
+    assert route_df.iloc[-1].lat == pytest.approx(40 + 59999e-5)
+    assert route_df.iloc[-1].ele == pytest.approx(999.5)
+    assert route_df.iloc[-1].time == dt.datetime(2020, 1, 1, 0, 0, 59)
+
+
+def test_parse_numbering(tmp_path):
+    file = tmp_path / 'numbering.gpx'
+    write_gpx(file, n_tracks=2, n_segments=3, n_points=5)
+
+    # Small chunks to flush several times inside segments
+    route_data = gpx.parse(str(file), chunk_points=4)
+
+    assert len(route_data) == 30
+    assert route_data['track'].tolist() == [0] * 5 + [1] * 5 + [2] * 5 + \
+        [0] * 5 + [1] * 5 + [2] * 5
+    assert route_data['segment'].tolist() == [0] * 15 + [1] * 15
+    assert route_data['ele'].tolist() == [0.5, 1.5, 2.5, 3.5, 4.5] * 6
+
+
+def test_load_file_not_gpx(tmp_path):
+    file = tmp_path / 'wrong.gpx'
+    file.write_text('<gpx><trk><trkseg><trkpt lat="1" lon="1"></trk>')
+
+    with pytest.raises(gpx.LoadGpxError):
+        gpx.Gpx(file)
+
+
+@pytest.mark.parametrize('point', ['<trkpt lon="1"/>',
+                                   '<trkpt lat="north" lon="1"/>',
+                                   '<trkpt lat="1" lon="1"><ele>high</ele>'
+                                   '</trkpt>'])
+def test_load_file_wrong_point(tmp_path, point):
+    file = tmp_path / 'wrong.gpx'
+    file.write_text(f'<gpx><trk><trkseg>{point}</trkseg></trk></gpx>')
+
+    with pytest.raises(gpx.LoadGpxError):
+        gpx.Gpx(file)
+
+
+def test_load_file_missing(tmp_path):
     with pytest.raises(gpx.LoadGpxError):
-        gpx.Gpx(f'{TEST_PATH}/test_cases/over_10mb.gpx')
+        gpx.Gpx(tmp_path / 'missing.gpx')
 
 
 def test_load_file_no_permission():
@@ -68,3 +138,27 @@ def test_to_pandas():
     assert route_df.iloc[-1].lat == pytest.approx(46.230118)
     assert route_df.iloc[-1].lon == pytest.approx(6.052533)
     assert route_df.iloc[-1].ele == pytest.approx(428.2)
+
+
+@pytest.mark.parametrize('filename', ['saved.gpx', 'saved.gpx.gz'])
+def test_write(tmp_path, filename):
+    columns = {'lat': np.array([40.1, 40.2, 40.3, 40.4], dtype='float32'),
+               'lon': np.array([-3.1, -3.2, -3.3, -3.4], dtype='float32'),
+               'ele': np.array([600, np.nan, 601.5, 602], dtype='float32'),
+               'time': np.array(['2020-01-01T00:00:00', 'NaT',
+                                 '2020-01-01T00:00:02.5',
+                                 '2020-01-01T00:00:03'],
+                                dtype='datetime64[ns]')}
+
+    # Small chunks to write segments in several pieces
+    gpx.write(tmp_path / filename, columns, [(0, 3), (3, 4)],
+              metadata={'creator': 'Device & Co', 'author_name': 'Me',
+                        'author_email': 'me@mail.com'},
+              chunk_points=2)
+    with gpx._open(tmp_path / filename, 'rb') as gpx_file:
+        route_data = gpx.parse(gpx_file)
+
+    assert route_data['track'].tolist() == [0, 0, 0, 1]
+    for column in columns:
+        assert np.array_equal(route_data[column].astype(columns[column].dtype),
+                              columns[column], equal_nan=True)
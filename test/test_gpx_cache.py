@@ -0,0 +1,75 @@
+import os
+import numpy as np
+
+import gpx
+import track
+from gpx_cache import GpxCache
+from constants import prj_path
+
+FILES = [f'{prj_path}/test/test_cases/Innacessible_Island_part{n}.gpx'
+         for n in range(1, 4)]
+
+
+def test_put_get(tmp_path):
+    cache = GpxCache(str(tmp_path))
+    data = track.read_gpx(FILES[0])
+    key = cache.key(FILES[0])
+
+    assert cache.get(key) is None
+    cache.put(key, data)
+    cached = cache.get(key)
+
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert isinstance(cached['lat'], np.memmap)
+    for column in data:
+        assert np.array_equal(cached[column], data[column], equal_nan=True)
+
+
+def test_content_key(tmp_path):
+    # Copies of a file share the entry
+    copy = tmp_path / 'copy.gpx'
+    copy.write_bytes(open(FILES[0], 'rb').read())
+
+    assert GpxCache.key(str(copy)) == GpxCache.key(FILES[0])
+    assert GpxCache.key(FILES[1]) != GpxCache.key(FILES[0])
+
+
+def test_lru_eviction(tmp_path):
+    data = [track.read_gpx(file) for file in FILES]
+    keys = [GpxCache.key(file) for file in FILES]
+    entry_size = GpxCache(str(tmp_path / 'size'))
+    entry_size.put(keys[0], data[0])
+
+    # Room for two entries of the biggest file
+    cache = GpxCache(str(tmp_path / 'cache'),
+                     max_size=2 * max(entry_size.nbytes, 1) + 1000)
+    cache.put(keys[0], data[0])
+    cache.put(keys[1], data[1])
+    os.utime(os.path.join(cache.path, keys[1]), (0, 0))
+    cache.get(keys[0])  # first entry is now the most recent one
+
+    cache.put(keys[2], data[2])
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is not None
+    assert cache.nbytes <= cache.max_size
+
+
+def test_track_skips_parsing(tmp_path, monkeypatch):
+    obj_track_ref = track.Track()
+    obj_track_ref.gpx_cache = GpxCache(str(tmp_path))
+    obj_track_ref.add_gpx_files(FILES)
+
+    # Known files are not parsed again
+    def not_parsed(*args, **kwargs):
+        raise AssertionError('parsed')
+    monkeypatch.setattr(gpx, 'parse', not_parsed)
+
+    obj_track = track.Track()
+    obj_track.gpx_cache = GpxCache(str(tmp_path))
+    obj_track.add_gpx_files(FILES)
+
+    assert obj_track.gpx_cache.hits == 3
+    assert obj_track.segment_index == obj_track_ref.segment_index
+    assert np.allclose(obj_track.df_track.distance,
+                       obj_track_ref.df_track.distance)
@@ -0,0 +1,28 @@
+import pytest
+import numpy as np
+
+from image_cache import ImageCache
+
+
+def test_lru():
+    image = np.zeros((4, 4, 4), dtype='float32')
+    cache = ImageCache(max_size=2 * image.nbytes)
+
+    cache.put('a', image.copy())
+    cache.put('b', image.copy())
+    assert cache.get('a') is not None  # b is the least recently used now
+    cache.put('c', image.copy())
+
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache
+    assert cache.nbytes == 2 * image.nbytes
+    assert cache.get('b') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Cached images are shared, they cannot be modified
+    with pytest.raises(ValueError):
+        cache.get('a')[0] = 1
+
+    cache.remove('a')
+    assert 'a' not in cache
+    assert cache.nbytes == image.nbytes
@@ -1,8 +1,10 @@
 import pytest
 import os
+import time
 
 import constants as c
 import iosm
+from db_handler import DbHandler
 
 
 def area_coor():
@@ -85,3 +87,120 @@ def test_download_tiles_by_num():
     assert iosm.download_tiles_by_num(x_min, y_min, x_max, y_max,
                                       max_zoom=my_zoom) == \
            (x_max - x_min + 1) * (y_max - y_min + 1)
+
+
+def local_downloader(tile_server, tmp_path, **kwargs) -> iosm.TileDownloader:
+    dbh = DbHandler(str(tmp_path / 'tiles.sqlite'))
+    dbh.open_db()
+    host, port = tile_server.server_address
+    return iosm.TileDownloader(
+        dbh, url=f'http://{host}:{port}/{{zoom}}/{{x}}/{{y}}.png',
+        tiles_path=str(tmp_path / 'tiles'), **kwargs)
+
+
+def corridor_tiles(max_zoom: int) -> list:
+    tiles = []
+    for zoom in range(max_zoom + 1):
+        xtiles, ytiles = area_tiles(zoom)
+        tiles += [(zoom, x, y) for x in xtiles for y in ytiles]
+    return tiles
+
+
+def test_concurrent_download(tile_server, tmp_path):
+    tiles = corridor_tiles(16)
+    downloader = local_downloader(tile_server, tmp_path, workers=4,
+                                  rate=400, burst=20)
+
+    report = downloader.download(tiles)
+    assert report.downloaded == report.valid == len(tiles)
+    assert report.failed == 0
+    assert tile_server.requests == len(tiles)
+    assert 1 < tile_server.max_active <= 4
+    assert report.tiles_per_second > 0
+
+    zoom, x, y = tiles[-1]
+    with open(downloader.tile_path(zoom, x, y), 'rb') as f:
+        assert f.read() == f'/{zoom}/{x}/{y}.png'.encode() * 100
+    assert downloader.db.get_tile_size(zoom, x, y) == \
+        len(f'/{zoom}/{x}/{y}.png') * 100
+
+    # Available tiles are not requested again
+    report = downloader.download(tiles)
+    assert report.available == len(tiles)
+    assert tile_server.requests == len(tiles)
+    assert downloader.hit_rate == 0.5
+
+
+def test_rate_limit(tile_server, tmp_path):
+    tiles = corridor_tiles(16)
+    rate, burst = 200, 10
+    downloader = local_downloader(tile_server, tmp_path, workers=8,
+                                  rate=rate, burst=burst)
+
+    # Time is bounded by the rate, not by the round trip
+    report = downloader.download(tiles)
+    assert report.downloaded == len(tiles)
+    assert report.seconds >= (len(tiles) - burst) / rate
+
+
+def test_download_missing_tile(tile_server, tmp_path):
+    downloader = local_downloader(tile_server, tmp_path)
+
+    report = downloader.download([(1, 0, 0), (1, 5, 5)])
+    assert (report.downloaded, report.failed) == (1, 1)
+    assert not downloader.db.get_tile_status(1, 5, 5)
+    assert not os.path.exists(downloader.tile_path(1, 5, 5))
+
+
+def test_download_without_content_length(tile_server, tmp_path):
+    tile_server.content_length = False
+    downloader = local_downloader(tile_server, tmp_path)
+
+    report = downloader.download([(2, 1, 1)])
+    assert report.downloaded == 1
+    assert downloader.db.get_tile_size(2, 1, 1) == len('/2/1/1.png') * 100
+
+
+def test_refresh_expired_tiles(tile_server, tmp_path):
+    tiles = corridor_tiles(8)
+    downloader = local_downloader(tile_server, tmp_path, rate=1000)
+    updated = []
+    downloader.on_update = updated.append
+    downloader.download(tiles)
+    etag, _, expires = downloader.db.get_tile_validators(8, 0, 0, 255,
+                                                         255)[tiles[-1]]
+    assert etag == '"0"' and expires > time.time() + 3000
+
+    # Expired tiles are available at once and revalidated in background,
+    # unchanged tiles are not transferred again
+    downloader.db.update_tile_validators(
+        [(*tile, None, None, 0) for tile in tiles])
+    report = downloader.download(tiles)
+    assert report.available == len(tiles)
+    downloader.wait_refresh(timeout=10)
+    assert tile_server.not_modified == len(tiles)
+    assert updated == []
+    assert all(expires > time.time() for _, _, expires in
+               iosm.tile_validators(downloader.db, tiles).values())
+
+    # Changed tiles are replaced
+    tile_server.version = 1
+    downloader.db.update_tile_validators([(*tiles[-1], None, None, 0)])
+    downloader.download(tiles)
+    downloader.wait_refresh(timeout=10)
+    assert updated == [tiles[-1]]
+    with open(downloader.tile_path(*tiles[-1]), 'rb') as f:
+        assert f.read().endswith(b'v')
+    assert iosm.tile_validators(downloader.db, tiles)[tiles[-1]][0] == '"1"'
+
+
+def test_expiry_time():
+    now = time.time()
+    assert iosm.expiry_time({'Cache-Control': 'public, max-age=600'}) == \
+        pytest.approx(now + 600, abs=5)
+    assert iosm.expiry_time({'Cache-Control': 'no-cache'}) <= time.time()
+    assert iosm.expiry_time(
+        {'Expires': 'Thu, 01 Jan 2037 00:00:00 GMT'}) == 2114380800
+    assert iosm.expiry_time({'Expires': '0'}) <= time.time()
+    assert iosm.expiry_time({}) == pytest.approx(now + c.tiles_max_age,
+                                                 abs=5)
@@ -0,0 +1,121 @@
+import pytest
+import numpy as np
+import datetime as dt
+
+import journal
+import track
+from column_store import ColumnStore
+from constants import prj_path
+
+
+def snapshot(obj_track: track.Track) -> dict:
+    return {'df_track': obj_track.df_track.copy(),
+            'segment_index': dict(obj_track.segment_index),
+            'totals': (obj_track.total_distance, obj_track.total_uphill,
+                       obj_track.total_downhill),
+            'extremes': obj_track.extremes,
+            'size': obj_track.size}
+
+
+def check_snapshot(obj_track: track.Track, expected: dict):
+    df_track = obj_track.df_track
+    assert obj_track.segment_index == expected['segment_index']
+    assert obj_track.size == expected['size']
+    assert (df_track.segment == expected['df_track'].segment).all()
+    assert (df_track.time.isnull() ==
+            expected['df_track'].time.isnull()).all()
+    for column in ['lat', 'lon', 'ele', 'distance', 'ele_pos_cum',
+                   'ele_neg_cum']:
+        assert np.allclose(df_track[column], expected['df_track'][column],
+                           atol=1e-4, equal_nan=True)
+    assert obj_track.extremes == pytest.approx(expected['extremes'])
+    assert [float(x) for x in (obj_track.total_distance,
+                               obj_track.total_uphill,
+                               obj_track.total_downhill)] == \
+        pytest.approx(expected['totals'], rel=1e-6)
+
+
+def test_undo_redo():
+    obj_track = track.Track()
+    edits = [
+        lambda: obj_track.add_gpx(
+            f'{prj_path}/test/test_cases/Innacessible_Island_part1.gpx'),
+        lambda: obj_track.add_gpx(
+            f'{prj_path}/test/test_cases/Innacessible_Island_part2.gpx'),
+        lambda: obj_track.add_gpx(
+            f'{prj_path}/test/test_cases/Innacessible_Island_part3.gpx'),
+        lambda: obj_track.reverse_segment(2),
+        lambda: obj_track.insert_timestamp(dt.datetime(2010, 1, 1), 4),
+        lambda: obj_track.divide_segment(30),
+        lambda: obj_track.change_order({1: 3, 2: 1, 3: 4, 4: 2}),
+        lambda: obj_track.smooth_elevation(4),
+        lambda: obj_track.remove_segment(2),
+    ]
+
+    snapshots = [snapshot(obj_track)]
+    for edit in edits:
+        edit()
+        snapshots.append(snapshot(obj_track))
+
+    # Go back to the empty track and forward again
+    for expected in snapshots[-2::-1]:
+        assert obj_track.undo()
+        check_snapshot(obj_track, expected)
+    assert not obj_track.undo()
+
+    for expected in snapshots[1:]:
+        assert obj_track.redo()
+        check_snapshot(obj_track, expected)
+    assert not obj_track.redo()
+
+
+def test_new_edit_clears_redo():
+    obj_track = track.Track()
+    obj_track.add_gpx(
+        f'{prj_path}/test/test_cases/Innacessible_Island_Full.gpx')
+    obj_track.reverse_segment(1)
+    obj_track.undo()
+
+    obj_track.smooth_elevation(1)
+
+    assert not obj_track.journal.can_redo()
+    assert obj_track.undo()
+    assert obj_track.undo()
+    assert obj_track.size == 0
+
+
+def test_memory_budget():
+    store = ColumnStore({'x': 'float64'})
+    store.append({'x': np.arange(1000)})
+    edit_journal = journal.EditJournal(budget=20000)
+
+    # Each edit keeps 8000 bytes, only two of them fit in the budget
+    for i in range(5):
+        inverse = journal.apply(store, ('write', 'x', 0, np.full(1000, i)))
+        edit_journal.record(journal.Edit([inverse], {}))
+
+    assert len(edit_journal.undo_stack) == 2
+    assert edit_journal.nbytes <= 20000
+
+    # Last edits are kept
+    journal.apply(store, edit_journal.pop_undo().operations[0])
+    assert store['x'][0] == 3
+
+
+def test_operations_inverse():
+    store = ColumnStore({'x': 'float64', 'n': 'int32'})
+    store.append({'x': np.arange(10), 'n': np.arange(10)})
+    initial = store['x'].copy(), store['n'].copy()
+
+    operations = [('write', 'x', 2, np.zeros(3)),
+                  ('delete', 5, 8),
+                  ('shift', 'n', 3, 10),
+                  ('blocks', [(4, 7), (0, 4)])]
+    inverse = [journal.apply(store, operation) for operation in operations]
+    assert len(store) == 7
+
+    for operation in inverse[::-1]:
+        journal.apply(store, operation)
+
+    assert (store['x'] == initial[0]).all()
+    assert (store['n'] == initial[1]).all()
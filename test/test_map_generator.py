@@ -0,0 +1,53 @@
+import numpy as np
+import matplotlib.image as mpimg
+
+import constants as c
+import map_generator as mg
+from image_cache import ImageCache
+
+
+def test_map_from_memory(monkeypatch, tmp_path):
+    for x in range(2):
+        for y in range(3):
+            (tmp_path / f'5/{x}').mkdir(parents=True, exist_ok=True)
+            mpimg.imsave(tmp_path / f'5/{x}/{y}.png',
+                         np.full((8, 8, 3), x * 0.5 + y * 0.1))
+    monkeypatch.setattr(c, 'tiles_path', str(tmp_path))
+    monkeypatch.setattr(mg, 'TILE_IMAGES', ImageCache(c.tile_images_size))
+
+    reads = []
+    imread = mpimg.imread
+    monkeypatch.setattr(mpimg, 'imread',
+                        lambda file: reads.append(file) or imread(file))
+
+    map_img = mg.create_map_img((0, 0, 1, 2), 5)
+    assert map_img.shape[:2] == (24, 16)
+    assert len(reads) == 6
+
+    # Drawing again does not read the tiles
+    mg.download_tiles((0, 0, 1, 2), 5)
+    assert np.array_equal(mg.create_map_img((0, 0, 1, 2), 5), map_img)
+    assert len(reads) == 6
+    assert mg.TILE_IMAGES.hits == 6
+
+
+def test_mosaic(monkeypatch, tmp_path):
+    monkeypatch.setattr(c, 'tiles_path', str(tmp_path))
+    monkeypatch.setattr(mg, 'TILE_IMAGES', ImageCache(c.tile_images_size))
+    for x in range(3):
+        (tmp_path / f'7/{x}').mkdir(parents=True, exist_ok=True)
+        for y in range(2):
+            mpimg.imsave(tmp_path / f'7/{x}/{y}.png',
+                         np.full((8, 8, 3), 0.2 * x + 0.4 * y))
+
+    # PNG files are RGBA, tiles may also be RGB or grayscale
+    mg.TILE_IMAGES.put((7, 1, 0), np.full((8, 8, 3), 0.2, dtype='float32'))
+    mg.TILE_IMAGES.put((7, 2, 1), np.full((8, 8), 0.8, dtype='float32'))
+
+    map_img = mg.create_map_img((0, 0, 2, 1), 7)
+    assert map_img.shape == (16, 24, 4)
+    assert (map_img[..., 3] == 1).all()
+    for x in range(3):
+        for y in range(2):
+            block = map_img[8 * y:8 * (y + 1), 8 * x:8 * (x + 1), :3]
+            assert np.allclose(block, 0.2 * x + 0.4 * y, atol=1 / 255)
@@ -0,0 +1,110 @@
+import os
+import subprocess
+import sys
+
+import iosm
+import mbtiles
+import prefetch
+from db_handler import DbHandler
+from tile_cache import TileCache
+
+
+def open_mbtiles(tmp_path) -> mbtiles.MBTiles:
+    store = mbtiles.MBTiles(str(tmp_path / 'tiles.mbtiles'))
+    assert store.open()
+    return store
+
+
+def test_tiles(tmp_path):
+    store = open_mbtiles(tmp_path)
+    store.put_tiles([(2, 1, 0, b'a'), (2, 1, 3, b'b'), (0, 0, 0, b'c')])
+
+    assert store.get_tile(2, 1, 0) == b'a'
+    assert store.get_tile(2, 0, 0) is None
+    assert (2, 1, 3) in store and (2, 0, 3) not in store
+    assert len(store) == 3
+
+    # Rows are stored from the south
+    assert store.conn.execute(
+        """SELECT tile_row FROM tiles
+           WHERE zoom_level=2 AND tile_data=?""", (b'a',)).fetchone() == (3,)
+
+    assert sorted(store.tiles(min_zoom=1)) == [(2, 1, 0, b'a'),
+                                               (2, 1, 3, b'b')]
+    store.remove_tiles([(2, 1, 0)])
+    assert len(store) == 2
+    store.close()
+
+
+def test_import_export(tmp_path):
+    for zoom, x, y in [(1, 0, 1), (3, 5, 2), (3, 5, 7)]:
+        os.makedirs(tmp_path / 'tiles' / str(zoom) / str(x), exist_ok=True)
+        (tmp_path / 'tiles' / str(zoom) / str(x) / f'{y}.png').write_bytes(
+            f'{zoom}/{x}/{y}'.encode())
+    (tmp_path / 'tiles' / '3' / '5' / '7.png.tmp').write_bytes(b'partial')
+
+    store = open_mbtiles(tmp_path)
+    assert mbtiles.import_directory(str(tmp_path / 'tiles'), store) == 3
+    assert store.get_tile(3, 5, 7) == b'3/5/7'
+    assert store.get_metadata()['minzoom'] == '1'
+    assert store.get_metadata()['maxzoom'] == '3'
+
+    assert mbtiles.export_directory(store, str(tmp_path / 'copy'),
+                                    min_zoom=3) == 2
+    assert (tmp_path / 'copy' / '3' / '5' / '2.png').read_bytes() == b'3/5/2'
+    assert not (tmp_path / 'copy' / '1').exists()
+
+
+def test_download_to_mbtiles(tile_server, tmp_path):
+    store = open_mbtiles(tmp_path)
+    dbh = DbHandler(str(tmp_path / 'tiles.sqlite'))
+    dbh.open_db()
+    host, port = tile_server.server_address
+    downloader = iosm.TileDownloader(
+        dbh, url=f'http://{host}:{port}/{{zoom}}/{{x}}/{{y}}.png',
+        tiles_path=str(tmp_path / 'tiles'), rate=1000, store=store)
+    tiles = [(3, x, y) for x in range(3) for y in range(3)]
+
+    assert downloader.download(tiles).downloaded == len(tiles)
+    assert downloader.download(tiles).available == len(tiles)
+    assert store.get_tile(3, 2, 1) == b'/3/2/1.png' * 100
+    assert not os.path.exists(tmp_path / 'tiles')
+
+    # Evicted tiles are removed from the file
+    cache = TileCache(dbh.db_path, quota=5000, protected_zoom=0, store=store)
+    removed, _ = cache.evict()
+    assert len(store) == len(tiles) - removed > 0
+
+
+def test_command_line(tmp_path):
+    tiles_path = tmp_path / 'tiles' / '4' / '3'
+    os.makedirs(tiles_path)
+    (tiles_path / '9.png').write_bytes(b'tile')
+    mbtiles_file = str(tmp_path / 'region.mbtiles')
+    script = mbtiles.__file__
+
+    subprocess.run([sys.executable, script, 'import',
+                    str(tmp_path / 'tiles'), mbtiles_file], check=True)
+    subprocess.run([sys.executable, script, 'export', mbtiles_file,
+                    str(tmp_path / 'copy')], check=True)
+    assert (tmp_path / 'copy' / '4' / '3' / '9.png').read_bytes() == b'tile'
+
+    assert subprocess.run([sys.executable, script, 'export',
+                           str(tmp_path / 'missing.mbtiles'),
+                           str(tmp_path / 'copy')]).returncode != 0
+
+
+def test_prefetch_to_mbtiles(tile_server, tmp_path):
+    store = open_mbtiles(tmp_path)
+    host, port = tile_server.server_address
+    tiles = [(3, x, 2) for x in range(4)]
+    job = prefetch.PrefetchJob(
+        tiles, str(tmp_path / 'prefetch.json'),
+        db_path=str(tmp_path / 'tiles.sqlite'), tile_cache=None,
+        url=f'http://{host}:{port}/{{zoom}}/{{x}}/{{y}}.png',
+        tiles_path=str(tmp_path / 'tiles'), rate=1000, store=store)
+    job.start()
+    assert job.wait(timeout=10)
+
+    assert len(store) == len(tiles)
+    assert not os.path.exists(tmp_path / 'tiles')
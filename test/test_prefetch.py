@@ -0,0 +1,118 @@
+import os
+import numpy as np
+
+import iosm
+import prefetch
+from db_handler import DbHandler
+from tile_cache import TileCache
+
+
+def diagonal_route(n: int = 500) -> (np.array, np.array):
+    # About 90 km from south-west to north-east
+    return np.linspace(42.0, 42.6, n), np.linspace(-1.0, -0.2, n)
+
+
+def test_track_tiles():
+    lat, lon = diagonal_route()
+    zoom = 14
+    tiles = prefetch.track_tiles(lat, lon, zoom, buffer=0)
+
+    # All the points are in the corridor, with no gaps between tiles
+    points = {iosm.deg2num(lat_deg, lon_deg, zoom)
+              for lat_deg, lon_deg in zip(lat, lon)}
+    corridor = set(map(tuple, tiles.tolist()))
+    assert points <= corridor
+    assert all(any((x + dx, y + dy) in corridor
+                   for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy)
+               for x, y in corridor)
+
+    # Much smaller than the bounding box
+    x_min, y_min = tiles.min(axis=0)
+    x_max, y_max = tiles.max(axis=0)
+    assert len(tiles) < 0.1 * (x_max - x_min + 1) * (y_max - y_min + 1)
+
+    # The buffer adds the surrounding tiles
+    buffered = prefetch.track_tiles(lat, lon, zoom, buffer=2)
+    assert corridor < set(map(tuple, buffered.tolist()))
+    assert len(prefetch.track_tiles(lat, lon, 0, buffer=2)) == 1
+
+
+def test_plan(tmp_path):
+    lat, lon = diagonal_route()
+    dbh = DbHandler(str(tmp_path / 'tiles.sqlite'))
+    dbh.open_db()
+
+    full_plan = prefetch.plan(lat, lon, max_zoom=12, buffer=1)
+    assert full_plan.tiles[0] == (0, 0, 0)
+    assert full_plan.estimated_bytes > 0
+
+    # Registered tiles are not planned again
+    dbh.insert_tiles([(*tile, True, '', 100) for tile in full_plan.tiles[:10]])
+    assert prefetch.plan(lat, lon, max_zoom=12, buffer=1, db=dbh).tiles == \
+        full_plan.tiles[10:]
+
+
+def test_resume_job(tile_server, tmp_path):
+    lat, lon = diagonal_route(50)
+    tiles = prefetch.plan(lat, lon, max_zoom=13, buffer=0.5).tiles
+    host, port = tile_server.server_address
+    options = {'db_path': str(tmp_path / 'tiles.sqlite'),
+               'batch_size': 5,
+               'url': f'http://{host}:{port}/{{zoom}}/{{x}}/{{y}}.png',
+               'tiles_path': str(tmp_path / 'tiles'),
+               'rate': 1000,
+               'tile_cache': None}
+    state_file = str(tmp_path / 'prefetch.json')
+
+    # Interrupted job
+    job = prefetch.PrefetchJob(tiles, state_file, **options)
+    job.start()
+    job.stop()
+    assert job.wait(timeout=10)
+    assert job.done < job.total
+    assert os.path.exists(state_file)
+
+    # Resumed job only downloads the remaining tiles
+    resumed_job = prefetch.PrefetchJob.resume(state_file, **options)
+    assert resumed_job.done == job.done
+    resumed_job.start()
+    assert resumed_job.wait(timeout=30)
+
+    assert resumed_job.error is None
+    assert resumed_job.done == resumed_job.total == len(tiles)
+    assert tile_server.requests == len(tiles)
+    assert not os.path.exists(state_file)
+
+    dbh = DbHandler(options['db_path'])
+    dbh.open_db()
+    assert all(iosm.tile_statuses(dbh, tiles).values())
+    assert len(iosm.tile_statuses(dbh, tiles)) == len(tiles)
+
+
+def test_job_shares_host_limits(tile_server, tmp_path):
+    lat, lon = diagonal_route(50)
+    tiles = prefetch.plan(lat, lon, max_zoom=12, buffer=0.5).tiles
+    host, port = tile_server.server_address
+    url = f'http://{host}:{port}/{{zoom}}/{{x}}/{{y}}.png'
+    db_path = str(tmp_path / 'tiles.sqlite')
+    tile_cache = TileCache(db_path, quota=1000, protected_zoom=0)
+
+    # Map download and prefetch job at once, each one with 2 workers
+    map_db = DbHandler(str(tmp_path / 'map.sqlite'))
+    map_db.open_db()
+    map_downloader = iosm.TileDownloader(
+        map_db, url=url, tiles_path=str(tmp_path / 'map'), workers=2,
+        rate=1000)
+    job = prefetch.PrefetchJob(tiles, str(tmp_path / 'prefetch.json'),
+                               db_path=db_path, batch_size=10,
+                               tile_cache=tile_cache, url=url,
+                               tiles_path=str(tmp_path / 'tiles'),
+                               workers=2, rate=1000)
+    job.start()
+    map_downloader.download([(13, x, 3000) for x in range(4000, 4040)])
+    assert job.wait(timeout=30)
+    tile_cache.wait(timeout=10)
+
+    assert job.error is None
+    assert tile_server.max_active <= 2
+    assert tile_cache.evicted_tiles > 0
@@ -0,0 +1,109 @@
+import gc
+import weakref
+
+import pytest
+import numpy as np
+import datetime as dt
+
+import session
+import track
+from constants import prj_path
+
+
+def build_track() -> track.Track:
+    obj_track = track.Track()
+    obj_track.add_gpx_files(
+        [f'{prj_path}/test/test_cases/Innacessible_Island_part{n}.gpx'
+         for n in range(1, 4)])
+    obj_track.insert_timestamp(dt.datetime(2010, 1, 1), 4)
+    obj_track.remove_segment(2)
+    return obj_track
+
+
+def check_same_track(obj_track: track.Track, expected: track.Track):
+    assert obj_track.segment_index == expected.segment_index
+    assert obj_track.size == expected.size
+    assert obj_track.last_segment_idx == expected.last_segment_idx
+    assert obj_track.extremes == pytest.approx(expected.extremes)
+    assert obj_track.total_distance == pytest.approx(expected.total_distance)
+    assert obj_track.total_uphill == pytest.approx(expected.total_uphill)
+    assert obj_track.df_track.equals(expected.df_track)
+
+
+def test_save_load(tmp_path):
+    obj_track = build_track()
+    obj_track.save_session(str(tmp_path / 'test.session'))
+
+    loaded_track = track.Track()
+    loaded_track.load_session(str(tmp_path / 'test.session'))
+
+    check_same_track(loaded_track, obj_track)
+    assert isinstance(loaded_track._store['lat'], np.memmap)
+    for seg, summary in obj_track.segment_summary.items():
+        assert loaded_track.segment_summary[seg]['distance'] == \
+            pytest.approx(summary['distance'])
+
+
+def test_edit_loaded_session(tmp_path):
+    file = str(tmp_path / 'test.session')
+    build_track().save_session(file)
+
+    loaded_track = track.Track()
+    loaded_track.load_session(file)
+    loaded_track.reverse_segment(1)
+    loaded_track.add_gpx(
+        f'{prj_path}/test/test_cases/Innacessible_Island_part4.gpx')
+
+    # Edits are not written back to the file, which can be overwritten
+    # while it is mapped
+    reloaded_track = track.Track()
+    reloaded_track.load_session(file)
+    check_same_track(reloaded_track, build_track())
+
+    loaded_track.save_session(file)
+    reloaded_track.load_session(file)
+    check_same_track(reloaded_track, loaded_track)
+
+
+def test_convert_h5(tmp_path):
+    h5_file = f'{prj_path}/test/test_cases/kungsleden.h5'
+    h5_track = track.Track()
+    h5_track.load_session(h5_file)
+
+    session_file = session.convert_h5(h5_file,
+                                      str(tmp_path / 'kungsleden.session'))
+    loaded_track = track.Track()
+    loaded_track.load_session(session_file)
+
+    check_same_track(loaded_track, h5_track)
+    assert loaded_track.total_distance == pytest.approx(32.968346)
+
+
+def test_not_a_session(tmp_path):
+    file = tmp_path / 'wrong.session'
+    file.write_bytes(b'not a session')
+
+    with pytest.raises(session.SessionError):
+        session.read(str(file))
+
+
+def test_save_over_loaded_session(tmp_path):
+    file = str(tmp_path / 'test.session')
+    build_track().save_session(file)
+
+    loaded_track = track.Track()
+    loaded_track.load_session(file)
+    loaded_track.df_track  # the pandas view also uses the maps
+    mapping = weakref.ref(loaded_track._store['lat']._mmap)
+    loaded_track.reverse_segment(1)
+
+    # The file cannot be replaced while it is mapped on some systems
+    loaded_track.save_session(file)
+    gc.collect()
+    assert mapping() is None
+    assert not any(isinstance(loaded_track._store[column], np.memmap)
+                   for column in loaded_track._store.columns)
+
+    reloaded_track = track.Track()
+    reloaded_track.load_session(file)
+    check_same_track(reloaded_track, loaded_track)
@@ -0,0 +1,88 @@
+import pytest
+import numpy as np
+
+import geodesy
+import spatial_index
+import track
+from constants import prj_path
+
+
+def load_track() -> track.Track:
+    obj_track = track.Track()
+    for n in range(1, 4):
+        obj_track.add_gpx(
+            f'{prj_path}/test/test_cases/Innacessible_Island_part{n}.gpx')
+    return obj_track
+
+
+def brute_force(obj_track: track.Track, lat: float, lon: float) -> tuple:
+    df_track = obj_track.df_track
+    distance = geodesy.distance(lat, lon, df_track.lat.to_numpy('float64'),
+                                df_track.lon.to_numpy('float64'))
+    closest = np.argmin(distance)
+    return distance[closest], df_track.segment.iloc[closest]
+
+
+def test_nearest():
+    obj_track = load_track()
+    df_track = obj_track.df_track
+    rng = np.random.default_rng(0)
+    lat = rng.uniform(df_track.lat.min(), df_track.lat.max(), 50)
+    lon = rng.uniform(df_track.lon.min(), df_track.lon.max(), 50)
+
+    for point in zip(lat, lon):
+        distance, segment = obj_track.closest_segment(point, 5)
+        expected_distance, expected_segment = brute_force(obj_track, *point)
+        assert distance == pytest.approx(expected_distance)
+        assert segment == expected_segment
+
+
+def test_out_of_range():
+    obj_track = load_track()
+    lat, lon = obj_track.df_track.lat.max() + 0.1, obj_track.df_track.lon[0]
+
+    assert obj_track.closest_segment((lat, lon), 1) == (np.inf, 0)
+    assert track.Track().closest_segment((lat, lon), 1) == (np.inf, 0)
+
+
+def test_sync_reuses_grids():
+    obj_track = load_track()
+    obj_track.closest_segment((0, 0), 1)
+    grids = dict(obj_track.spatial_index.grids)
+
+    # Moved and renamed segments keep their grid
+    obj_track.change_order({1: 3, 2: 1, 3: 2})
+    obj_track.remove_segment(3)
+    obj_track.closest_segment((0, 0), 1)
+    assert obj_track.spatial_index.grids[1] is grids[2]
+    assert obj_track.spatial_index.grids[2] is grids[3]
+
+    # Modified points need a new grid
+    obj_track.reverse_segment(1)
+    obj_track.closest_segment((0, 0), 1)
+    assert obj_track.spatial_index.grids[1] is not grids[2]
+    assert obj_track.spatial_index.grids[2] is grids[3]
+
+
+def test_segment_grid_cells():
+    # Points in many cells, query radius of several cells
+    lat = np.linspace(-37.3, -37.2, 1000)
+    lon = np.linspace(-12.7, -12.6, 1000)
+    grid = spatial_index.SegmentGrid(lat, lon, cell_size=0.1)
+
+    distance, position = grid.nearest(-37.25, -12.65 + 0.01, 2)
+    expected = geodesy.distance(-37.25, -12.64, lat, lon)
+    assert position == np.argmin(expected)
+    assert distance == expected.min()
+
+
+def test_large_radius():
+    # A route of hundreds of km queried with a radius of a whole map
+    lat = np.linspace(30, 50, 20000)
+    lon = np.linspace(-10, 10, 20000)
+    grid = spatial_index.SegmentGrid(lat, lon, cell_size=0.25)
+
+    distance, position = grid.nearest(40.01, 0.02, max_distance=150)
+    expected = geodesy.distance(40.01, 0.02, lat, lon)
+    assert distance == pytest.approx(expected.min())
+    assert position == np.argmin(expected)
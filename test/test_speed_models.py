@@ -0,0 +1,83 @@
+import pytest
+import numpy as np
+import datetime as dt
+
+import speed_models
+import track
+from constants import prj_path
+
+INITIAL_TIME = dt.datetime(2010, 1, 1)
+
+
+def get_track():
+    obj_track = track.Track()
+    for part in range(1, 4):
+        obj_track.add_gpx(
+            f'{prj_path}/test/test_cases/Innacessible_Island_part{part}.gpx')
+    return obj_track
+
+
+def get_timestamps(obj_track: track.Track, speed: float, **kwargs):
+    return speed_models.timestamps(INITIAL_TIME, speed,
+                                   obj_track.df_track.distance,
+                                   obj_track.df_track.ele,
+                                   obj_track.df_track.segment,
+                                   **kwargs)
+
+
+def test_constant():
+    obj_track = get_track()
+    time = get_timestamps(obj_track, 4.0)
+
+    # Same result as a point by point computation
+    expected = [np.datetime64(INITIAL_TIME + dt.timedelta(hours=d / 4.0))
+                for d in obj_track.df_track.distance.astype('float64')]
+    error = np.abs(time - np.array(expected, dtype='datetime64[ns]'))
+    assert error.max() <= np.timedelta64(1, 'ms')
+    assert time[0] == np.datetime64(INITIAL_TIME)
+    assert time.dtype == np.dtype('datetime64[ns]')
+
+
+def test_grade():
+    obj_track = get_track()
+    time = get_timestamps(obj_track, 4.0, model='grade')
+    elapsed = np.diff(time).astype('float64')
+    elapsed_constant = np.diff(get_timestamps(obj_track, 4.0)).astype(
+        'float64')
+
+    # Uphill is slower and a gentle downhill faster than flat terrain
+    ele_diff = np.diff(obj_track.df_track.ele.to_numpy())
+    uphill = ele_diff > 1
+    assert (elapsed[uphill] > elapsed_constant[uphill]).all()
+    assert np.all(np.diff(time) >= np.timedelta64(0))
+
+
+def test_segment():
+    obj_track = get_track()
+    time = get_timestamps(obj_track, 4.0, model='segment',
+                          segment_speed={1: 2.0, 3: 8.0})
+    elapsed = np.diff(time).astype('float64')
+    elapsed_constant = np.diff(get_timestamps(obj_track, 4.0)).astype(
+        'float64')
+
+    # Elapsed time scales with the speed of each segment
+    segment = obj_track.df_track.segment.to_numpy()[1:]
+    ratio = {1: 2.0, 2: 1.0, 3: 0.5}
+    for seg, value in ratio.items():
+        mask = segment == seg
+        assert elapsed[mask] == pytest.approx(
+            elapsed_constant[mask] * value, rel=1e-3, abs=2e3)
+
+
+def test_wrong_input():
+    obj_track = get_track()
+
+    with pytest.raises(ValueError):
+        get_timestamps(obj_track, 4.0, model='unknown')
+
+    with pytest.raises(ValueError):
+        get_timestamps(obj_track, 0)
+
+    with pytest.raises(ValueError):
+        get_timestamps(obj_track, 4.0, model='segment',
+                       segment_speed={1: -1})
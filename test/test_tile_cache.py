@@ -0,0 +1,52 @@
+import os
+
+from db_handler import DbHandler
+from tile_cache import TileCache
+
+
+def build_tiles(tmp_path) -> DbHandler:
+    # 1 kB tiles at zooms 4 and 12, accessed in order
+    dbh = DbHandler(str(tmp_path / 'tiles.sqlite'))
+    dbh.open_db()
+    tiles = [(zoom, x, 0) for zoom in (4, 12) for x in range(10)]
+    for zoom, x, y in tiles:
+        path = tmp_path / f'{zoom}/{x}/{y}.png'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'0' * 1000)
+        dbh.insert_tiles([(zoom, x, y, True, str(path), 1000)])
+    for access_time, tile in enumerate(tiles):
+        dbh.touch_tiles([tile], access_time=access_time)
+    return dbh
+
+
+def test_evict(tmp_path):
+    dbh = build_tiles(tmp_path)
+    cache = TileCache(dbh.db_path, quota=15000, protected_zoom=8,
+                      target=0.9, batch_size=3)
+    assert cache.usage() == (20, 20000)
+
+    # Down to 90% of the quota, least recently used first
+    assert cache.evict() == (7, 7000)
+    assert cache.usage() == (13, 13000)
+    assert not os.path.exists(tmp_path / '12/6/0.png')
+    assert os.path.exists(tmp_path / '12/7/0.png')
+    assert dbh.get_tile_statuses(12, 0, 0, 9, 0).keys() == \
+        {(12, x, 0) for x in range(7, 10)}
+
+    # Protected zooms are kept even over the quota
+    cache.quota = 5000
+    cache.evict_in_background()
+    cache.wait()
+    assert cache.usage() == (10, 10000)
+    assert (cache.evicted_tiles, cache.evicted_bytes) == (10, 10000)
+    assert len(dbh.get_tile_statuses(4, 0, 0, 9, 0)) == 10
+
+
+def test_recently_used(tmp_path):
+    dbh = build_tiles(tmp_path)
+    dbh.touch_tiles([(12, 0, 0)])
+    cache = TileCache(dbh.db_path, quota=19000, protected_zoom=8, target=1)
+
+    assert cache.evict() == (1, 1000)
+    assert dbh.get_tile_status(12, 0, 0)
+    assert not dbh.get_tile_status(12, 1, 0)
@@ -4,6 +4,7 @@ import numpy as np
 import datetime as dt
 
 import track
+from gpx_cache import GpxCache
 from constants import prj_path
 
 pd.set_option('display.max_rows', 500)
@@ -28,6 +29,52 @@ def test_add_gpx():
     assert obj_track.df_track.shape[0] == 141
 
 
+@pytest.mark.parametrize('parallel_bytes', [track.PARALLEL_LOAD_BYTES, 0])
+def test_add_gpx_files(monkeypatch, tmp_path, parallel_bytes):
+    files = [f'{prj_path}/test/test_cases/Innacessible_Island_part{n}.gpx'
+             for n in range(1, 6)]
+    obj_track_ref = track.Track()
+    obj_track_ref.add_gpx(files[0])
+    for file in files[1:]:
+        obj_track_ref.add_gpx(file)
+
+    # Process pool is used for any amount of data, nothing is cached
+    monkeypatch.setattr(track, 'PARALLEL_LOAD_BYTES', parallel_bytes)
+    obj_track = track.Track()
+    obj_track.gpx_cache = GpxCache(str(tmp_path))
+    obj_track.add_gpx(files[0])
+    obj_track.add_gpx_files(files[1:], processes=2)
+
+    assert obj_track.size == 5
+    assert obj_track.segment_index == obj_track_ref.segment_index
+    for column in ['lat', 'lon', 'ele', 'distance', 'ele_pos_cum',
+                   'ele_neg_cum']:
+        assert np.allclose(obj_track.df_track[column],
+                           obj_track_ref.df_track[column], equal_nan=True)
+    assert obj_track.total_distance == \
+        pytest.approx(obj_track_ref.total_distance)
+
+    # All the files are undone at once
+    assert obj_track.undo()
+    assert obj_track.size == 1
+    assert list(obj_track.segment_index) == [1]
+
+
+def test_add_gpx_files_error():
+    obj_track = track.Track()
+    obj_track.add_gpx(
+        f'{prj_path}/test/test_cases/Innacessible_Island_part1.gpx')
+
+    with pytest.raises(FileNotFoundError):
+        obj_track.add_gpx_files(
+            [f'{prj_path}/test/test_cases/Innacessible_Island_part2.gpx',
+             f'{prj_path}/test/test_cases/missing.gpx'])
+
+    # Track is not modified
+    assert obj_track.size == 1
+    assert obj_track.df_track.shape[0] == 24
+
+
 def test_update_summary():
     """
     Private method test: executed within add_gpx
@@ -52,6 +99,41 @@ def test_update_summary():
     assert total_downhill != obj_track.total_downhill
 
 
+def test_incremental_summary():
+    """
+    Private method test: after several edits the incrementally updated
+    columns and totals must match a full computation of the summary
+    """
+    # Load data
+    obj_track = track.Track()
+    for i in range(1, 6):
+        obj_track.add_gpx(
+            f'{prj_path}/test/test_cases/Innacessible_Island_part{i}.gpx')
+
+    # Apply edits
+    obj_track.reverse_segment(2)
+    obj_track.change_order({1: 3, 2: 1, 3: 2, 4: 5, 5: 4})
+    obj_track.remove_segment(1)
+
+    # Reference: full computation
+    ref_track = track.Track()
+    ref_track.df_track = obj_track.df_track.copy()
+    ref_track._update_summary()
+
+    for column in ['distance', 'ele_pos_cum', 'ele_neg_cum']:
+        assert np.allclose(obj_track.df_track[column],
+                           ref_track.df_track[column],
+                           atol=1e-3, equal_nan=True)  # float32 coordinates
+    assert obj_track.total_distance == \
+        pytest.approx(ref_track.total_distance, rel=1e-4)
+    assert obj_track.total_uphill == \
+        pytest.approx(ref_track.total_uphill, rel=1e-4)
+    assert obj_track.total_downhill == \
+        pytest.approx(ref_track.total_downhill, rel=1e-4)
+    assert obj_track.extremes == pytest.approx(ref_track.extremes)
+    assert sorted(obj_track.segment_summary) == [2, 3, 4, 5]
+
+
 def test_insert_positive_elevation():
     """
     Private method test: executed within add_gpx
@@ -300,6 +382,28 @@ def test_fix_elevation():
     assert initial_std > final_std
 
 
+def test_fix_elevation_all_segments():
+    """
+    Fixing all segments is one edit: a single undo restores them.
+    """
+    obj_track = track.Track()
+    for part in range(1, 4):
+        obj_track.add_gpx(
+            f'{prj_path}/test/test_cases/Innacessible_Island_part{part}.gpx')
+    initial_ele = obj_track.df_track.ele.to_numpy().copy()
+    initial_uphill = obj_track.total_uphill
+
+    obj_track.fix_elevation()
+    assert not np.array_equal(obj_track.df_track.ele.to_numpy(), initial_ele)
+    assert obj_track.total_uphill < initial_uphill
+
+    assert obj_track.undo()
+    np.testing.assert_array_equal(obj_track.df_track.ele.to_numpy(),
+                                  initial_ele)
+    assert obj_track.total_uphill == initial_uphill
+    assert len(obj_track.segment_index) == 3
+
+
 def test_smooth_elevation():
     """
     The established criteria is to check that the standard deviation and
@@ -345,6 +449,34 @@ def test_remove_segment():
     assert 2 not in obj_track.df_track.segment.unique()
 
 
+def test_undo_change_order_with_gap():
+    """
+    Renumber and reorder segments whose ids have a gap, then undo: segment
+    column and index must agree.
+    """
+    obj_track = track.Track()
+    for part in range(1, 5):
+        obj_track.add_gpx(
+            f'{prj_path}/test/test_cases/Innacessible_Island_part'
+            f'{min(part, 3)}.gpx')
+    obj_track.remove_segment(1)
+
+    obj_track.change_order({2: 1, 3: 3, 4: 2})
+    obj_track.undo()
+
+    segment = obj_track.df_track.segment.to_numpy()
+    for seg, (start, stop) in obj_track.segment_index.items():
+        assert (segment[start:stop] == seg).all()
+    assert sorted(obj_track.segment_index) == [2, 3, 4]
+
+    # Later edits keep the index consistent
+    obj_track.divide_segment(obj_track.segment_index[3][0] + 5)
+    assert sorted(obj_track.segment_index) == [2, 3, 4, 5]
+    segment = obj_track.df_track.segment.to_numpy()
+    for seg, (start, stop) in obj_track.segment_index.items():
+        assert (segment[start:stop] == seg).all()
+
+
 def test_get_segment():
     # Load data
     obj_track = track.Track()
@@ -367,6 +499,30 @@ def test_get_segment():
     assert (ref_df.fillna(0) == seg_df.fillna(0)).all().all()
 
 
+def test_segment_index():
+    """
+    The segment index maintained after edits must match the rows of each
+    segment in the dataframe
+    """
+    # Load data
+    obj_track = track.Track()
+    for i in range(1, 4):
+        obj_track.add_gpx(
+            f'{prj_path}/test/test_cases/Innacessible_Island_part{i}.gpx')
+
+    # Apply edits
+    obj_track.divide_segment(30)
+    obj_track.change_order({1: 2, 2: 4, 3: 1, 4: 3})
+    obj_track.remove_segment(3)
+
+    # Check
+    assert list(obj_track.segment_index) == [1, 2, 4]
+    for seg_id, (start, stop) in obj_track.segment_index.items():
+        rows = np.flatnonzero(obj_track.df_track.segment == seg_id)
+        assert (start, stop) == (rows[0], rows[-1] + 1)
+        assert obj_track.get_segment(seg_id).shape[0] == stop - start
+
+
 def datetime_to_integer(dt_time):
     return 3600*24*dt_time.days + dt_time.seconds
 
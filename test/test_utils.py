@@ -1,3 +1,6 @@
+import hashlib
+import pytest
+
 import utils
 
 
@@ -33,3 +36,28 @@ def test_print_progress_bar(capsys):
     utils.print_progress_bar(100, 100, length=20)
     captured = capsys.readouterr()
     assert captured.out == '\r |||||||||||||||||||||| 100.0% '
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_file_hash(tmp_path, use_mmap):
+    content = bytes(range(256)) * 1000
+    tmp_file = tmp_path / 'test_file_hash.bin'
+    tmp_file.write_bytes(content)
+
+    # Several chunks give the digest of the whole content
+    assert utils.file_hash(tmp_file, use_mmap=use_mmap, chunk_size=1000) == \
+        hashlib.md5(content).hexdigest()
+    assert utils.file_hash(tmp_file, 'blake2b', digest_size=16,
+                           use_mmap=use_mmap) == \
+        hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def test_hash_files(tmp_path):
+    files = []
+    for i in range(20):
+        files.append(tmp_path / f'test_hash_files_{i}.txt')
+        files[-1].write_text(str(i) * i)
+
+    assert utils.hash_files(files, workers=4) == \
+        [utils.md5sum(file) for file in files]
+    assert utils.hash_files([]) == []